@@ -1,18 +1,12 @@
 # This file is executed on every boot (including wake-boot from deepsleep)
 #import esp
 #esp.osdebug(1)
-import network
-wlan = network.WLAN(network.STA_IF)
-wlan.active(True)
-wlan.config(dhcp_hostname="NFC_Door")
-if not wlan.isconnected():
-    print('connecting to network...')
-    
-    wlan.connect('WIFI_Name', 'WIFI_Password')
-    while not wlan.isconnected():
-        pass
-print('network config:', wlan.ifconfig())
+#The Wi-Fi associates in the background while main.py sets up reader, keypad and LEDs, main.py
+#waits for the link before the first tap. AP and DHCP lease are cached (fastboot.py), a restart
+#after a watchdog reset is back on the network in a fraction of a second
+import fastboot
+fastboot.connect('WIFI_Name', 'WIFI_Password', hostname="NFC_Door")
+wlan = fastboot.wlan
 
 #import webrepl
 #webrepl.start()
-
@@ -0,0 +1,98 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# The stage1 parameters (anti-tamper block, its read key and length) of the tags that were tapped
+# here lately. A known tag skips stage1: the reader reads the block right away and goes on with
+# stage2/sess2, one request less per tap. auth.php still checks the tag and the device there and
+# answers "forget" when the parameters must not be used anymore (tag unknown, due for a reset or
+# not allowed on this device). An entry is also dropped after ttl_s, the least recently used one
+# when the cache is full.
+# With a path the entries survive a reset in a json file on flash. It is only written when an
+# entry is added, changed or dropped, not on every tap.
+
+import time
+import ubinascii
+import ujson
+
+
+class CardCache:
+    """stage1 parameters by uid, least recently used first."""
+
+    def __init__(self, size=16, ttl_s=86400, path=None):
+        self.size = size
+        self.ttl_s = ttl_s
+        self.path = path
+        self.cards = {}     #uid -> [antiblk, key (hex), len, time.time() the server sent them]
+        self.order = []     #uids, least recently used first
+        if path is None:
+            return
+        try:
+            with open(path) as f:
+                d = ujson.load(f)
+            self.cards = d["cards"]
+            self.order = d["order"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _save(self):
+        if self.path is None:
+            return
+        try:
+            with open(self.path, "w") as f:
+                ujson.dump({"cards": self.cards, "order": self.order}, f)
+        except OSError:
+            pass
+
+    def _drop(self, uid):
+        if uid in self.cards:
+            self.order.remove(uid)
+            del self.cards[uid]
+            return True
+        return False
+
+    def __contains__(self, uid):
+        return uid in self.cards
+
+    def put(self, uid, antiblk, key, length):
+        """Parameters from a stage1/sess3 answer, key as hex text (JSON) or bytes (CBOR)."""
+        if isinstance(key, bytes):
+            key = ubinascii.hexlify(key).decode()
+        c = self.cards.get(uid)
+        changed = c is None or c[0] != antiblk or c[1] != key or c[2] != length
+        self._drop(uid)
+        self.cards[uid] = [antiblk, key, length, time.time()]
+        self.order.append(uid)
+        while len(self.order) > self.size:
+            self._drop(self.order[0])
+        if changed:
+            self._save()
+
+    def get(self, uid):
+        """(antiblk, key, len) for uid, None if there is none or it is older than ttl_s."""
+        c = self.cards.get(uid)
+        if c is None:
+            return None
+        #a clock that went back (power cycle before NTP) also ends the entry
+        if not 0 <= time.time() - c[3] < self.ttl_s:
+            self.forget(uid)
+            return None
+        self.order.remove(uid)
+        self.order.append(uid)
+        return c[0], c[1], c[2]
+
+    def forget(self, uid):
+        """Drop the entry of uid, e.g. when the server answered "forget" or the block read failed."""
+        if self._drop(uid):
+            self._save()
+
+    def clear(self):
+        self.cards = {}
+        self.order = []
+        self._save()
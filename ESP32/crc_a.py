@@ -0,0 +1,42 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# CRC_A of ISO/IEC 14443-3 (CRC-16/ISO-IEC-14443-3-A: reflected poly 0x8408, preset 0x6363),
+# the checksum every MIFARE command except REQA/WUPA/anticollision carries.
+# Computing it here saves the MFRC522 coprocessor round trip (FIFO load, CalcCRC, polling
+# DivIrqReg, reading the result) for each frame. Plain Python, runs the same on a PC.
+
+from array import array
+
+PRESET = 0x6363
+
+
+def _table():
+    t = array("H", bytes(512))
+    for i in range(256):
+        c = i
+        for _ in range(8):
+            c = (c >> 1) ^ 0x8408 if c & 1 else c >> 1
+        t[i] = c
+    return t
+
+
+TABLE = _table()
+
+
+def crc_a(data, start=0, end=None):
+    """CRC_A of data[start:end] as int, it goes on the air low byte first."""
+    if end is None:
+        end = len(data)
+    t = TABLE
+    crc = PRESET
+    for i in range(start, end):
+        crc = (crc >> 8) ^ t[(crc ^ data[i]) & 0xFF]
+    return crc
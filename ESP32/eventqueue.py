@@ -0,0 +1,126 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# Notifications for auth.php that need no answer during the tap (a Chinese UID, a tag seen while
+# the server could not be reached, the close of a long tap). main.py queues them and goes on,
+# they are sent in batches ("events" command) when the reader is idle. A batch that does not get
+# through is tried again after retry_ms, the pause doubles with every failure up to max_retry_ms.
+# The queue holds size events, a full queue drops the oldest one. With a path every event is also
+# appended to that file on flash, what was not sent yet is read back after a reset.
+# Each event carries the time it happened ("t") and the id of the start it happened in ("b"). The
+# clock may have started over since, so auth.php only dates events of the start that sends them.
+
+import os
+import time
+import ujson
+
+
+class EventQueue:
+    """The last size events (dicts), oldest first."""
+
+    def __init__(self, size=16, path=None, retry_ms=2000, max_retry_ms=60000):
+        self.ring = [None] * size
+        self.head = 0       #index of the oldest event
+        self.count = 0
+        self.dropped = 0    #events lost to a full queue
+        self.path = path
+        self.lines = 0      #lines in the file, it is written anew when it holds too many sent ones
+        self.retry_ms = retry_ms
+        self.max_retry_ms = max_retry_ms
+        self.pause = retry_ms
+        self.next_try = time.ticks_ms()
+        #random id of this start, "t" of events with another one is from a clock that may have started over
+        self.boot = int.from_bytes(os.urandom(4), "big") >> 1
+        if path is None:
+            return
+        try:
+            with open(path) as f:
+                for l in f:
+                    self.lines += 1
+                    try:
+                        self._add(ujson.loads(l))
+                    except ValueError:
+                        pass    #the line being written when the power went
+        except OSError:
+            pass
+        if self.lines > self.count:
+            self._save()
+
+    def _add(self, ev):
+        size = len(self.ring)
+        if self.count == size:
+            self.head = (self.head + 1) % size
+            self.count -= 1
+            self.dropped += 1
+        self.ring[(self.head + self.count) % size] = ev
+        self.count += 1
+
+    def _save(self):
+        #the file holds exactly the events that are not sent yet, there is none while nothing waits
+        if self.path is None:
+            return
+        self.lines = 0
+        try:
+            if not self.count:
+                os.remove(self.path)
+                return
+            with open(self.path, "w") as f:
+                for ev in self.batch(self.count):
+                    f.write(ujson.dumps(ev) + "\n")
+            self.lines = self.count
+        except OSError:
+            pass
+
+    def put(self, ev):
+        """Queue an event, it gets the time it happened in "t" and the start in "b"."""
+        ev["t"] = int(time.time())
+        ev["b"] = self.boot
+        self._add(ev)
+        if self.path is None:
+            return
+        if self.lines >= 2 * len(self.ring):
+            self._save()
+            return
+        try:
+            with open(self.path, "a") as f:
+                f.write(ujson.dumps(ev) + "\n")
+            self.lines += 1
+        except OSError:
+            pass
+
+    def batch(self, n):
+        """Up to n of the oldest events, they stay queued until sent() is called."""
+        size = len(self.ring)
+        return [self.ring[(self.head + i) % size] for i in range(min(n, self.count))]
+
+    def sent(self, n):
+        """The server took the n oldest events."""
+        size = len(self.ring)
+        n = min(n, self.count)
+        for i in range(n):
+            self.ring[(self.head + i) % size] = None
+        self.head = (self.head + n) % size
+        self.count -= n
+        self.pause = self.retry_ms
+        self.next_try = time.ticks_ms()
+        self._save()
+
+    def failed(self):
+        """The batch did not get through, wait a bit longer before the next one."""
+        self.next_try = time.ticks_add(time.ticks_ms(), self.pause)
+        self.pause = min(self.pause * 2, self.max_retry_ms)
+
+    def wait_ms(self):
+        """ms until the next batch may go, 0 = now."""
+        return max(0, time.ticks_diff(self.next_try, time.ticks_ms()))
+
+    def due(self):
+        """Events are waiting and the pause after a failure is over."""
+        return self.count > 0 and self.wait_ms() == 0
@@ -0,0 +1,203 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# Fast start of the door after power-on and above all after a watchdog reset. boot.py only starts
+# the Wi-Fi association (connect()), main.py sets up reader, keypad and LEDs while the radio
+# associates and waits for the link (wait()) right before the first tap.
+# A link that came up is remembered for the next start: BSSID and channel in NVS (kept across
+# power cycles), the DHCP lease in RTC memory (kept across resets, not across power cycles).
+# The next association then skips the scan of all channels and the DHCP exchange. If the cached
+# AP does not answer the association starts over with a scan and DHCP.
+# A reused lease is a static address the DHCP server knows nothing about: renew() hands it back to
+# DHCP once half of lease_s is over (like a DHCP client renews at T1), before the server can give
+# the address to another host.
+
+import time
+import machine
+import network
+
+try:
+    import esp32
+except ImportError:
+    esp32 = None
+
+NVS_NAMESPACE = "fastboot"
+LEASE_MAGIC = b"FB1"
+
+wlan = None
+t_connect = 0   #ticks_ms when connect() started the association (~ time from reset to boot.py)
+t_up = None     #ticks_ms when the link was up
+how = "-"       #"lease": cached AP and address, "ap": cached AP and DHCP, "scan": no cache, "up": already connected
+_ssid = None
+_key = None
+_ap = None      #(bssid, channel) the association was started with, None = left to the Wi-Fi driver
+_lease_s = 0
+_lease_t = None #time.time() the reused lease was got, None = DHCP runs (or no link yet)
+_renewing = False
+
+
+def cached_ap():
+    """(bssid, channel) of the last good association, None if there is none."""
+    try:
+        buf = bytearray(7)
+        esp32.NVS(NVS_NAMESPACE).get_blob("ap", buf)
+        return bytes(buf[:6]), buf[6]
+    except (OSError, AttributeError):
+        return None
+
+
+def cached_lease():
+    """(time it was got, ifconfig()) of the last DHCP lease if it survived a reset (not a power cycle)
+    and is younger than lease_s."""
+    if not _lease_s or machine.reset_cause() == machine.PWRON_RESET:
+        return None
+    m = machine.RTC().memory()
+    if not m.startswith(LEASE_MAGIC):
+        return None
+    t = int.from_bytes(m[3:7], "big")
+    if not 0 <= time.time() - t < _lease_s:
+        return None
+    try:
+        cfg = tuple(m[7:].decode().split(" "))
+    except ValueError:
+        return None
+    return (t, cfg) if len(cfg) == 4 else None
+
+
+def forget():
+    """Drop the cached AP and lease, e.g. after moving the door to another network."""
+    try:
+        nvs = esp32.NVS(NVS_NAMESPACE)
+        nvs.erase_key("ap")
+        nvs.commit()
+    except (OSError, AttributeError):
+        pass
+    machine.RTC().memory(b"")
+
+
+def _scan():
+    #strongest AP of the network, a full scan like the one connect() would do without a BSSID
+    best = None
+    for ssid, bssid, channel, rssi, security, hidden in wlan.scan():
+        if ssid.decode() == _ssid and (best is None or rssi > best[2]):
+            best = (bssid, channel, rssi)
+    return best[:2] if best is not None else None
+
+
+def _associate(ap):
+    global _ap
+    _ap = ap
+    if ap is None:
+        wlan.connect(_ssid, _key)
+        return
+    try:
+        wlan.config(channel=ap[1])
+    except (OSError, ValueError):
+        pass
+    wlan.connect(_ssid, _key, bssid=ap[0])
+
+
+def connect(ssid, key, hostname=None, lease_s=3600):
+    """Start the association and return right away. lease_s: how long a DHCP lease is reused
+    without asking the DHCP server (keep it below the lease time of the network), 0 = never."""
+    global wlan, t_connect, how, _ssid, _key, _lease_s, _lease_t
+    _ssid = ssid
+    _key = key
+    _lease_s = lease_s
+    t_connect = time.ticks_ms()
+    wlan = network.WLAN(network.STA_IF)
+    wlan.active(True)
+    if hostname:
+        wlan.config(dhcp_hostname=hostname)
+    if wlan.isconnected():
+        how = "up"
+        return
+    ap = cached_ap()
+    if ap is None:
+        #first start: the scan blocks for a moment, but it tells us what to cache
+        how = "scan"
+        _associate(_scan())
+        return
+    lease = cached_lease()
+    if lease is not None:
+        #static address, the link is usable as soon as the association is done
+        _lease_t = lease[0]
+        wlan.ifconfig(lease[1])
+    how = "lease" if lease is not None else "ap"
+    _associate(ap)
+
+
+def _remember():
+    #the link is up: keep AP and address for the next start. NVS (flash) is only written on a change
+    if _ap is not None:
+        try:
+            ap = (_ap[0], wlan.config("channel"))
+        except (OSError, ValueError):
+            ap = _ap
+        if ap != cached_ap():
+            try:
+                nvs = esp32.NVS(NVS_NAMESPACE)
+                nvs.set_blob("ap", ap[0] + bytes([ap[1]]))
+                nvs.commit()
+            except (OSError, AttributeError):
+                pass
+    if _lease_t is None and _lease_s:
+        machine.RTC().memory(LEASE_MAGIC + int(time.time()).to_bytes(4, "big") + " ".join(wlan.ifconfig()).encode())
+
+
+def wait(timeout_ms, feed=None, retry_ms=4000):
+    """Wait until the link is up (True) or timeout_ms after connect() (False, the door works without
+    the server for now). If the cached AP did not bring the link up within retry_ms the association
+    starts over with a scan and DHCP, the cache is replaced once that works. feed() is called while
+    waiting (watchdog)."""
+    global t_up, how, _lease_t
+    if wlan is None:
+        return False
+    while not wlan.isconnected():
+        if feed is not None:
+            feed()
+        waited = time.ticks_diff(time.ticks_ms(), t_connect)
+        if waited > timeout_ms:
+            return False
+        if how in ("ap", "lease") and (waited > retry_ms or wlan.status() in (network.STAT_NO_AP_FOUND, network.STAT_WRONG_PASSWORD)):
+            wlan.disconnect()
+            wlan.ifconfig("dhcp")
+            _lease_t = None
+            how = "scan"
+            _associate(_scan())
+        time.sleep_ms(10)
+    if t_up is None:
+        t_up = time.ticks_ms()
+        _remember()
+    return True
+
+
+def renew():
+    """Call it now and then while the door is idle: once half of lease_s of a reused lease is over, DHCP
+    takes over again (the address is gone for a moment) and its lease is cached for the next start.
+    True while DHCP is running."""
+    global _lease_t, _renewing
+    if _renewing:
+        if wlan.ifconfig()[0] == "0.0.0.0":
+            return True
+        _renewing = False
+        _remember()
+        return False
+    if _lease_t is None or t_up is None or time.time() - _lease_t < _lease_s // 2:
+        return False
+    _lease_t = None
+    _renewing = True
+    wlan.ifconfig("dhcp")
+    return True
+
+
+def assoc_ms():
+    """Time the association took, None while it is not done."""
+    return None if t_up is None else time.ticks_diff(t_up, t_connect)
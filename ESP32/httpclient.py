@@ -0,0 +1,445 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# Minimal HTTP/1.1 client that keeps one (TLS) connection to the auth server open.
+# urequests does a full TCP + TLS handshake for every single request, on an ESP32
+# that is by far the biggest part of the time a tap takes.
+
+import usocket
+
+try:
+    import ussl
+except ImportError:
+    ussl = None
+import time
+
+ETIMEDOUT = 110
+
+
+def split_url(url):
+    proto, _, host, path = url.split("/", 3)
+    if proto == "https:":
+        port = 443
+    elif proto == "http:":
+        port = 80
+    else:
+        raise ValueError("Unsupported protocol: " + proto)
+    if ":" in host:
+        host, port = host.split(":", 1)
+        port = int(port)
+    return proto == "https:", host, port, "/" + path
+
+
+def request_head(path, host, content_type, length):
+    return ("POST %s HTTP/1.1\r\nHost: %s\r\nConnection: keep-alive\r\nContent-Type: %s\r\nContent-Length: %d\r\n\r\n"
+            % (path, host, content_type, length)).encode()
+
+
+def parse_header(line):
+    name, _, value = line.partition(b":")
+    return name.strip().lower(), value.strip().lower()
+
+
+class Response:
+
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+    @property
+    def text(self):
+        return str(self.content, "utf-8")
+
+    def json(self):
+        import ujson
+        return ujson.loads(self.content)
+
+    def close(self):
+        #body is always read completely, the connection stays with the client
+        pass
+
+
+class HTTPClient:
+
+    def __init__(self, url, timeout=5, keepalive_ms=4000):
+        self.tls, self.host, self.port, self.path = split_url(url)
+        self.timeout = timeout
+        #idle time after which the server has most likely closed the connection
+        #(apache KeepAliveTimeout defaults to 5 seconds), we reconnect instead of trying
+        self.keepalive_ms = keepalive_ms
+        self.sock = None
+        self.body = None    #Body of the last response, the connection is busy until it is read
+        self.last_used = 0
+        self.hits = 0       #requests sent over an already open connection
+        self.misses = 0     #requests that needed a new connection (TCP + TLS handshake)
+        self.reconnects = 0 #kept connections that turned out to be stale
+        self.unsent = False #the last request surely did not reach the server, safe to send again
+
+    def connect(self):
+        """Open the connection now, e.g. while the reader is busy with the tag anyway."""
+        if self.sock is None:
+            ai = usocket.getaddrinfo(self.host, self.port, 0, usocket.SOCK_STREAM)[0]
+            s = usocket.socket(ai[0], usocket.SOCK_STREAM, ai[2])
+            try:
+                s.settimeout(self.timeout)
+                s.connect(ai[-1])
+                if self.tls:
+                    s = ussl.wrap_socket(s, server_hostname=self.host)
+            except:
+                s.close()
+                raise
+            self.sock = s
+            self.last_used = time.ticks_ms()
+            return True
+        return False
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+    def post(self, data, content_type="application/json"):
+        """POST data to the url, returns a Response with the whole body read."""
+        body = self.stream(data, content_type)
+        return Response(body.status_code, body.read())
+
+    def stream(self, data, content_type="application/json"):
+        """POST data to the url, returns the Body as soon as the headers are in."""
+        if self.sock is not None and (time.ticks_diff(time.ticks_ms(), self.last_used) > self.keepalive_ms
+                                      or self.body is not None and not self.body.done):
+            #idle for too long or the last body was abandoned halfway, its rest would be read as our answer
+            self.close()
+        reused = not self.connect()
+        if reused:
+            self.hits += 1
+        else:
+            self.misses += 1
+        try:
+            return self._open(data, content_type)
+        except OSError as e:
+            self.close()
+            #sent again only if the server cannot have processed it: the send failed or the connection
+            #ended before a byte of the answer. A timeout or a reset while waiting may come after it did,
+            #a second stage2/sess2 would turn the anti-tamper block twice.
+            if not reused or not self.unsent or e.args[0] == ETIMEDOUT:
+                raise
+        except:
+            self.close()
+            raise
+        #the kept connection was closed by the server in the meantime, the request never got processed
+        self.reconnects += 1
+        self.connect()
+        try:
+            return self._open(data, content_type)
+        except:
+            self.close()
+            raise
+
+    def _open(self, data, content_type):
+        if isinstance(data, str):
+            data = data.encode()
+        s = self.sock
+        self.unsent = True
+        s.write(request_head(self.path, self.host, content_type, len(data)))
+        s.write(data)
+        self.unsent = False
+
+        line = s.readline()
+        if not line:
+            #closed without answering: a kept connection the server closed before the request came in
+            self.unsent = True
+            raise OSError("connection closed")
+        status = int(line.split(None, 2)[1])
+        length = -1
+        chunked = False
+        keep = True
+        while True:
+            line = s.readline()
+            if not line or line == b"\r\n":
+                break
+            name, value = parse_header(line)
+            if name == b"content-length":
+                length = int(value)
+            elif name == b"transfer-encoding" and value == b"chunked":
+                chunked = True
+            elif name == b"connection" and value == b"close":
+                keep = False
+        self.body = Body(self, status, length, chunked, keep)
+        return self.body
+
+
+class Body:
+    """Response body that is read from the socket piece by piece as it arrives.
+
+    The connection belongs to the body until it is read to the end (read(), readline()
+    returning b"" or close()), only then the client can send the next request.
+    """
+
+    def __init__(self, client, status, length, chunked, keep):
+        self.client = client
+        self.status_code = status
+        self.chunked = chunked
+        #bytes left of the body (content-length) or of the current chunk, -1 = until the server closes
+        self.left = 0 if chunked else length
+        self.keep = keep
+        self.done = False
+        self.buf = b""
+
+    def _more(self):
+        try:
+            return self._recv()
+        except:
+            self.client.close()
+            self.done = True
+            raise
+
+    def _recv(self):
+        s = self.client.sock
+        if self.chunked and self.left == 0:
+            self.left = int(s.readline().split(b";", 1)[0], 16)
+            if self.left == 0:
+                #trailer headers until the empty line
+                while s.readline() not in (b"\r\n", b""):
+                    pass
+                return self._end()
+        if self.left == 0:
+            return self._end()
+        d = s.read(256 if self.left < 0 or self.left > 256 else self.left)
+        if not d:
+            if self.left > 0:
+                raise OSError("connection closed")
+            #no length: the body ends when the server closes the connection
+            self.keep = False
+            return self._end()
+        if self.left > 0:
+            self.left -= len(d)
+            if self.chunked and self.left == 0:
+                s.readline()
+        return d
+
+    def _end(self):
+        self.done = True
+        if self.keep:
+            self.client.last_used = time.ticks_ms()
+        else:
+            self.client.close()
+        return b""
+
+    def readline(self):
+        """Next line of the body including the newline, b"" at the end."""
+        while b"\n" not in self.buf and not self.done:
+            self.buf += self._more()
+        i = self.buf.find(b"\n") + 1 or len(self.buf)
+        line = self.buf[:i]
+        self.buf = self.buf[i:]
+        return line
+
+    def read(self):
+        """The rest of the body."""
+        while not self.done:
+            self.buf += self._more()
+        d = self.buf
+        self.buf = b""
+        return d
+
+    def readsome(self):
+        """Whatever has arrived of the body so far (at least one byte), b"" at the end."""
+        while not self.buf and not self.done:
+            self.buf = self._more()
+        d = self.buf
+        self.buf = b""
+        return d
+
+    def unread(self, data):
+        """Put data back in front of the rest of the body, e.g. what follows a parsed item."""
+        self.buf = data + self.buf
+
+    def close(self):
+        """Skip the rest of the body, the connection is ready for the next request."""
+        while not self.done:
+            self._more()
+        self.buf = b""
+
+
+class AsyncHTTPClient:
+    """Same as HTTPClient on uasyncio streams, the other tasks keep running while a request is in flight."""
+
+    def __init__(self, url, timeout=5, keepalive_ms=4000):
+        self.tls, self.host, self.port, self.path = split_url(url)
+        self.timeout = timeout
+        self.keepalive_ms = keepalive_ms
+        self.reader = None
+        self.writer = None
+        self.body = None
+        self.last_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.reconnects = 0
+        self.unsent = False
+
+    async def connect(self):
+        import uasyncio as asyncio
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.wait_for_ms(
+                asyncio.open_connection(self.host, self.port, ssl=self.tls), self.timeout * 1000)
+            self.last_used = time.ticks_ms()
+            return True
+        return False
+
+    async def close(self):
+        if self.writer is not None:
+            w = self.writer
+            self.reader = self.writer = None
+            try:
+                w.close()
+                await w.wait_closed()
+            except OSError:
+                pass
+
+    async def post(self, data, content_type="application/json"):
+        body = await self.stream(data, content_type)
+        return Response(body.status_code, await body.read())
+
+    async def stream(self, data, content_type="application/json"):
+        import uasyncio as asyncio
+        if self.writer is not None and (time.ticks_diff(time.ticks_ms(), self.last_used) > self.keepalive_ms
+                                        or self.body is not None and not self.body.done):
+            await self.close()
+        reused = not await self.connect()
+        if reused:
+            self.hits += 1
+        else:
+            self.misses += 1
+        try:
+            return await asyncio.wait_for_ms(self._open(data, content_type), self.timeout * 1000)
+        except asyncio.TimeoutError:
+            #first: on CPython (emulator) it is an OSError. The server may have processed the request already.
+            await self.close()
+            raise
+        except OSError:
+            await self.close()
+            if not reused or not self.unsent:
+                raise
+        except:
+            await self.close()
+            raise
+        self.reconnects += 1
+        await self.connect()
+        try:
+            return await asyncio.wait_for_ms(self._open(data, content_type), self.timeout * 1000)
+        except:
+            await self.close()
+            raise
+
+    async def _open(self, data, content_type):
+        if isinstance(data, str):
+            data = data.encode()
+        r = self.reader
+        w = self.writer
+        self.unsent = True
+        w.write(request_head(self.path, self.host, content_type, len(data)))
+        w.write(data)
+        await w.drain()
+        self.unsent = False
+
+        line = await r.readline()
+        if not line:
+            self.unsent = True
+            raise OSError("connection closed")
+        status = int(line.split(None, 2)[1])
+        length = -1
+        chunked = False
+        keep = True
+        while True:
+            line = await r.readline()
+            if not line or line == b"\r\n":
+                break
+            name, value = parse_header(line)
+            if name == b"content-length":
+                length = int(value)
+            elif name == b"transfer-encoding" and value == b"chunked":
+                chunked = True
+            elif name == b"connection" and value == b"close":
+                keep = False
+        self.body = AsyncBody(self, status, length, chunked, keep)
+        return self.body
+
+
+class AsyncBody(Body):
+    """Body of an AsyncHTTPClient response, every read waits at most the client timeout."""
+
+    async def _more(self):
+        import uasyncio as asyncio
+        try:
+            return await asyncio.wait_for_ms(self._recv(), self.client.timeout * 1000)
+        except:
+            await self.client.close()
+            self.done = True
+            raise
+
+    async def _recv(self):
+        r = self.client.reader
+        if self.chunked and self.left == 0:
+            self.left = int((await r.readline()).split(b";", 1)[0], 16)
+            if self.left == 0:
+                while (await r.readline()) not in (b"\r\n", b""):
+                    pass
+                return await self._end()
+        if self.left == 0:
+            return await self._end()
+        d = await r.read(256 if self.left < 0 or self.left > 256 else self.left)
+        if not d:
+            if self.left > 0:
+                raise OSError("connection closed")
+            self.keep = False
+            return await self._end()
+        if self.left > 0:
+            self.left -= len(d)
+            if self.chunked and self.left == 0:
+                await r.readline()
+        return d
+
+    async def _end(self):
+        self.done = True
+        if self.keep:
+            self.client.last_used = time.ticks_ms()
+        else:
+            await self.client.close()
+        return b""
+
+    async def readline(self):
+        while b"\n" not in self.buf and not self.done:
+            self.buf += await self._more()
+        i = self.buf.find(b"\n") + 1 or len(self.buf)
+        line = self.buf[:i]
+        self.buf = self.buf[i:]
+        return line
+
+    async def read(self):
+        while not self.done:
+            self.buf += await self._more()
+        d = self.buf
+        self.buf = b""
+        return d
+
+    async def readsome(self):
+        while not self.buf and not self.done:
+            self.buf = await self._more()
+        d = self.buf
+        self.buf = b""
+        return d
+
+    async def close(self):
+        while not self.done:
+            await self._more()
+        self.buf = b""
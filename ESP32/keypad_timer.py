@@ -9,6 +9,8 @@ Notes
         - `for x in [list]` loop can NOT be used as an iterator object is allocated.
            NOTE: may not be true for newer versions of MicroPython !!
         - `for x in range(y)` is ok.
+        - Strings can not be built, key presses go into a `bytearray` ring
+          buffer as key codes and get_key() turns them into characters.
 
     * To run type:
         >>> import keypad_timer
@@ -49,148 +51,252 @@ from machine import Timer
 #except ImportError :
 #    from pyb import Timer
 
+from machine import SLEEP
+
 #!============================================================================
 
 class Keypad_Timer () :
     """
     Class to scan a Keypad matrix (e.g. 16-keys as 4x4 matrix) and report
-    last key press.
+    key presses in the order they happened.
     """
 
-    #! Key states
-    KEY_UP      = const( 0 )
-    KEY_DOWN    = const( 1 )
+    #! Size of the key event ring buffer, must be a power of 2.
+    RING_SIZE   = const( 32 )
 
     #-------------------------------------------------------------------------
 
-    def __init__ ( self,pins_row,pins_col ) :
-        self.init(pins_row=pins_row,pins_col=pins_col)
+    def __init__ ( self,pins_row,pins_col,idle_ms=None ) :
+        self.init(pins_row=pins_row,pins_col=pins_col,idle_ms=idle_ms)
 
     #-------------------------------------------------------------------------
 
-    def init ( self,pins_row,pins_col ) :
-        """Initialise/Reinitialise the instance."""
-
-        keys = [
-                '1', '2', '3', 'A',
-                '4', '5', '6', 'B',
-                '7', '8', '9', 'C',
-                '*', '0', '#', 'D',
-               ]
+    def init ( self,pins_row,pins_col,idle_ms=None ) :
+        """
+        Initialise/Reinitialise the instance.
+        idle_ms: stop scanning after this long without a key down and wait for a
+        column pin interrupt instead. None = scan all the time.
+        """
 
-        #! Initialise all keys to the UP state.
-        self.keys = [ { 'char' : key, 'state' : self.KEY_UP } for key in keys ]
+        #! Key code (row * columns + column) -> character.
+        self.chars = '123A456B789C*0#D'
 
         #! Pin names for rows and columns.
         self.rows = pins_row # [ 'PD1', 'PD3', 'PD5', 'PD7' ]
         self.cols = pins_col # [ 'PD9', 'PD11', 'PD13', 'PD15' ]
+        self.ncols = len( self.cols )
 
-        #! Initialise row pins as outputs.
-        self.row_pins = [ Pin(pin_name, mode=Pin.OUT) for pin_name in self.rows ]
+        #! Initialise row pins as outputs, all rows low until the scan asserts them.
+        self.row_pins = [ Pin(pin_name, mode=Pin.OUT, value=0) for pin_name in self.rows ]
 
         #! Initialise column pins as inputs.
         self.col_pins = [ Pin(pin_name, mode=Pin.IN, pull=Pin.PULL_DOWN) for pin_name in self.cols ]
 
         self.timer = Timer(5)
-        
-        
-        #self.timer.callback( None )
+        #! Bound methods made once, `self.wake` in the timer callback would allocate a new one.
+        self._wake_cb = self.wake
+        self._scan_cb = self.timer_callback
+        self.period = 10
+        self.idle_ms = idle_ms
+        self.quiet = 0      #! ms since a key was down, while scanning
+        self.running = False
+        self.armed = False  #! Waiting for the column interrupt, no scanning.
+        self.wakeups = 0
+
+        self.state = 0      #! Debounced key states, bit set = key down.
+        self.sample = 0     #! Raw state of the previous scan, a key has to read the same twice.
+
+        #! Key press events (key codes). Written only by the timer callback (head),
+        #! read only by get_code() (tail), so neither side needs to disable interrupts.
+        self.ring = bytearray( self.RING_SIZE )
+        self.head = 0
+        self.tail = 0
+        self.overflows = 0  #! Presses dropped because nobody read the buffer.
 
-        self.scan_row = 0
-        self.key_code = None
-        self.key_char = ""
+    #-------------------------------------------------------------------------
+
+    def any ( self ) :
+        """True if there are key presses to read."""
+
+        return self.head != self.tail
 
     #-------------------------------------------------------------------------
 
-    def get_key ( self ) :
-        """Get last key pressed."""
+    def get_code ( self ) :
+        """Next key code in the buffer or -1, does not allocate."""
 
-        key_char = self.key_char
+        if self.tail == self.head :
+            return -1
 
-        self.key_code = None    #! consume last key pressed
-        self.key_char = ""    #! consume last key pressed
+        key_code = self.ring[ self.tail ]
+        self.tail = ( self.tail + 1 ) & ( self.RING_SIZE - 1 )
 
-        return key_char
+        return key_code
 
     #-------------------------------------------------------------------------
 
-    def key_process ( self, key_code, col_pin ) :
-        """Process a key press or release."""
+    def get_key ( self ) :
+        """Get all keys pressed since the last call, "" if none."""
+
+        key_char = ""
+        while self.tail != self.head :
+            key_char += self.chars[ self.get_code() ]
+
+        return key_char
+
+    #-------------------------------------------------------------------------
 
-        key_event = None
+    def put_code ( self, key_code ) :
+        """Append a key press event, drop it if the buffer is full."""
 
-        if col_pin.value() :
-            if self.keys[ key_code ][ 'state' ] == self.KEY_UP :
-                key_event = self.KEY_DOWN
-                self.keys[ key_code ][ 'state' ] = key_event
-        else:
-            if self.keys[ key_code ][ 'state' ] == self.KEY_DOWN :
-                key_event = self.KEY_UP
-                self.keys[ key_code ][ 'state' ] = key_event
+        head = ( self.head + 1 ) & ( self.RING_SIZE - 1 )
+        if head == self.tail :
+            self.overflows += 1
+            return
 
-        return key_event
+        self.ring[ self.head ] = key_code
+        self.head = head
 
     #-------------------------------------------------------------------------
 
-    def scan_row_update(self):
+    def scan ( self ) :
         """
-        Timer interrupt callback to scan next keypad row/column.
-        NOTE: This is a true interrupt and no memory can be allocated !!
+        Read all keys, bit n of the result is set if key code n is down.
+        NOTE: Called from the timer interrupt, no memory can be allocated !!
         """
 
-        #! Deassert row.
-        self.row_pins[ self.scan_row ].value( 0 )
+        sample = 0
+        key_code = 0
+        for row in range( len( self.row_pins ) ) :
+            #! Assert row, read its columns, deassert.
+            self.row_pins[ row ].value( 1 )
+            for col in range( self.ncols ) :
+                if self.col_pins[ col ].value() :
+                    sample |= 1 << ( key_code + col )
+            self.row_pins[ row ].value( 0 )
+            key_code += self.ncols
 
-        #! Next scan row.
-        self.scan_row = ( self.scan_row + 1 ) % len( self.row_pins )
-
-        #! Assert next row.
-        self.row_pins[ self.scan_row ].value( 1 )
+        return sample
 
     #-------------------------------------------------------------------------
 
     def timer_callback ( self, timer ) :
         """
-        Timer interrupt callback to scan next keypad row/column.
+        Timer interrupt callback to scan the keypad.
         NOTE: This is a true interrupt and no memory can be allocated !!
         """
 
-        #print("DEBUG: Keypad.timer_callback()")
-
         #! Can't use `for x in [list]` loop in micropython time callback as memory is allocated
         #! => exception in timer interrupt !!
 
-        #! key code/index for first column of current row
-        key_code = self.scan_row * len( self.cols )
+        sample = self.scan()
+
+        #! Debounce: a key changes state when two scans in a row agree.
+        changed = ( sample ^ self.state ) & ~( sample ^ self.sample )
+        self.sample = sample
+
+        if self.idle_ms is not None :
+            if sample :
+                self.quiet = 0
+            else :
+                self.quiet += self.period
+                if self.quiet >= self.idle_ms and not self.state :
+                    self.timer.deinit()
+                    self.arm()
+
+        if changed :
+            self.state ^= changed
+            pressed = changed & sample
+            key_code = 0
+            while pressed :
+                if pressed & 1 :
+                    self.put_code( key_code )
+                pressed >>= 1
+                key_code += 1
 
-        for col in range( len( self.cols ) ) :
-            #! Process pin state.
-            key_event = self.key_process( key_code, self.col_pins[ col ] )
-            
-            #! Process key event.
-            if key_event == self.KEY_DOWN:
-                self.key_code = key_code
-                self.key_char += self.keys[ key_code ][ 'char' ]
+    #-------------------------------------------------------------------------
 
-            #! Next key code (i.e. for next column)
-            key_code += 1
+    def arm ( self ) :
+        """
+        Idle: all rows high, any key pulls its column up and wakes the scanning.
+        """
 
-        self.scan_row_update()
+        for row in range( len( self.row_pins ) ) :
+            self.row_pins[ row ].value( 1 )
+        for col in range( self.ncols ) :
+            self.col_pins[ col ].irq( trigger=Pin.IRQ_RISING, handler=self._wake_cb )
+        self.armed = True
 
     #-------------------------------------------------------------------------
 
-    def start ( self ) :
-        """Start the timer."""
+    def disarm ( self ) :
+        self.armed = False
+        for col in range( self.ncols ) :
+            self.col_pins[ col ].irq( handler=None )
+        for row in range( len( self.row_pins ) ) :
+            self.row_pins[ row ].value( 0 )
+
+    #-------------------------------------------------------------------------
+
+    def wake ( self, pin ) :
+        """Column interrupt: scan right away, then every period ms until idle again."""
+
+        if not self.running :
+            return
+        self.disarm()
+        self.wakeups += 1
+        self.quiet = 0
+        self.timer_callback( None )
+        self.timer.init(mode=Timer.PERIODIC, period=self.period, callback=self._scan_cb)
+
+    #-------------------------------------------------------------------------
+
+    def idle ( self ) :
+        """True while nothing is scanned: stopped, or waiting for the first key in idle mode."""
+
+        return not self.running or self.armed
+
+    #-------------------------------------------------------------------------
 
-        self.timer.init(mode=Timer.PERIODIC, period=10, callback=self.timer_callback)
+    def sleep_wake ( self, on ) :
+        """
+        While armed: let a key wake the ESP32 from machine.lightsleep() (on=True), the
+        columns are then level triggered wake sources. on=False goes back to the edge
+        interrupt and starts scanning if a key is already down.
+        """
+
+        if not self.armed :
+            return
+        if on :
+            for col in range( self.ncols ) :
+                self.col_pins[ col ].irq( trigger=Pin.WAKE_HIGH, wake=SLEEP )
+        else :
+            self.arm()
+            for col in range( self.ncols ) :
+                if self.col_pins[ col ].value() :
+                    self.wake( None )
+                    return
+
+    #-------------------------------------------------------------------------
+
+    def start ( self ) :
+        """Start the timer (or wait for the first key in idle mode)."""
+
+        if self.running :
+            return
+        self.running = True
+        if self.idle_ms is None :
+            self.timer.init(mode=Timer.PERIODIC, period=self.period, callback=self._scan_cb)
+        else :
+            self.arm()
         #self.timer.callback( self.timer_callback )
 
     #-------------------------------------------------------------------------
 
     def stop ( self ) :
         """Stop the timer."""
+        self.running = False
         self.timer.deinit()
+        if self.idle_ms is not None :
+            self.disarm()
         #self.timer.callback( None )
-
-
-
@@ -0,0 +1,89 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# Status LEDs: a color table, a framebuffer of what the strip shows right now and a timer
+# for blinking/pulsing. The NeoPixel write is bit-banged with interrupts disabled, so it
+# only happens when a pixel really changes, never twice for one color.
+
+from machine import Timer
+
+#frame (one color per pixel) for each status, indexed by the status numbers of main.py
+COLORS = {
+    1: ((255, 255, 255), (255, 255, 255)),  #WHITE
+    2: ((255, 0, 0), (255, 0, 0)),          #RED
+    3: ((0, 0, 255), (0, 0, 255)),          #BLUE
+    4: ((0, 255, 0), (0, 255, 0)),          #GREEN
+    5: ((0, 0, 0), (0, 0, 0)),              #OFF
+    6: ((255, 0, 255), (255, 0, 255)),      #PINK
+    7: ((255, 255, 0), (255, 255, 0)),      #YELLOW
+    8: ((0, 0, 255), (255, 255, 0)),        #BLUEYELL
+    9: ((255, 255, 0), (0, 0, 255)),        #YELLBLUE
+}
+
+
+def dim(frame, level):
+    """frame with every channel scaled to level/255"""
+    return tuple(tuple(c * level // 255 for c in px) for px in frame)
+
+
+class Leds:
+
+    def __init__(self, np, timer_id=2):
+        self.np = np
+        self.shown = [None] * len(np)   #framebuffer: what the strip shows
+        self.timer = Timer(timer_id)
+        self.frames = None              #running pattern
+        self.step = 0
+        self.writes = 0                 #strip writes, for the debug log
+
+    def _show(self, frame):
+        dirty = False
+        for i in range(len(self.shown)):
+            if self.shown[i] != frame[i]:
+                self.np[i] = frame[i]
+                self.shown[i] = frame[i]
+                dirty = True
+        if dirty:
+            self.np.write()
+            self.writes += 1
+
+    def _stop(self):
+        if self.frames is not None:
+            self.timer.deinit()
+            self.frames = None
+
+    def set(self, stat):
+        """Steady color, stops a running pattern."""
+        self._stop()
+        self._show(COLORS[stat])
+
+    def play(self, frames, step_ms):
+        """Loop through frames in the background, step_ms each, until set() or the next play()."""
+        self._stop()
+        self.frames = frames
+        self.step = 0
+        self._show(frames[0])
+        self.timer.init(period=step_ms, mode=Timer.PERIODIC, callback=self._tick)
+
+    def _tick(self, t):
+        frames = self.frames
+        if frames is not None:
+            self.step = (self.step + 1) % len(frames)
+            self._show(frames[self.step])
+
+    def blink(self, a, b, step_ms=500):
+        self.play((COLORS[a], COLORS[b]), step_ms)
+
+    def pulse(self, stat, period_ms=1600, steps=16):
+        """Fade in and out"""
+        half = steps // 2
+        frames = [dim(COLORS[stat], 255 * i // half) for i in range(half)]
+        frames += [dim(COLORS[stat], 255 * (half - i) // half) for i in range(half)]
+        self.play(frames, period_ms // steps)
@@ -8,20 +8,63 @@
 # Licensed under the MIT License
 #---------------------------------------------------
 
+import time
+t_main = time.ticks_ms() #boot timing: ms from reset to main.py, t_imports after the imports
 import mfrc522
 from os import uname
-import time
 import ubinascii
 import ujson
-import urequests
+import httpclient
 import sys
 import machine, neopixel
 import micropython
+from micropython import const
 import keypad_timer
+import offline
+import leds
+import trace
+import wire
+import fastboot
+import ringlog
+import cardcache
+import eventqueue
+t_imports = time.ticks_ms()
 
 #-----------General Config--------------------
 authurl = 'https://your-server/rfid-auth2/auth.php'
 device_id = 'frontdoor' #deviceid used in server's config file to distingush operations for multiple devices
+#the connection to authurl is kept open between requests, set this a bit below the server's keep-alive timeout
+http_keepalive_ms = 4000
+#boot.py starts the Wi-Fi (SSID/password are set there), main.py sets up the hardware meanwhile and then
+#waits at most this long for the link before taking taps (offline grants work without the server)
+wifi_wait_ms = 15000
+
+#Session protocol: fewer round trips per tap (sess2/sess3 in auth.php), NFC+PIN/GAuth saves the
+#separate stage4 request. Set to False for an old auth.php
+useSessionProtocol = True
+#Tags tapped here lately skip stage1: their stage1 parameters are kept (cardcache.py), the tag is read
+#right away and stage2/sess2 is the first request. auth.php checks tag and device there and answers
+#"forget" if they must not be used anymore. An entry is asked for again after card_cache_ttl_s, or at
+#once in the same tap if its key does not read the tag anymore (changed on the server meanwhile).
+#card_cache_file keeps them on flash across resets, None = RAM only. 0 = stage1 on every tap (old auth.php)
+card_cache_size = 16
+card_cache_ttl_s = 86400
+card_cache_file = None
+#Notifications that need no answer (Chinese UID, a tag seen while the server could not be reached, the
+#close of a long tap) are queued and sent in batches while the reader is idle, a batch that does not get
+#through is tried again with a growing pause. A full queue drops the oldest event. event_queue_file
+#keeps the unsent ones on flash across resets (the file only exists while events wait), None = RAM only
+event_queue_size = 16
+event_queue_file = "events.txt"
+event_batch = 8 #events per request
+#Per-tap latency tracing: a timing summary of each tap (detection, tag operations, every server
+#request) goes along with the next request, auth.php appends it to $tap_trace_log. False = the
+#summary is only written to the debug log
+useTrace = True
+#Binary requests and answers (CBOR, see wire.py) instead of JSON: keys and block contents travel as
+#raw bytes, about a third less to send and nothing to unhexlify. Needs cbor.php next to auth.php,
+#an older auth.php is detected on the first request and gets JSON from then on
+useBinaryWire = False
 
 #-----------NeoPixel Config--------------------
 pin_neopixel = 21
@@ -34,6 +77,21 @@ pin_nfc_mosi=13
 pin_nfc_miso=12
 pin_nfc_rst=26
 pin_nfc_cs=27
+#GPIO the MFRC522 IRQ output is wired to. The loop then sleeps until a card answers instead of
+#polling once a second. None = no IRQ line, poll with REQA
+pin_nfc_irq = None
+nfc_irq_rearm_ms = 50 #a card only answers a REQA, so one is sent in the background this often
+#long tap: a tag that stays this long after the tap closes the door, one taken away earlier opens it
+#right away. Meanwhile the tag is woken up every presence_poll_ms to see whether it is still there
+long_tap_ms = 4000
+presence_poll_ms = 20
+#compute the frame checksums (CRC_A) on the ESP32 instead of the MFRC522 coprocessor, saves SPI
+#round trips on every read/write. Checked against the chip at boot, falls back to the chip on mismatch
+useSoftCRC = True
+#more readers on the same SPI bus, e.g. one inside and one outside the door: (cs, rst, device_id)
+#each, the reader above is the first one and reports as device_id. The readers are polled in turn.
+#With pin_nfc_irq the IRQ outputs of all readers go to that one pin (open drain, wired-OR)
+nfc_readers = []
 
 #Message to write on each card, that is readable by any device
 #Use as a welcoming message and tell the people to fuck off
@@ -45,10 +103,45 @@ nfc_writemessage = b"Go Away!         "
 useGoogleAuth = True
 pins_keypad_rows = [ 15, 2, 0, 4 ]
 pins_keypad_cols = [ 16, 17, 5, 18 ]
+#the keypad is only scanned while keys are pressed, after this many ms without a key it waits for a
+#pin interrupt again (the first key wakes it up). None = scan every 10ms all the time
+keypad_idle_ms = 2000
+
+#-----------Offline Config--------------------
+#Door relay/strike wired to the ESP32. Only used while auth.php cannot be reached: a tag that
+#opened the door here before gets in once more with the grant auth.php signed for it, the tap is
+#reported when the server answers again. NFC only users (no PIN/GAuth). None = no offline mode
+pin_offline_relay = None
+offline_relay_ms = 3000 #how long the relay stays on
+offline_grant_key = b'' #same as $offline_grant_key in configuration.php
+offline_cache_size = 16 #tags with a grant stored on flash, the least recently used are dropped
+offline_budget_ms = 1500 #the server gets this long to answer (per socket operation) before a grant is used
+
+#-----------Runtime---------------------------
+#Run card reader, keypad, LEDs and server requests as uasyncio tasks, so the keypad and the LEDs
+#stay responsive while a card waits for the server. False = classic blocking loop
+useAsyncio = False
+nfc_poll_ms = 200 #REQA poll interval of the card task when there is no IRQ line
+#Battery/UPS doors: between two detection windows the MFRC522 sits in soft power-down (field off)
+#and the ESP32 in light sleep, a key press wakes it early. Takes precedence over pin_nfc_irq,
+#blocking loop only (useAsyncio = False)
+useLowPower = False
+lp_poll_ms = 250 #time between detection windows = how long a tag may wait until it is seen
+lp_field_ms = 5 #field on before the REQA, the tag needs a few ms of power to answer
+lp_awake_ms = 5000 #keep the field on this long after a tap, a second tap is seen at once
+#board current in mA (measure your own) to report the average idle current to the debug log
+lp_ma_sleep = 1.5 #light sleep, MFRC522 powered down
+lp_ma_awake = 40 #ESP32 awake, field off
+lp_ma_field = 120 #ESP32 awake, field on
 
 #-----------Debug Mode---------------------------
 #Enable debugmode to print debug messages to the serial console
 debugmode = True
+#What is logged: 0 nothing, 1 errors, 2 and taps/Wi-Fi (info), 3 and every step (debug). Calls above
+#this level are compiled out or return right away, their arguments are never formatted
+log_level = const(2)
+#The last log lines stay in RAM (bytes): logs.dump() on the REPL, auth.php can ask for them ($reader_log_devices), 0 = off
+log_ring_size = 2048
 
 #****************END CONFIG***********************
 from machine import WDT
@@ -63,115 +156,644 @@ YELLOW = 7
 BLUEYELL = 8 #for GAuth after NFC
 YELLBLUE = 9 #for GAuth after NFC
 
-lastled = -1
+card_irq = False
+roundtrips = 0 #requests to the server during the current tap
+cards = None #cardcache.CardCache if card_cache_size is set
+events = None #eventqueue.EventQueue
 defaultkey = [0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF]
 defaultkeystr = b"\xff\xff\xff\xff\xff\xff"
+blockbuf = bytearray(16) #scratch buffer for repeated block reads
+secbuf = bytearray(64) #a whole sector (3 data blocks + trailer) for init/reset
+blockstat = bytearray(64) #status of every block of the last init/reset, see rdr.write_sector()
+grants = None #offline.GrantCache if offline mode is configured
+last_reconcile = 0
+lp_active = 0 #ticks_ms of the last tap, see lp_awake_ms
+lp_held = None #uid of the last tag while it is still in the field
+readers = [] #(MFRC522, device_id) of every reader, rdr and device_id are the ones of the current tap
+reader_next = 0 #index of the reader that is polled first
+card_waiting = -1 #index of a reader that found a tag while the last tap finished
+lp_us = [0, 0, 0] #us spent idle in light sleep, awake with the field off and with the field on
+lp_reported = 0
+wire_cbor = useBinaryWire #False once the server turned out to only read JSON
 
-def log(txt):
+ERROR = const(1)
+INFO = const(2)
+DEBUG = const(3)
+_LOG_ERROR = const(log_level // ERROR) #not 0 if the level is logged, "if _LOG_DEBUG:" compiles out logging that costs by itself
+_LOG_INFO = const(log_level // INFO)
+_LOG_DEBUG = const(log_level // DEBUG)
+logs = ringlog.RingLog(log_ring_size) if log_ring_size and log_level else None
+log_wanted = False #an answer asked for the log lines, they go to the server after the tap
+
+def _log(level, fmt, args):
+    #only called for a level that is logged: the text is made here, not by the caller
+    txt = fmt % args if args else str(fmt)
+    if logs is not None:
+        logs.write("%d %s %s" % (time.ticks_ms(), "-EID"[level], txt))
     if debugmode:
         print(txt)
 
-def init(rdr,answerjs,raw_uid):
-    log("INIT!")
-    log(answerjs)
-    if (answerjs["setantiblk"] != ""):
-        log("initializing sector 0...")
-        if rdr.auth(rdr.AUTHENT1A, 2, defaultkey, raw_uid) == rdr.OK:
-            rdr.write(2, nfc_writemessage)
+def error(fmt, *args):
+    if _LOG_ERROR:
+        _log(ERROR, fmt, args)
 
+def info(fmt, *args):
+    if _LOG_INFO:
+        _log(INFO, fmt, args)
+
+def log(fmt, *args):
+    #debug level, the steps of a tap
+    if _LOG_DEBUG:
+        _log(DEBUG, fmt, args)
+
+def sectors(answerjs,body):
+    #sector data of an init/reset answer. A streamed answer sends one line per sector after the
+    #status line, each sector is written while the next one is still on its way. Older servers
+    #send everything in one document
+    if answerjs.get("stream") and wire_cbor:
+        sec = next_item(body)
+        while sec is not None:
+            yield sec
+            sec = next_item(body)
+    elif answerjs.get("stream"):
+        while True:
+            line = body.readline()
+            if not line:
+                return
+            if line.strip():
+                yield ujson.loads(line)
+    else:
         for i in range(1,16):
-            log("writing sector %s" % i)
-            if rdr.auth(rdr.AUTHENT1A, i*4, defaultkey, raw_uid) == rdr.OK:
-                #log("auth ok")
-                for x in range(0,3):
-                    #write filler data or real hash 
-                    numblk = (i*4)+x
-                    numfiller = ((i-4)*4)+x #Array begins at 0 but blocks begin at 4
-                    if numblk == int(answerjs["setantiblk"]):
-                        log("writing hash to block: %s" % numblk)
-                        rdr.write(int(answerjs["setantiblk"]), answerjs["txt"].encode())
-                    else:
-                        #log("writing filler to block: %s" % numblk)
-                        rdr.write(numblk,answerjs["filler"][numfiller].encode())
+            sec = {"s":i,"keya":answerjs["keya"][i],"keyb":answerjs["keyb"][i]}
+            if "filler" in answerjs:
+                sec["filler"] = [answerjs["filler"][((i-4)*4)+x] for x in range(0,3)] #Array begins at 0 but blocks begin at 4
+            yield sec
+
+def init_sector0(rdr,raw_uid):
+    log("initializing sector 0...")
+    rdr.write_sector(0, nfc_writemessage, defaultkey, raw_uid, rdr.AUTHENT1A, 2, 1)
+
+def sector_failed(i):
+    error("sector %s not written, block status %s", i, bytes(blockstat[i*4:i*4+4]))
+
+def init_sector(rdr,answerjs,sec,raw_uid):
+    #the 3 data blocks (filler data or the real hash) and the trailer with the new keys in one go
+    i = sec["s"]
+    log("writing sector %s", i)
+    hashblk = int(answerjs["setantiblk"]) - i*4
+    for x in range(0,3):
+        secbuf[x*16:x*16+16] = blockbytes(answerjs["txt"] if x == hashblk else sec["filler"][x])[:16]
+    rdr.trailer(secbuf, keybytes(sec["keya"]), rdr.ACCESS_LOCKED, keybytes(sec["keyb"]), 48)
+    if rdr.write_sector(i, secbuf, defaultkey, raw_uid, rdr.AUTHENT1A, status=blockstat) != rdr.OK:
+        sector_failed(i)
 
-                rdr.setKey(i,ubinascii.unhexlify(answerjs["keya"][i]),ubinascii.unhexlify(answerjs["keyb"][i]))
-                log("key set complete")
-            else:
-                log("auth error")
+def reset_sector0(rdr,raw_uid):
+    log("resetting sector 0...")
+    rdr.write_sector(0, bytes(16), defaultkey, raw_uid, rdr.AUTHENT1B, 2, 1)
+
+def reset_sector(rdr,sec,raw_uid):
+    #data blocks back to 0's, the trailer back to the transport configuration
+    i = sec["s"]
+    log("setting key for sector %s", i)
+    for x in range(0,48):
+        secbuf[x] = 0
+    rdr.trailer(secbuf, defaultkeystr, rdr.ACCESS_OPEN, defaultkeystr, 48)
+    if rdr.write_sector(i, secbuf, keybytes(sec["keyb"]), raw_uid, rdr.AUTHENT1B, status=blockstat) != rdr.OK:
+        sector_failed(i)
+
+def init(rdr,answerjs,raw_uid,body=None):
+    log("INIT!")
+    log(answerjs)
+    if (answerjs["setantiblk"] != ""):
+        init_sector0(rdr,raw_uid)
+        for sec in sectors(answerjs,body):
+            init_sector(rdr,answerjs,sec,raw_uid)
     else:
-        log("server response error...")
+        error("server response error...")
 
-def reset(rdr,answerjs,raw_uid):
+def reset(rdr,answerjs,raw_uid,body=None):
     log("RESET!")
     log(answerjs)
-    if (answerjs["keyb"] != ""):
-        log("resetting sector 0...")
-        if rdr.auth(rdr.AUTHENT1B, 2, defaultkey, raw_uid) == rdr.OK:
-            rdr.write(2, b"\x00"*17)
+    if answerjs.get("stream") or answerjs["keyb"] != "":
+        reset_sector0(rdr,raw_uid)
+        for sec in sectors(answerjs,body):
+            reset_sector(rdr,sec,raw_uid)
+    else:
+        error("server response error...")
 
-        for i in range(1,16):
-            log("setting key for sector %s" % i)
-            if rdr.auth(rdr.AUTHENT1B, i*4, [c for c in ubinascii.unhexlify(answerjs["keyb"][i])], raw_uid) == rdr.OK:
-                log("auth ok")
-                #Fill the contents with 0's
-                for x in range(0,3):
-                    numblk = (i*4)+x
-                    rdr.write(numblk,b"\x00"*17)
-                
-                rdr.reSetKeyOpen(i,defaultkeystr,defaultkeystr)
-                log("key reset complete")
-            else:
-                log("auth error")
+def encode(js):
+    #request body and its content type
+    if wire_cbor:
+        return wire.dumps(js), wire.CONTENT_TYPE
+    return ujson.dumps(js), "application/json"
+
+def json_only(answer):
+    #an auth.php without cbor.php cannot read a CBOR request, True if the request has to go again as JSON
+    global wire_cbor
+    if wire_cbor and answer.startswith(b"Received content contained invalid JSON"):
+        info("Server only reads JSON, not using the binary wire")
+        wire_cbor = False
+        return True
+    return False
+
+def parse(r):
+    #the answer of post()
+    return asked_for_log(wire.loads(r.content) if wire.is_cbor(r.content) else r.json())
+
+def asked_for_log(answerjs):
+    #auth.php lists the reader in $reader_log_devices: the log lines go to the server after the tap
+    global log_wanted
+    if answerjs.get("sendlog"):
+        log_wanted = True
+    return answerjs
+
+def send_log():
+    global log_wanted
+    log_wanted = False
+    try:
+        post({"cmd":"log","device_id":device_id,"lines":logs.lines()}).close()
+        logs.clear()
+    except OSError as e:
+        error("Sending the log failed: %s", e)
+
+def notify(ev):
+    #queue a notification for auth.php, the tap goes on right away
+    events.put(ev)
+    if event_flag is not None:
+        event_flag.set()
+
+def close_later(uid, data):
+    #long tap: the proof of the new tag content goes out with the next batch of events, the door
+    #closes then. data: the block read back after the write
+    ev = {"ev":"close","device_id":device_id,"uid":uid,"key":"".join(chr(i) for i in data)}
+    if grant_wanted():
+        #the offline grant has the text the tag carried before, the answer brings one for the new text
+        grants.forget(uid)
+        ev["grant"] = 1
+    notify(ev)
+    log("Door closes with the next events")
+
+def missed_tap(uid):
+    #stage1 did not reach the server: auth.php gets the uid later and logs it if the tag is unknown
+    notify({"ev":"seen","device_id":device_id,"uid":uid})
+
+def events_js():
+    #the oldest queued events in one request, "now" dates the ones of this start ("t" and "b" of each event)
+    return {"cmd":"events","device_id":readers[0][1],"now":int(time.time()),"boot":events.boot,"events":events.batch(event_batch)}
+
+def events_done(js, answerjs):
+    if answerjs.get("status") != "ok":
+        error("Events not taken: %s", answerjs)
+        events.failed()
+        return
+    events.sent(len(js["events"]))
+    log("%s events sent", len(js["events"]))
+    for g in answerjs.get("grants", ()):
+        store_grant({"grant":g,"now":answerjs["now"]})
+
+def send_events():
+    js = events_js()
+    try:
+        r = post(js)
+        answerjs = parse(r)
+        r.close()
+    except (OSError, ValueError) as e:
+        info("Sending events failed: %s", e)
+        events.failed()
+        return
+    events_done(js, answerjs)
+
+def keybytes(v):
+    #a MIFARE key of an answer: hex text in JSON, the 6 bytes themselves in CBOR
+    return v if isinstance(v, bytes) else ubinascii.unhexlify(v)
+
+def blockbytes(v):
+    #block content of an answer: text in JSON, bytes in CBOR
+    return v if isinstance(v, bytes) else v.encode()
+
+def blockdata(data):
+    #block content read from the tag as it goes into a request
+    return bytes(data) if wire_cbor else "".join(chr(i) for i in data)
+
+def next_item(body):
+    #next CBOR item of a streamed answer, None at the end. An item can span several reads, the
+    #bytes after it go back to the body for the next call
+    buf = b""
+    while True:
+        d = body.readsome()
+        if not d:
+            if buf:
+                raise ValueError("answer cut off")
+            return None
+        buf += d
+        if not wire.is_cbor(buf):
+            raise ValueError(buf)
+        try:
+            item, i = wire.decode(buf)
+        except EOFError:
+            continue
+        body.unread(buf[i:])
+        return item
+
+def post(js):
+    global roundtrips
+    roundtrips += 1
+    tracer.attach(js)
+    r = http.post(*encode(js))
+    if json_only(r.content):
+        r = http.post(*encode(js))
+    tracer.sent()
+    return r
+
+def stream(js):
+    #for requests that can be answered with init/reset: the status line is parsed right away,
+    #the sectors follow line by line (see sectors())
+    global roundtrips
+    roundtrips += 1
+    js["stream"] = 1
+    tracer.attach(js)
+    r = http.stream(*encode(js))
+    if wire_cbor:
+        head = r.readsome()
+        if not wire.is_cbor(head):
+            head += r.read()
+            if json_only(head):
+                r = http.stream(*encode(js))
+                head = b""
+        r.unread(head)
+    tracer.sent()
+    if not wire_cbor:
+        return asked_for_log(ujson.loads(r.readline())), r
+    answerjs = asked_for_log(next_item(r))
+    if not answerjs.get("stream"):
+        #nothing follows, read up to the end of the body so the connection can be used again
+        r.close()
+    return answerjs, r
+
+def hexuid(raw_uid):
+    return ubinascii.hexlify(bytes(raw_uid)).decode()
+
+def pick_tag(uids):
+    #several tags in the field at once (a wallet, see rdr.tags()): the tap is about a tag of the
+    #card cache or one with an offline grant, else the first. stage1 may still name another one
+    for u in uids:
+        if cards is not None and hexuid(u) in cards:
+            return u
+    for u in uids:
+        if grants is not None and hexuid(u) in grants.grants:
+            return u
+    return uids[0]
+
+def stage1_js(uid, uids):
+    #the other tags go along in "uids", the server answers for the first one it knows
+    js = {"cmd":"stage1","device_id":device_id,"uid":uid}
+    if len(uids) > 1:
+        js["uids"] = [hexuid(u) for u in uids if hexuid(u) != uid]
+    return js
+
+def cached_stage1(raw_uid, uid):
+    #the stage1 answer for a tag of the card cache, None = ask the server. The block is read into blockbuf
+    #right away ("read"): parameters that do not open the tag anymore are dropped and stage1 asks for the
+    #current ones in the same tap
+    c = cards.get(uid) if cards is not None else None
+    if c is None:
+        return None
+    if rdr.auth(rdr.AUTHENT1A, c[0], keybytes(c[1]), raw_uid) != rdr.OK or rdr.readinto(c[0], blockbuf) != rdr.OK:
+        info("Remembered key does not read %s, asking stage1", uid)
+        cards.forget(uid)
+        #a failed auth leaves the tag halted
+        rdr.stop_crypto1()
+        select_uid(raw_uid)
+        return None
+    log("Known tag, skipping stage1")
+    return {"status":"k","antiblk":c[0],"key":c[1],"len":c[2],"read":1}
+
+def remember_card(uid, answerjs):
+    #stage1 parameters of a stage1/sess3 answer go into the card cache, "forget" or a reset drops them
+    if cards is None:
+        return
+    if "forget" in answerjs or answerjs.get("status") == "reset":
+        cards.forget(uid)
+    elif "antiblk" in answerjs:
+        cards.put(uid, int(answerjs["antiblk"]), answerjs["key"], int(answerjs["len"]))
+
+def forget_card(uid):
+    #the block could not be read with the parameters, stage1 again next time
+    if cards is not None:
+        cards.forget(uid)
+
+def select_uid(raw_uid):
+    #rdr.tags() left every tag halted, wake them and select the one with this uid
+    rdr.detect(rdr.REQALL)
+    return rdr.select_tag(raw_uid)
+
+def picked_tag(uids, answerjs, raw_uid):
+    #the stage1 answer named another tag of the wallet: select that one instead. The raw uid the tap is about
+    for u in uids:
+        if hexuid(u) == answerjs.get("uid") and u is not raw_uid:
+            if select_uid(u) != rdr.OK:
+                answerjs["status"] = "err"
+            return u
+    return raw_uid
+
+def use_reader(i):
+    #the tap happens on reader i: rdr and device_id go with it into the requests
+    global rdr, device_id, reader_next
+    rdr, device_id = readers[i]
+    reader_next = (i + 1) % len(readers)
+
+def poll_readers(irq, skip=None):
+    #REQA on every reader (irq: the answer to the one wait_for_card armed), starting after the reader of
+    #the last tap, so a busy reader cannot starve the others. Index of the reader with a tag or -1
+    n = len(readers)
+    for k in range(n):
+        i = (reader_next + k) % n
+        r = readers[i][0]
+        if r is skip:
+            continue
+        if (r.irq_result() if irq else r.detect(r.REQIDL)) == r.OK:
+            return i
+    return -1
+
+def find_card(irq, skip=None):
+    #True if a reader has a tag (or rest() found one), rdr is that reader then
+    global card_waiting
+    tracer.begin()
+    i = poll_readers(irq, skip) if card_waiting < 0 else card_waiting
+    card_waiting = -1
+    if i < 0:
+        return False
+    use_reader(i)
+    return True
+
+def rest(ms):
+    #show the result of a tap for ms, cut short when a tag shows up on another reader. The LED shows
+    #the result already, queued events go out first
+    global card_waiting
+    start = time.ticks_ms()
+    if events.due():
+        send_events()
+    while card_waiting < 0 and time.ticks_diff(time.ticks_ms(), start) < ms:
+        if len(readers) > 1:
+            card_waiting = poll_readers(False, rdr)
+            if card_waiting >= 0:
+                return
+        time.sleep_ms(nfc_poll_ms)
+
+def grant_wanted():
+    #offline grants are signed for the first reader, its door has the relay
+    return grants is not None and grants.device_id == device_id
+
+def store_grant(answerjs):
+    if grants is not None and "grant" in answerjs:
+        if not grants.put(answerjs["grant"], answerjs["now"]):
+            error("Offline grant rejected")
+
+def offline_tap(raw_uid, uid):
+    #the server did not answer: the tag must carry the text its grant was made for, it gets the
+    #spare text of the grant so a copy of the old content is worthless from now on
+    g = grants.get(uid)
+    if g is None:
+        return False
+    info("Server unreachable, using offline grant for %s", uid)
+    blk = int(g["blk"])
+    rkey = ubinascii.unhexlify(g["rkey"])
+    rdr.stop_crypto1()
+    if rdr.auth(rdr.AUTHENT1A, blk, rkey, raw_uid) != rdr.OK:
+        #a half done exchange can leave the tag waiting for encrypted frames, wake it up again
+        rdr.stop_crypto1()
+        if (rdr.detect(rdr.REQALL) != rdr.OK or rdr.select_tag(raw_uid) != rdr.OK
+                or rdr.auth(rdr.AUTHENT1A, blk, rkey, raw_uid) != rdr.OK):
+            return False
+    if rdr.readinto(blk, blockbuf) != rdr.OK or blockbuf != g["txt"].encode():
+        error("Tag does not match its offline grant")
+        return False
+    if rdr.auth(rdr.AUTHENT1B, blk, ubinascii.unhexlify(g["wkey"]), raw_uid) != rdr.OK:
+        return False
+    otxt = g["otxt"].encode()
+    rdr.write(blk, otxt)
+    #only a tag that really carries the spare text counts as used, otherwise the report would
+    #make auth.php expect a text the tag does not have
+    if rdr.readinto(blk, blockbuf) != rdr.OK or blockbuf != otxt:
+        return False
+    grants.use(uid)
+    relay.value(1)
+    relay_timer.init(period=offline_relay_ms, mode=machine.Timer.ONE_SHOT, callback=lambda t: relay.value(0))
+    info("Opened offline")
+    return True
+
+def offline_fallback(e, raw_uid, uid):
+    #True if the exception was the server not answering and the tag got in with its grant
+    if not grant_wanted() or not isinstance(e, OSError):
+        return False
+    if offline_tap(raw_uid, uid):
+        tracer.lap(trace.OFFLINE)
+        led(np,GREEN)
+        return True
+    return False
+
+def reconcile():
+    #report the offline taps as soon as the server answers again
+    global last_reconcile
+    if grants is None or time.ticks_diff(time.ticks_ms(), last_reconcile) < 10000:
+        return
+    last_reconcile = time.ticks_ms()
+    for uid, otxt in grants.pending():
+        try:
+            r = post({"cmd":"offline","device_id":grants.device_id,"uid":uid,"key":otxt})
+        except OSError:
+            return
+        info("Offline tap of %s reported: %s", uid, parse(r)["status"])
+        grants.reported(uid)
+
+def presence(misses):
+    #one wake-up of the tag after the tap, misses counts the ones in a row that got no answer. A woken
+    #tag ignores the next wake-up (it falls back to IDLE/HALT), so it is only gone after two misses
+    return misses + 1 if rdr.detect(rdr.REQALL) != rdr.OK else 0
+
+def same_tag(raw_uid):
+    #a tag is still there after long_tap_ms: it has to be the one of the tap, select_tag() only gets
+    #an answer from this uid. The first wake-up may hit a tag that answered the last one
+    for _ in range(2):
+        if rdr.detect(rdr.REQALL) == rdr.OK and rdr.select_tag(raw_uid) == rdr.OK:
+            return True
+    return False
+
+def card_held(raw_uid):
+    #long tap: the tag stays in the field for long_tap_ms. A tag taken away is noticed within a few
+    #presence_poll_ms and the tap is an "open" at once
+    rdr.stop_crypto1()
+    start = time.ticks_ms()
+    misses = 0
+    while time.ticks_diff(time.ticks_ms(), start) < long_tap_ms:
+        misses = presence(misses)
+        if misses >= 2:
+            log("Tag taken away after %s ms", time.ticks_diff(time.ticks_ms(), start))
+            return False
+        wdt.feed()
+        time.sleep_ms(presence_poll_ms)
+    return same_tag(raw_uid)
+
+def session_tap(raw_uid, uid, rblock, rkey, read=False):
+    #sess2 checks the tag content and returns the write instruction plus the digits an "open" needs,
+    #sess3 proves the new content got written and opens/closes the door (with the code, if one is needed).
+    #read: the block is in blockbuf already (cached_stage1)
+    if not read and (rdr.auth(rdr.AUTHENT1A, rblock, rkey, raw_uid) != rdr.OK or rdr.readinto(rblock, blockbuf) != rdr.OK):
+        error("auth error sess2! (Card removed or tag changed?)")
+        forget_card(uid)
+        led(np,RED)
+        return
+    tracer.lap(trace.RF)
+    pdata = blockdata(blockbuf)
+    log("Found data: %s", pdata)
+    log("Asking Access Control System (sess2)...")
+    wdt.feed()
+    answerjs, r = stream({"cmd":"sess2","device_id":device_id,"uid":uid,"key":pdata})
+    tracer.lap(trace.STAGE2)
+    log(answerjs)
+    remember_card(uid, answerjs)
+    if answerjs["status"] == "reset":
+        led(np,BLUE)
+        reset(rdr,answerjs,raw_uid,r)
+        tracer.lap(trace.PROVISION)
+        led(np,GREEN)
+        return
+    if answerjs["status"] != "kk":
+        error("sess2 status error (key wrong?)")
+        led(np,RED)
+        return
+    rwriteblock = int(answerjs["setantiblk"])
+    if rdr.auth(rdr.AUTHENT1B, rwriteblock, keybytes(answerjs["key"]), raw_uid) != rdr.OK:
+        error("auth error sess2! (Card removed?)")
+        led(np,RED)
+        return
+    wdt.feed()
+    log(rdr.write(rwriteblock, blockbytes(answerjs["txt"])))
+    data = bytes(rdr.read(rwriteblock))
+    tracer.lap(trace.RF)
+    pdata = blockdata(data)
+    log("Found new data: %s", pdata)
+    led(np,GREEN)
+    cmd = "open"
+    if card_held(raw_uid):
+        #if same tag is still there after some sec, cmd is close (long tap)
+        cmd = "close"
+        led(np,PINK)
+    tracer.lap(trace.HELD)
+    if cmd == "close":
+        close_later(uid, data)
+        return
+    js = {"cmd":"sess3","device_id":device_id,"uid":uid,"key":pdata,"doorcmd":cmd}
+    if grant_wanted():
+        js["grant"] = 1
+    if cmd == "open" and int(answerjs["num"]) > 0:
+        log("Access Control System is Requesting Google Authenticator...")
+        js["gcode"] = get_stage4_gcode(np,int(answerjs["num"]))
+        tracer.lap(trace.CODE)
+    log("Asking Access Control System (sess3) to %s...", cmd)
+    r = post(js)
+    answerjs = parse(r)
+    r.close()
+    tracer.lap(trace.STAGE3)
+    log(answerjs)
+    remember_card(uid, answerjs)
+    store_grant(answerjs)
+    if answerjs["status"] == "done":
+        led(np,GREEN)
+    else:
+        error("sess3 status error (code wrong?)")
+        led(np,RED)
+    log("Finished.. going to sleep...")
+
+def nfc_irq_handler(pin):
+    global card_irq
+    card_irq = True
+    if card_flag is not None:
+        card_flag.set()
+
+def wait_for_card(ms):
+    #sleep up to ms milliseconds, wake up early when the reader raises its IRQ line or a key got pressed
+    global card_irq
+    if card_waiting >= 0:
+        return
+    if useNFC and useLowPower:
+        lowpower_wait()
+        return
+    if not useNFC or pin_nfc_irq is None:
+        machine.idle()
+        time.sleep_ms(ms)
+        return
+    start = time.ticks_ms()
+    while time.ticks_diff(time.ticks_ms(), start) < ms:
+        card_irq = False
+        for i in range(len(readers)):
+            readers[i][0].irq_arm(rdr.REQIDL)
+        armed = time.ticks_ms()
+        while not card_irq and time.ticks_diff(time.ticks_ms(), armed) < nfc_irq_rearm_ms:
+            machine.idle()
+        if card_irq or keypad.any():
+            return
+
+def lp_tag_present():
+    #wake the last tag, check its uid and halt it again, so the REQIDL of do_work keeps ignoring it
+    rdr.stop_crypto1()
+    #a tag still selected from the tap only falls back on the first WUPA, the second one wakes it
+    if rdr.detect(rdr.REQALL) != rdr.OK and rdr.detect(rdr.REQALL) != rdr.OK:
+        return False
+    #select_tag() only gets an answer from the tag with this uid, other tags of a wallet go back to sleep
+    if rdr.select_tag(lp_held) != rdr.OK:
+        return False
+    rdr.halt()
+    return True
+
+def lowpower_wait():
+    #one duty cycle: field off for lp_poll_ms, then on for lp_field_ms so the next detect() can see a tag
+    global lp_reported, lp_held
+    t = time.ticks_us()
+    if lp_held is not None and not lp_tag_present():
+        lp_held = None
+    if lp_held is not None or time.ticks_diff(time.ticks_ms(), lp_active) < lp_awake_ms:
+        #a tag that lost power in the field comes back IDLE and would be taken for a new tap, so the
+        #field stays on while the last one is there (and a little longer for a quick second tap)
+        while time.ticks_diff(time.ticks_us(), t) < lp_poll_ms * 1000 and not keypad.any():
+            machine.idle()
     else:
-        log("server response error...")    
+        for i in range(len(readers)):
+            readers[i][0].power_down()
+        sleep = keypad.idle() and status_leds.frames is None and (grants is None or not relay.value())
+        if sleep:
+            #the timers of the LED patterns and the relay would stop during light sleep, so only if none runs
+            keypad.sleep_wake(True)
+            machine.lightsleep(lp_poll_ms)
+            keypad.sleep_wake(False)
+        else:
+            while time.ticks_diff(time.ticks_us(), t) < lp_poll_ms * 1000 and not keypad.any():
+                machine.idle()
+        now = time.ticks_us()
+        lp_us[0 if sleep else 1] += time.ticks_diff(now, t)
+        t = now
+        for i in range(len(readers)):
+            readers[i][0].power_up()
+        time.sleep_ms(lp_field_ms)
+    lp_us[2] += time.ticks_diff(time.ticks_us(), t)
+
+    if time.ticks_diff(time.ticks_ms(), lp_reported) > 60000:
+        lp_reported = time.ticks_ms()
+        total = sum(lp_us) or 1
+        ma = (lp_us[0] * lp_ma_sleep + lp_us[1] * lp_ma_awake + lp_us[2] * lp_ma_field) / total
+        info("Idle current: %.1f mA average (sleep %d%%, awake %d%%, field %d%%)",
+             ma, lp_us[0] * 100 // total, lp_us[1] * 100 // total, lp_us[2] * 100 // total)
+        lp_us[0] = lp_us[1] = lp_us[2] = 0
 
 def led(np,stat):
+    #the strip is only written when the color changes (see leds.py)
     wdt.feed()
-    if lastled != stat:
-        np[0] = (0, 0, 0)
-        np[1] = (0, 0, 0)
-        np.write()         
-        if stat == WHITE:
-            np[0] = (255, 255, 255)
-            np[1] = (255, 255, 255)
-            np.write()
-        elif stat == RED:
-            np[0] = (255, 0, 0)
-            np[1] = (255, 0, 0)
-            np.write()
-        elif stat == BLUE:
-            np[0] = (0, 0, 255)
-            np[1] = (0, 0, 255)
-            np.write()
-        elif stat == PINK:
-            np[0] = (255, 0, 255)
-            np[1] = (255, 0, 255)
-            np.write()
-        elif stat == GREEN:
-            np[0] = (0, 255, 0)
-            np[1] = (0, 255, 0)
-            np.write()
-        elif stat == YELLOW:
-            np[0] = (255, 255, 0)
-            np[1] = (255, 255, 0)
-            np.write()
-        elif stat == YELLBLUE:
-            np[0] = (255, 255, 0)
-            np[1] = (0, 0, 255)
-            np.write()
-        elif stat == BLUEYELL:
-            np[0] = (0, 0, 255)
-            np[1] = (255, 255, 0)
-            np.write()
-        elif stat == OFF:
-            np[0] = (0, 0, 0)
-            np[1] = (0, 0, 0)
-            np.write()
+    status_leds.set(stat)
 
 def get_stage4_gcode(np,keypadnums):
     log("Keypad Entry Requested...")
     keypad.start()
-    myled = BLUEYELL
+    status_leds.blink(BLUEYELL,YELLBLUE)
     try:
             timecnt = 0
             loopme=True
@@ -184,15 +806,8 @@ def get_stage4_gcode(np,keypadnums):
                     testkey = keypad.get_key()
                     if testkey:
                         key = testkey
-                        log( "keystr: %s" % key )
+                        log("keystr: %s", key)
 
-                    if myled == BLUEYELL:
-                        led(np,YELLBLUE)
-                        myled = YELLBLUE
-                    else:
-                        led(np,BLUEYELL)
-                        myled = BLUEYELL
-            
                     time.sleep(0.5)
                     timecnt+=5
                 else:
@@ -208,14 +823,14 @@ def get_stage4_gcode(np,keypadnums):
                         newkey = keypad.get_key()
                         if newkey:
                             timecnt = 0 #reset abort timer
-                            if newkey == "#" or newkey == "*":
+                            if "#" in newkey or "*" in newkey:
                                 #abort
-                                log( "Key entry aborted with key: %s" % newkey )
+                                log("Key entry aborted with key: %s", newkey)
                                 led(np,OFF)
                                 loopme = False
                             else:
                                 key += newkey
-                                log( "keystr: %s" % key )
+                                log("keystr: %s", key)
                                 led(np,BLUE)
                         time.sleep(0.1)
 
@@ -223,12 +838,13 @@ def get_stage4_gcode(np,keypadnums):
                     #autoabort after 60 seconds no keypress
                     loopme = False
     except Exception as exc:
-        log( "Exception in KeyPad enum: %s " % str( exc ) )
+        error("Exception in KeyPad enum: %s ", exc)
         pass
     keypad.stop()
     return "0"*keypadnums
 
 def do_work():
+    global roundtrips, lp_active, lp_held
 
     log("")
     log("Place card before reader...")
@@ -239,107 +855,129 @@ def do_work():
             wdt.feed()
             led(np,OFF)
             if useNFC:
-                (stat, tag_type) = rdr.request(rdr.REQIDL)
-                if stat == rdr.OK:
+                #REQA (allocation free, keeps the idle loop off the heap) or the answer to the one sent by wait_for_card
+                if find_card(pin_nfc_irq is not None and not useLowPower):
+                    tracer.lap(trace.DETECT)
+                    xfers = rdr.xfers
+                    tag_type = rdr.bits
+                    roundtrips = 0
+                    tap_start = time.ticks_ms()
+                    lp_active = tap_start
                     keypad.stop() #Stop keypad Timer, no presses recorded from here
                     led(np,WHITE)
-                    if not rdr.checkChinaUID():
-                        (stat, raw_uid) = rdr.anticoll()
+                    china = rdr.checkChinaUID()
+                    tracer.lap(trace.CHINA)
+                    uid = "-"
+                    if not china:
+                        uids = rdr.tags()
+                        tracer.lap(trace.ANTICOLL)
 
-                        if stat == rdr.OK:
+                        if uids:
                             wdt.feed()
-                            log("New card detected")
-                            log("  - tag type: 0x%02x" % tag_type)
-                            log("  - uid	 : 0x%02x%02x%02x%02x" %
-                                (raw_uid[0], raw_uid[1], raw_uid[2], raw_uid[3]))
-                            log("")
+                            if _LOG_DEBUG:
+                                log("New card detected")
+                                log("  - tag type: 0x%02x", tag_type)
+                                for u in uids:
+                                    log("  - uid	 : 0x%s", hexuid(u))
+                                log("")
 
-                            if rdr.select_tag(raw_uid) == rdr.OK:
+                            raw_uid = lp_held = pick_tag(uids)
+                            stat = select_uid(raw_uid)
+                            tracer.lap(trace.SELECT)
+                            if stat == rdr.OK:
                                 log("Tag selected")
-                                #stage1
-                                log("Asking Access Control System (stage1)...")
-                                uid = "%02x%02x%02x%02x" % (raw_uid[0], raw_uid[1], raw_uid[2], raw_uid[3]) #ubinascii.hexlify(bytes(raw_uid)).decode('UTF8')
+                                uid = hexuid(raw_uid)
                                 try:
-                                    r = urequests.post(authurl, data = ujson.dumps({"cmd":"stage1","device_id":device_id,"uid":uid}))
-                                    log(r.text)
-                                    answerjs = r.json()
-                                    r.close()
+                                    answerjs = cached_stage1(raw_uid, uid)
+                                    if answerjs is None:
+                                        #stage1
+                                        log("Asking Access Control System (stage1)...")
+                                        try:
+                                            answerjs, r = stream(stage1_js(uid, uids))
+                                        except OSError:
+                                            missed_tap(uid)
+                                            raise
+                                        raw_uid = lp_held = picked_tag(uids, answerjs, raw_uid)
+                                        uid = hexuid(raw_uid)
+                                        remember_card(uid, answerjs)
+                                    tracer.lap(trace.STAGE1)
 
                                     if answerjs["status"] == "k":
                                         log("status ok")
                                         log(answerjs)
                                         wdt.feed()
-                                        rkey = ubinascii.unhexlify(answerjs["key"])
+                                        rkey = keybytes(answerjs["key"])
                                         rblock = int(answerjs["antiblk"])
                                         rlen = int(answerjs["len"])
                                         
-                                        log("Reading %s Bytes from Block #%s, with KEY_A:%s" % (rlen,rblock,rkey))
-                                        if rdr.auth(rdr.AUTHENT1A, rblock, [c for c in rkey], raw_uid) == rdr.OK:
-                                            data = rdr.read(rblock) #rkey
-                                            pdata = "".join(chr(i) for i in data)
-                                            log("Found data: %s" % pdata)                                    
+                                        log("Reading %s Bytes from Block #%s, with KEY_A:%s", rlen, rblock, rkey)
+                                        if useSessionProtocol:
+                                            session_tap(raw_uid, uid, rblock, rkey, answerjs.get("read"))
+                                        elif answerjs.get("read") or rdr.auth(rdr.AUTHENT1A, rblock, [c for c in rkey], raw_uid) == rdr.OK:
+                                            data = blockbuf if answerjs.get("read") else rdr.read(rblock) #rkey
+                                            tracer.lap(trace.RF)
+                                            pdata = blockdata(data)
+                                            log("Found data: %s", pdata)                                    
                                             
                                             #stage2 - check data against server
                                             log("Asking Access Control System (stage2)...")
                                             wdt.feed()
                                             try:
-                                                r = urequests.post(authurl, data = ujson.dumps({"cmd":"stage2","device_id":device_id,"uid":uid,"key":pdata}))
-                                                log(r.text)
-                                                answerjs = r.json()
+                                                r = post({"cmd":"stage2","device_id":device_id,"uid":uid,"key":pdata})
+                                                answerjs = parse(r)
                                                 r.close()
+                                                tracer.lap(trace.STAGE2)
                                                 log(answerjs)
+                                                remember_card(uid, answerjs)
                                                 if answerjs["status"] == "kk":
                                                     log("stage 2 ok")
                                                     log("Entering stage3...")
                                                     #stage 3 - write data and give response
                                                     rwriteblock = int(answerjs["setantiblk"])
-                                                    rwritekey = ubinascii.unhexlify(answerjs["key"])
+                                                    rwritekey = keybytes(answerjs["key"])
                                                     rwritedata = answerjs["txt"]
                                                     
                                                     if rdr.auth(rdr.AUTHENT1B, rwriteblock, [c for c in rwritekey], raw_uid) == rdr.OK:
                                                         wdt.feed()
-                                                        stat = rdr.write(rwriteblock, rwritedata.encode())
+                                                        stat = rdr.write(rwriteblock, blockbytes(rwritedata))
                                                         log(stat)
-                                                        data = rdr.read(rwriteblock)
-                                                        pdata = "".join(chr(i) for i in data)
-                                                        log("Found new data: %s" % pdata)
+                                                        data = bytes(rdr.read(rwriteblock))
+                                                        tracer.lap(trace.RF)
+                                                        pdata = blockdata(data)
+                                                        log("Found new data: %s", pdata)
                                                         
                                                         led(np,GREEN)
                                                         #open, or when closed also open
                                                         cmd = "open"
                                                         #time.sleep(2)
-                                                        pdata2 = "nope"
-                                                        for g in range(4):
-                                                            try:
-                                                                data2 = rdr.read(rwriteblock)
-                                                                pdata2 = "".join(chr(i) for i in data2)
-                                                                log("Still found new data: %s (%s)" % (pdata2,g))
-                                                                time.sleep(1)
-                                                            except: # Exception as e:
-                                                                #print("Exception in recurring data fetch: %s" % e)
-                                                                #sys.print_exception(e)
-                                                                pdata2 = "nope"
-                                                                break
-
-                                                        if pdata2 == pdata:
+                                                        if card_held(raw_uid):
                                                             #wait some sec, if same uid is still there, cmd is close (long tap)
                                                             cmd = "close"
                                                             led(np,PINK)
+                                                        tracer.lap(trace.HELD)
                                                         try:
-                                                            log("Asking Access Control System (stage3) to %s..." % cmd)
-                                                            r = urequests.post(authurl, data = ujson.dumps({"cmd":"stage3","device_id":device_id,"uid":uid,"key":pdata,"doorcmd":cmd}))
-                                                            #log(r.text)
-                                                            answerjs = r.json()
-                                                            r.close()
+                                                            if cmd == "close":
+                                                                close_later(uid, data)
+                                                                answerjs = {"status":"done"}
+                                                            else:
+                                                                log("Asking Access Control System (stage3) to %s...", cmd)
+                                                                r = post({"cmd":"stage3","device_id":device_id,"uid":uid,"key":pdata,"doorcmd":cmd,"grant":grant_wanted()})
+                                                                #log(r.text)
+                                                                answerjs = parse(r)
+                                                                r.close()
+                                                                tracer.lap(trace.STAGE3)
+                                                                store_grant(answerjs)
                                                             #log(answerjs)
                                                             wdt.feed()
                                                             #Stage4 requested:
                                                             if (answerjs["status"] == "getcode"):
                                                                 log("Access Control System is Requesting Google Authenticator... transistion into stage 4")
                                                                 gcode_code = get_stage4_gcode(np,int(answerjs["num"]))
-                                                                log("sending code... %s " % gcode_code)
-                                                                r = urequests.post(authurl, data = ujson.dumps({"cmd":"stage4","device_id":device_id,"uid":uid,"key":pdata,"doorcmd":cmd,"gcode":gcode_code}))
-                                                                answerjs = r.json()
+                                                                tracer.lap(trace.CODE)
+                                                                log("sending code... %s ", gcode_code)
+                                                                r = post({"cmd":"stage4","device_id":device_id,"uid":uid,"key":pdata,"doorcmd":cmd,"gcode":gcode_code})
+                                                                answerjs = parse(r)
+                                                                tracer.lap(trace.STAGE4)
                                                                 if (answerjs["status"] == "done"):
                                                                     log("GoogleAuth code valid")
                                                                     led(np,GREEN)
@@ -353,73 +991,78 @@ def do_work():
                                                                 #finished...
                                                                 log("Finished.. going to sleep...")
 
-                                                            time.sleep(3)
+                                                            rest(3000)
                                                         except Exception as e:
-                                                            log("Exception in stage3: %s" % e)
+                                                            error("Exception in stage3: %s", e)
                                                             led(np,RED)
                                                             if debugmode:
                                                                 sys.print_exception(e)
-                                                            
-                                                            r.close()
-                                                            break  
+                                                            if not isinstance(e, OSError):
+                                                                break
                                                     else:
-                                                        log("auth error stage3! (Card removed?)")
+                                                        error("auth error stage3! (Card removed?)")
                                                         led(np,RED)
                                                 else:
-                                                    log("stage 2 status error (key wrong?)")
+                                                    error("stage 2 status error (key wrong?)")
                                                     led(np,RED)
                                             except Exception as e:
-                                                log("Exception in stage2: %s" % e)
-                                                led(np,RED)
-                                                if debugmode:
-                                                    sys.print_exception(e)
-                                                
-                                                r.close()
-                                                break    
+                                                error("Exception in stage2: %s", e)
+                                                if not offline_fallback(e, raw_uid, uid):
+                                                    led(np,RED)
+                                                    if debugmode:
+                                                        sys.print_exception(e)
+                                                    if not isinstance(e, OSError):
+                                                        break
                                         else:
-                                            log("auth error stage1! (Card removed?)")
+                                            error("auth error stage1! (Card removed?)")
+                                            forget_card(uid)
                                             led(np,RED)
                                     elif answerjs["status"] == "init":
                                         led(np,BLUE)
-                                        init(rdr,answerjs,raw_uid)
+                                        init(rdr,answerjs,raw_uid,r)
+                                        tracer.lap(trace.PROVISION)
                                         led(np,GREEN)
                                     elif answerjs["status"] == "reset":
                                         led(np,BLUE)
-                                        reset(rdr,answerjs,raw_uid)
+                                        reset(rdr,answerjs,raw_uid,r)
+                                        tracer.lap(trace.PROVISION)
                                         led(np,GREEN)
                                     else:
-                                        log("stage 1 status error (uid not auth?)!")
+                                        error("stage 1 status error (uid not auth?)!")
                                         led(np,RED)
                                 except Exception as e:
-                                    log("Exception in stage1: %s" % e)
-                                    led(np,RED)
-                                    if debugmode:
-                                        sys.print_exception(e)
-                                    
-                                    r.close()
-                                    break
+                                    error("Exception in stage1: %s", e)
+                                    if not offline_fallback(e, raw_uid, uid):
+                                        led(np,RED)
+                                        if debugmode:
+                                            sys.print_exception(e)
+                                        #server unreachable: this tap is lost (stage1 queued it), the loop goes on
+                                        #and sends the queued events once the server answers again
+                                        if not isinstance(e, OSError):
+                                            break
                                 rdr.stop_crypto1()     
-                                time.sleep(3)
+                                rest(3000)
                             else:
-                                log("Failed to select tag")
+                                error("Failed to select tag")
                                 led(np,RED)
                     else:
-                        log("Chinese UID found!")
+                        error("Chinese UID found!")
                         led(np,RED)
-                        try:
-                            (stat, tag_type) = rdr.request(rdr.REQIDL)
-                            (stat, raw_uid) = rdr.anticoll()
-                            #rdr.halt()
-                            if stat == rdr.OK:
-                                uid = "%02x%02x%02x%02x" % (raw_uid[0], raw_uid[1], raw_uid[2], raw_uid[3])
-                            else:
-                                uid = "00000000"
-                            log("Chinese UID %s found!" % uid)
-                            r = urequests.post(authurl, data = ujson.dumps({"cmd":"chinauid","device_id":device_id,"uid":uid}))
-                            r.close()
-                        except:
-                            pass
-                        time.sleep(3)
+                        (stat, tag_type) = rdr.request(rdr.REQIDL)
+                        (stat, raw_uid) = rdr.anticoll()
+                        tracer.lap(trace.ANTICOLL)
+                        #rdr.halt()
+                        if stat == rdr.OK:
+                            uid = "%02x%02x%02x%02x" % (raw_uid[0], raw_uid[1], raw_uid[2], raw_uid[3])
+                        else:
+                            uid = "00000000"
+                        error("Chinese UID %s found!", uid)
+                        notify({"ev":"chinauid","device_id":device_id,"uid":uid})
+                        rest(3000)
+                    info("Tap trace: %s", tracer.finish(uid, device_id))
+                    log("SPI transactions for this tap: %s", rdr.xfers - xfers)
+                    info("Tap took %s round trips, %s ms", roundtrips, time.ticks_diff(time.ticks_ms(), tap_start))
+                    log("HTTP connections reused: %s, new: %s", http.hits, http.misses)
                     keypad.start() #resume keypad presses
             if useGoogleAuth:
                 #log("Check KeyPad Entry")
@@ -427,7 +1070,7 @@ def do_work():
                     key = keypad.get_key()
                     if key:
                         #we got at least one key, check faster here for more keys or abort after 5 seconds
-                        log( "keypad: got key: %s" % key )
+                        log("keypad: got key: %s", key)
                         timecnt = 0
                         loopme=True
                         while loopme:
@@ -440,9 +1083,8 @@ def do_work():
                                 led(np,WHITE)
                                 #send to server
                                 try:
-                                    r = urequests.post(authurl, data = ujson.dumps({"cmd":"keyauth","device_id":device_id,"key":key}))
-                                    log(r.text)
-                                    answerjs = r.json()
+                                    r = post({"cmd":"keyauth","device_id":readers[0][1],"key":key})
+                                    answerjs = parse(r)
                                     r.close()
                                     log(answerjs)
                                     if answerjs["status"] == "kk":
@@ -462,14 +1104,14 @@ def do_work():
                                 newkey = keypad.get_key()
                                 if newkey:
                                     timecnt = 0 #reset abort timer
-                                    if newkey == "#" or newkey == "*":
+                                    if "#" in newkey or "*" in newkey:
                                         #abort
-                                        log( "Key entry aborted with key: %s" % newkey )
+                                        log("Key entry aborted with key: %s", newkey)
                                         led(np,OFF)
                                         loopme = False
                                     else:
                                         key += newkey
-                                        log( "keystr: %s" % key )
+                                        log("keystr: %s", key)
                                         led(np,BLUE)
 
                                 time.sleep(0.1)
@@ -481,19 +1123,528 @@ def do_work():
                             
 
                 except Exception as exc:
-                    log( "Exception in KeyPad enum: %s" % str( exc ) )
+                    error("Exception in KeyPad enum: %s", exc)
                     pass
-            machine.idle()
-            time.sleep(1) 
+            if grants is not None and grants.pending():
+                reconcile()
+            if events.due():
+                send_events()
+            if log_wanted and logs is not None:
+                send_log()
+            fastboot.renew()
+            wait_for_card(1000)
     except KeyboardInterrupt:
         log("Bye")
 
+#****************uasyncio runtime*****************
+#Card reader, keypad, LEDs, watchdog and server requests run as their own tasks, the requests
+#go over non-blocking sockets. do_work() above is the blocking fallback (useAsyncio = False).
+
+keylock = None #owner of the keypad: PIN+GAuth entry or the code a card asks for
+card_flag = None #set from the IRQ handler of the reader
+event_flag = None #set when an event is queued
+tap_uid = None #(raw_uid, uid) of the tag being handled
+tapping = False #a_card() is busy with a tap
+
+async def a_post(js):
+    global roundtrips
+    roundtrips += 1
+    tracer.attach(js)
+    r = await ahttp.post(*encode(js))
+    if json_only(r.content):
+        r = await ahttp.post(*encode(js))
+    tracer.sent()
+    return r
+
+async def a_next_item(body):
+    buf = b""
+    while True:
+        d = await body.readsome()
+        if not d:
+            if buf:
+                raise ValueError("answer cut off")
+            return None
+        buf += d
+        if not wire.is_cbor(buf):
+            raise ValueError(buf)
+        try:
+            item, i = wire.decode(buf)
+        except EOFError:
+            continue
+        body.unread(buf[i:])
+        return item
+
+async def a_stream(js):
+    global roundtrips
+    roundtrips += 1
+    js["stream"] = 1
+    tracer.attach(js)
+    r = await ahttp.stream(*encode(js))
+    if wire_cbor:
+        head = await r.readsome()
+        if not wire.is_cbor(head):
+            head += await r.read()
+            if json_only(head):
+                r = await ahttp.stream(*encode(js))
+                head = b""
+        r.unread(head)
+    tracer.sent()
+    if not wire_cbor:
+        return asked_for_log(ujson.loads(await r.readline())), r
+    answerjs = asked_for_log(await a_next_item(r))
+    if not answerjs.get("stream"):
+        await r.close()
+    return answerjs, r
+
+async def a_send_log():
+    global log_wanted
+    log_wanted = False
+    try:
+        await a_post({"cmd":"log","device_id":device_id,"lines":logs.lines()})
+        logs.clear()
+    except OSError as e:
+        error("Sending the log failed: %s", e)
+
+async def a_provision(answerjs, raw_uid, body):
+    #init/reset, sector by sector as the lines come in
+    if not answerjs.get("stream"):
+        (init if answerjs["status"] == "init" else reset)(rdr,answerjs,raw_uid)
+        return
+    log(answerjs)
+    if answerjs["status"] == "init":
+        init_sector0(rdr,raw_uid)
+    else:
+        reset_sector0(rdr,raw_uid)
+    while True:
+        if wire_cbor:
+            sec = await a_next_item(body)
+            if sec is None:
+                break
+        else:
+            line = await body.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            sec = ujson.loads(line)
+        if answerjs["status"] == "init":
+            init_sector(rdr,answerjs,sec,raw_uid)
+        else:
+            reset_sector(rdr,sec,raw_uid)
+
+async def a_wdt():
+    while True:
+        wdt.feed()
+        await asyncio.sleep_ms(1000)
+
+async def a_wifi():
+    #a reused DHCP lease goes back to DHCP between taps, the address is gone for a moment (fastboot.renew)
+    while True:
+        await asyncio.sleep_ms(1000)
+        if not tapping and not keylock.locked():
+            fastboot.renew()
+
+async def a_read_code(num, timeout_ms, key=""):
+    #collect num digits from the keypad, None on abort (# or *) or after timeout_ms without a key
+    keypad.start()
+    last = time.ticks_ms()
+    try:
+        while len(key) < num:
+            newkey = keypad.get_key()
+            if newkey:
+                last = time.ticks_ms()
+                if "#" in newkey or "*" in newkey:
+                    log("Key entry aborted with key: %s", newkey)
+                    led(np,OFF)
+                    return None
+                key += newkey
+                log("keystr: %s", key)
+                led(np,BLUE)
+            elif time.ticks_diff(time.ticks_ms(), last) > timeout_ms:
+                log("Key entry timed out")
+                return None
+            await asyncio.sleep_ms(50)
+        return key
+    finally:
+        led(np,OFF)
+        if not useGoogleAuth:
+            keypad.stop()
+
+async def a_keypad():
+    #PIN + GAuth without a card, runs next to the card task
+    while True:
+        await asyncio.sleep_ms(50)
+        if keylock.locked():
+            continue
+        key = keypad.get_key()
+        if not key:
+            continue
+        async with keylock:
+            log("keypad: got key: %s", key)
+            led(np,YELLOW)
+            key = await a_read_code(10, 10000, key)
+            if key is None:
+                led(np,OFF)
+                continue
+            led(np,WHITE)
+            try:
+                r = await a_post({"cmd":"keyauth","device_id":readers[0][1],"key":key})
+                answerjs = parse(r)
+                log(answerjs)
+                led(np,GREEN if answerjs["status"] == "kk" else RED)
+            except Exception as e:
+                error("Exception in keyauth: %s", e)
+                led(np,RED)
+            await asyncio.sleep_ms(1000)
+            led(np,OFF)
+
+async def a_card_held(raw_uid):
+    rdr.stop_crypto1()
+    start = time.ticks_ms()
+    misses = 0
+    while time.ticks_diff(time.ticks_ms(), start) < long_tap_ms:
+        misses = presence(misses)
+        if misses >= 2:
+            log("Tag taken away after %s ms", time.ticks_diff(time.ticks_ms(), start))
+            return False
+        await asyncio.sleep_ms(presence_poll_ms)
+    return same_tag(raw_uid)
+
+async def a_get_code(num):
+    log("Keypad Entry Requested...")
+    async with keylock:
+        status_leds.blink(BLUEYELL,YELLBLUE)
+        code = await a_read_code(num, 60000)
+    return code if code is not None else "0"*num
+
+async def a_stages(raw_uid, uid, rblock, rkey, read=False):
+    if not read and (rdr.auth(rdr.AUTHENT1A, rblock, rkey, raw_uid) != rdr.OK or rdr.readinto(rblock, blockbuf) != rdr.OK):
+        error("auth error stage1! (Card removed?)")
+        forget_card(uid)
+        led(np,RED)
+        return
+    tracer.lap(trace.RF)
+    pdata = blockdata(blockbuf)
+    log("Asking Access Control System (stage2)...")
+    answerjs = parse(await a_post({"cmd":"stage2","device_id":device_id,"uid":uid,"key":pdata}))
+    tracer.lap(trace.STAGE2)
+    remember_card(uid, answerjs)
+    if answerjs["status"] != "kk":
+        error("stage 2 status error (key wrong?)")
+        led(np,RED)
+        return
+    rwriteblock = int(answerjs["setantiblk"])
+    if rdr.auth(rdr.AUTHENT1B, rwriteblock, keybytes(answerjs["key"]), raw_uid) != rdr.OK:
+        error("auth error stage3! (Card removed?)")
+        led(np,RED)
+        return
+    rdr.write(rwriteblock, blockbytes(answerjs["txt"]))
+    data = bytes(rdr.read(rwriteblock))
+    tracer.lap(trace.RF)
+    pdata = blockdata(data)
+    led(np,GREEN)
+    cmd = "close" if await a_card_held(raw_uid) else "open"
+    tracer.lap(trace.HELD)
+    if cmd == "close":
+        led(np,PINK)
+        close_later(uid, data)
+        return
+    log("Asking Access Control System (stage3) to %s...", cmd)
+    answerjs = parse(await a_post({"cmd":"stage3","device_id":device_id,"uid":uid,"key":pdata,"doorcmd":cmd,"grant":grant_wanted()}))
+    tracer.lap(trace.STAGE3)
+    store_grant(answerjs)
+    if answerjs["status"] == "getcode":
+        gcode_code = await a_get_code(int(answerjs["num"]))
+        tracer.lap(trace.CODE)
+        answerjs = parse(await a_post({"cmd":"stage4","device_id":device_id,"uid":uid,"key":pdata,"doorcmd":cmd,"gcode":gcode_code}))
+        tracer.lap(trace.STAGE4)
+        led(np,GREEN if answerjs["status"] == "done" else RED)
+    elif answerjs["status"] != "done":
+        led(np,RED)
+
+async def a_session(raw_uid, uid, rblock, rkey, read=False):
+    if not read and (rdr.auth(rdr.AUTHENT1A, rblock, rkey, raw_uid) != rdr.OK or rdr.readinto(rblock, blockbuf) != rdr.OK):
+        error("auth error sess2! (Card removed or tag changed?)")
+        forget_card(uid)
+        led(np,RED)
+        return
+    tracer.lap(trace.RF)
+    pdata = blockdata(blockbuf)
+    log("Asking Access Control System (sess2)...")
+    answerjs, r = await a_stream({"cmd":"sess2","device_id":device_id,"uid":uid,"key":pdata})
+    tracer.lap(trace.STAGE2)
+    remember_card(uid, answerjs)
+    if answerjs["status"] == "reset":
+        led(np,BLUE)
+        await a_provision(answerjs,raw_uid,r)
+        tracer.lap(trace.PROVISION)
+        led(np,GREEN)
+        return
+    if answerjs["status"] != "kk":
+        error("sess2 status error (key wrong?)")
+        led(np,RED)
+        return
+    rwriteblock = int(answerjs["setantiblk"])
+    if rdr.auth(rdr.AUTHENT1B, rwriteblock, keybytes(answerjs["key"]), raw_uid) != rdr.OK:
+        error("auth error sess2! (Card removed?)")
+        led(np,RED)
+        return
+    rdr.write(rwriteblock, blockbytes(answerjs["txt"]))
+    data = bytes(rdr.read(rwriteblock))
+    tracer.lap(trace.RF)
+    pdata = blockdata(data)
+    led(np,GREEN)
+    cmd = "close" if await a_card_held(raw_uid) else "open"
+    tracer.lap(trace.HELD)
+    if cmd == "close":
+        led(np,PINK)
+        close_later(uid, data)
+        return
+    js = {"cmd":"sess3","device_id":device_id,"uid":uid,"key":pdata,"doorcmd":cmd}
+    if grant_wanted():
+        js["grant"] = 1
+    if cmd == "open" and int(answerjs["num"]) > 0:
+        js["gcode"] = await a_get_code(int(answerjs["num"]))
+        tracer.lap(trace.CODE)
+    log("Asking Access Control System (sess3) to %s...", cmd)
+    answerjs = parse(await a_post(js))
+    tracer.lap(trace.STAGE3)
+    log(answerjs)
+    remember_card(uid, answerjs)
+    store_grant(answerjs)
+    led(np,GREEN if answerjs["status"] == "done" else RED)
+
+async def a_tap():
+    global tap_uid
+    led(np,WHITE)
+    china = rdr.checkChinaUID()
+    tracer.lap(trace.CHINA)
+    if china:
+        error("Chinese UID found!")
+        led(np,RED)
+        (stat, tag_type) = rdr.request(rdr.REQIDL)
+        (stat, raw_uid) = rdr.anticoll()
+        tracer.lap(trace.ANTICOLL)
+        uid = "%02x%02x%02x%02x" % (raw_uid[0], raw_uid[1], raw_uid[2], raw_uid[3]) if stat == rdr.OK else "00000000"
+        error("Chinese UID %s found!", uid)
+        notify({"ev":"chinauid","device_id":device_id,"uid":uid})
+        return
+    uids = rdr.tags()
+    tracer.lap(trace.ANTICOLL)
+    if not uids:
+        return
+    if _LOG_DEBUG:
+        log("New card detected, uid: %s", " ".join(hexuid(u) for u in uids))
+    raw_uid = pick_tag(uids)
+    uid = hexuid(raw_uid)
+    tap_uid = (raw_uid, uid) #for the offline fallback
+    stat = select_uid(raw_uid)
+    tracer.lap(trace.SELECT)
+    if stat != rdr.OK:
+        error("Failed to select tag")
+        led(np,RED)
+        return
+    answerjs = cached_stage1(raw_uid, uid)
+    if answerjs is None:
+        log("Asking Access Control System (stage1)...")
+        try:
+            answerjs, r = await a_stream(stage1_js(uid, uids))
+        except OSError:
+            missed_tap(uid)
+            raise
+        raw_uid = picked_tag(uids, answerjs, raw_uid)
+        uid = hexuid(raw_uid)
+        tap_uid = (raw_uid, uid)
+        remember_card(uid, answerjs)
+    tracer.lap(trace.STAGE1)
+    log(answerjs)
+    if answerjs["status"] == "k":
+        rkey = keybytes(answerjs["key"])
+        rblock = int(answerjs["antiblk"])
+        if useSessionProtocol:
+            await a_session(raw_uid, uid, rblock, rkey, answerjs.get("read"))
+        else:
+            await a_stages(raw_uid, uid, rblock, rkey, answerjs.get("read"))
+    elif answerjs["status"] == "init" or answerjs["status"] == "reset":
+        led(np,BLUE)
+        await a_provision(answerjs,raw_uid,r)
+        tracer.lap(trace.PROVISION)
+        led(np,GREEN)
+    else:
+        error("stage 1 status error (uid not auth?)!")
+        led(np,RED)
+
+async def a_wait_for_card():
+    #IRQ line: sleep until a reader signals an answer to the background REQA, else poll
+    if pin_nfc_irq is None:
+        while not find_card(False):
+            await asyncio.sleep_ms(nfc_poll_ms)
+        return
+    while True:
+        for i in range(len(readers)):
+            readers[i][0].irq_arm(rdr.REQIDL)
+        try:
+            await asyncio.wait_for_ms(card_flag.wait(), nfc_irq_rearm_ms)
+        except asyncio.TimeoutError:
+            continue
+        if find_card(True):
+            return
+
+async def a_card_gone():
+    #the tag is gone when it did not answer two wake-ups in a row (a woken tag skips the next one).
+    #True if a tag showed up on another reader meanwhile (see find_card)
+    global card_waiting
+    misses = 0
+    while misses < 2:
+        await asyncio.sleep_ms(nfc_poll_ms)
+        misses = misses + 1 if rdr.detect(rdr.REQALL) != rdr.OK else 0
+        if len(readers) > 1:
+            card_waiting = poll_readers(False, rdr)
+            if card_waiting >= 0:
+                park()
+                return True
+    return False
+
+def park():
+    #halt the tag of the last tap if it is still on rdr, the REQA polling ignores it then
+    if tap_uid is not None and (rdr.detect(rdr.REQALL) == rdr.OK or rdr.detect(rdr.REQALL) == rdr.OK):
+        if rdr.select_tag(tap_uid[0]) == rdr.OK:
+            rdr.halt()
+
+async def a_send_events():
+    #on its own connection, a tap can use ahttp meanwhile
+    js = events_js()
+    try:
+        r = await ehttp.post(*encode(js))
+        if json_only(r.content):
+            r = await ehttp.post(*encode(js))
+        answerjs = parse(r)
+    except (OSError, ValueError, asyncio.TimeoutError) as e:
+        info("Sending events failed: %s", e)
+        events.failed()
+        return
+    events_done(js, answerjs)
+
+async def a_events():
+    while True:
+        if not events.count:
+            await event_flag.wait()
+            continue
+        wait = events.wait_ms()
+        if wait:
+            await asyncio.sleep_ms(wait)
+        await a_send_events()
+
+async def a_reconcile():
+    while True:
+        await asyncio.sleep_ms(10000)
+        for uid, otxt in grants.pending():
+            try:
+                r = await a_post({"cmd":"offline","device_id":grants.device_id,"uid":uid,"key":otxt})
+            except OSError:
+                break
+            info("Offline tap of %s reported: %s", uid, parse(r)["status"])
+            grants.reported(uid)
+
+async def a_card():
+    global roundtrips, tap_uid, tapping
+    found = False
+    while True:
+        if not (found and find_card(False)):
+            await a_wait_for_card()
+        tracer.lap(trace.DETECT)
+        roundtrips = 0
+        tap_uid = None
+        tapping = True
+        tap_start = time.ticks_ms()
+        try:
+            await a_tap()
+        except Exception as e:
+            error("Exception in tap: %s", e)
+            if not (tap_uid is not None and offline_fallback(e, tap_uid[0], tap_uid[1])):
+                led(np,RED)
+                if debugmode:
+                    sys.print_exception(e)
+        rdr.stop_crypto1()
+        info("Tap trace: %s", tracer.finish(tap_uid[1] if tap_uid is not None else "-", device_id))
+        info("Tap took %s round trips, %s ms", roundtrips, time.ticks_diff(time.ticks_ms(), tap_start))
+        tapping = False
+        found = await a_card_gone()
+        if found:
+            continue
+        #keep the result on the LED for a moment after quick taps
+        shown = time.ticks_diff(time.ticks_ms(), tap_start)
+        if shown < 1500:
+            await asyncio.sleep_ms(1500 - shown)
+        led(np,OFF)
+        if log_wanted and logs is not None:
+            #the reader is idle now, a tap right after this one is not held up
+            await a_send_log()
+
+async def a_main():
+    global keylock, card_flag, event_flag
+    keylock = asyncio.Lock()
+    card_flag = asyncio.ThreadSafeFlag()
+    event_flag = asyncio.ThreadSafeFlag()
+    tasks = [a_wdt(), a_events(), a_wifi()]
+    if useNFC:
+        tasks.append(a_card())
+    if useGoogleAuth:
+        tasks.append(a_keypad())
+    if grants is not None:
+        tasks.append(a_reconcile())
+    await asyncio.gather(*tasks)
+
 micropython.alloc_emergency_exception_buf( 100 )
 wdt = WDT(timeout=wd_timeout)
 np = neopixel.NeoPixel(machine.Pin(pin_neopixel), 2)
+status_leds = leds.Leds(np)
 led(np,PINK)
-rdr = mfrc522.MFRC522(sck=pin_nfc_sck, mosi=pin_nfc_mosi, miso=pin_nfc_miso, rst=pin_nfc_rst, cs=pin_nfc_cs)
-keypad = keypad_timer.Keypad_Timer(pins_row=pins_keypad_rows,pins_col=pins_keypad_cols)
+http_timeout = 5
+if pin_offline_relay is not None and offline_grant_key:
+    grants = offline.GrantCache("grants.json", offline_grant_key, device_id, offline_cache_size)
+    relay = machine.Pin(pin_offline_relay, machine.Pin.OUT, value=0)
+    #the ESP32 port maps Timer(id) to hardware timer group (id>>1)&1, index id&1: 2 is the LEDs, 5 the keypad
+    relay_timer = machine.Timer(0)
+    http_timeout = offline_budget_ms / 1000
+if card_cache_size:
+    cards = cardcache.CardCache(card_cache_size, card_cache_ttl_s, card_cache_file)
+events = eventqueue.EventQueue(event_queue_size, event_queue_file)
+http = httpclient.HTTPClient(authurl, timeout=http_timeout, keepalive_ms=http_keepalive_ms)
+ahttp = httpclient.AsyncHTTPClient(authurl, timeout=http_timeout, keepalive_ms=http_keepalive_ms)
+ehttp = httpclient.AsyncHTTPClient(authurl, timeout=http_timeout, keepalive_ms=http_keepalive_ms) #events, see a_events()
+tracer = trace.Tracer(keep=4 if useTrace else 0)
+for cs, rst, dev in nfc_readers:
+    machine.Pin(cs, machine.Pin.OUT, value=1) #a floating cs would let that reader answer on the bus too
+rdr = mfrc522.MFRC522(sck=pin_nfc_sck, mosi=pin_nfc_mosi, miso=pin_nfc_miso, rst=pin_nfc_rst, cs=pin_nfc_cs, soft_crc=False)
+readers.append((rdr, device_id))
+for cs, rst, dev in nfc_readers:
+    readers.append((mfrc522.MFRC522(sck=pin_nfc_sck, mosi=pin_nfc_mosi, miso=pin_nfc_miso, rst=rst, cs=cs, soft_crc=False, spi=rdr.spi), dev))
+for r, dev in readers:
+    if useSoftCRC:
+        r.soft_crc = r.verify_crc()
+        if not r.soft_crc:
+            error("Software CRC_A does not match the MFRC522 of %s, using its coprocessor", dev)
+    if pin_nfc_irq is not None and (useAsyncio or not useLowPower):
+        r.irq_setup(shared=len(readers) > 1)
+if pin_nfc_irq is not None and (useAsyncio or not useLowPower):
+    machine.Pin(pin_nfc_irq, machine.Pin.IN, machine.Pin.PULL_UP).irq(trigger=machine.Pin.IRQ_FALLING, handler=nfc_irq_handler)
+keypad = keypad_timer.Keypad_Timer(pins_row=pins_keypad_rows,pins_col=pins_keypad_cols,idle_ms=keypad_idle_ms)
 if useGoogleAuth:
     keypad.start()
-do_work()
\ No newline at end of file
+t_hw = time.ticks_ms()
+wifi_up = fastboot.wait(wifi_wait_ms, wdt.feed)
+boot_ms = time.ticks_ms()
+if wifi_up:
+    info("Wi-Fi up after %s ms (%s): %s", fastboot.assoc_ms(), fastboot.how, fastboot.wlan.ifconfig())
+else:
+    error("No Wi-Fi after %s ms, starting without the server", wifi_wait_ms)
+info("Ready for tap %s ms after reset: startup %s ms, imports %s ms, hardware %s ms, waiting for Wi-Fi %s ms",
+     boot_ms, t_main, time.ticks_diff(t_imports, t_main), time.ticks_diff(t_hw, t_imports), time.ticks_diff(boot_ms, t_hw))
+tracer.note(device_id, "boot %d start:%d,imp:%d,hw:%d,wifi:%d" % (boot_ms, t_main, time.ticks_diff(t_imports, t_main),
+                                                                 time.ticks_diff(t_hw, t_imports), time.ticks_diff(boot_ms, t_hw)))
+if useAsyncio:
+    import uasyncio as asyncio
+    asyncio.run(a_main())
+else:
+    do_work()
\ No newline at end of file
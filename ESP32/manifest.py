@@ -0,0 +1,29 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# Freezes the firmware modules into a MicroPython build: they run as bytecode straight from flash,
+# nothing is parsed and compiled at start and the code takes no heap. boot.py and main.py (the
+# config) stay files on the board. Delete the .py copies of these modules from the board, files
+# come before frozen modules on sys.path.
+#   > make -C ports/esp32 BOARD=ESP32_GENERIC FROZEN_MANIFEST=/path/to/ESP32/manifest.py
+
+include("$(PORT_DIR)/boards/manifest.py")
+module("fastboot.py")
+module("mfrc522.py")
+module("crc_a.py")
+module("httpclient.py")
+module("keypad_timer.py")
+module("offline.py")
+module("leds.py")
+module("trace.py")
+module("wire.py")
+module("ringlog.py")
+module("cardcache.py")
+module("eventqueue.py")
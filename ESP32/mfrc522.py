@@ -6,6 +6,7 @@
 #---------------------------------------------------
 from machine import Pin, SPI
 from os import uname
+from crc_a import crc_a
 
 
 class MFRC522:
@@ -13,26 +14,74 @@ class MFRC522:
 	OK = 0
 	NOTAGERR = 1
 	ERR = 2
+	COLLERR = 3 #several tags answered with different bits
 
 	REQIDL = 0x26
 	REQALL = 0x52
 	AUTHENT1A = 0x60
 	AUTHENT1B = 0x61
 
-	def __init__(self, sck, mosi, miso, rst, cs):
+	#spi: the bus of another MFRC522 to share it, sck/mosi/miso are ignored then. Several readers
+	#on one bus need their own cs (and rst) pins, all cs pins must be high before the first init()
+	def __init__(self, sck, mosi, miso, rst, cs, soft_crc=True, spi=None):
 
-		self.sck = Pin(sck, Pin.OUT)
-		self.mosi = Pin(mosi, Pin.OUT)
-		self.miso = Pin(miso)
+		if spi is None:
+			self.sck = Pin(sck, Pin.OUT)
+			self.mosi = Pin(mosi, Pin.OUT)
+			self.miso = Pin(miso)
 		self.rst = Pin(rst, Pin.OUT)
 		self.cs = Pin(cs, Pin.OUT)
 
 		self.rst.value(0)
 		self.cs.value(1)
-		
+
+		#number of CS framed SPI transactions, compare before/after an operation to measure bus usage
+		self.xfers = 0
+
+		#Preallocated scratch buffers: register and frame I/O must not allocate on the heap,
+		#otherwise a long running reader fragments the heap and gets GC pauses mid-transaction.
+		self._wr = bytearray(2)
+		self._rd = bytearray(2)
+		#frame to send: byte 0 is the FIFODataReg write address, then up to 16 data bytes + CRC
+		self._tx = bytearray(19)
+		self._tx[0] = 0x12
+		#FIFO burst read: address 0x92 repeated, the terminating 0x00 is set right before the transfer
+		self._fq = bytearray(b'\x92' * 17)
+		#received frame, data starts at index 1
+		self._rx = bytearray(17)
+		self._rq = bytearray(4)
+		#UID bytes + BCC of the cascade level in progress (anticollision / select)
+		self._cl = bytearray(5)
+		#memoryviews of every length, so a transfer of n bytes needs no slicing at runtime
+		self._txv = self._views(self._tx)
+		self._fqv = self._views(self._fq)
+		self._rxv = self._views(self._rx)
+		self._rqv = self._views(self._rq)
+		#multi-register read queries used by _frame and _crc_tx
+		self._q_div_fifo = self._query(0x05, 0x0A)
+		self._q_status = self._query(0x06, 0x0A, 0x0C)
+		self._q_crc = self._query(0x22, 0x21)
+
+		#CRC_A of outgoing frames: computed here (True) or by the CalcCRC coprocessor of the chip
+		self.soft_crc = soft_crc
+
+		#bit length and byte length of the last answer received by _frame
+		self.bits = 0
+		self.rlen = 0
+
+		#what was last written to BitFramingReg (without StartSend) and ComIEnReg: _frame sets StartSend
+		#and the interrupt sources without reading the registers first. None = not known (after reset)
+		self._bf = 0
+		self._ien = None
+
+		#scratch block for verify_sector, sector trailer built by trailer()
+		self._vb = bytearray(16)
+
 		board = uname()[0]
 
-		if board == 'esp32' or board == 'LoPy' or board == 'FiPy':
+		if spi is not None:
+			self.spi = spi
+		elif board == 'esp32' or board == 'LoPy' or board == 'FiPy':
 			self.spi = SPI(1, 10000000, sck=self.sck, mosi=self.mosi, miso=self.miso)
 			self.spi.init()
 		elif board == 'esp8266':
@@ -44,21 +93,75 @@ class MFRC522:
 		self.rst.value(1)
 		self.init()
 
+	@staticmethod
+	def _views(buf):
+		mv = memoryview(buf)
+		return [mv[:i] for i in range(len(buf) + 1)]
+
+	#read addresses for _rregs, terminated with 0x00
+	@staticmethod
+	def _query(*regs):
+		q = bytearray(len(regs) + 1)
+		for i in range(len(regs)):
+			q[i] = ((regs[i] << 1) & 0x7e) | 0x80
+		return q
+
 	def _wreg(self, reg, val):
 
+		b = self._wr
+		b[0] = (reg << 1) & 0x7e
+		b[1] = val & 0xff
 		self.cs.value(0)
-		self.spi.write(b'%c' % int(0xff & ((reg << 1) & 0x7e)))
-		self.spi.write(b'%c' % int(0xff & val))
+		self.spi.write(b)
 		self.cs.value(1)
+		self.xfers += 1
 
 	def _rreg(self, reg):
 
+		b = self._wr
+		b[0] = ((reg << 1) & 0x7e) | 0x80
+		b[1] = 0
+		self.cs.value(0)
+		self.spi.write_readinto(b, self._rd)
+		self.cs.value(1)
+		self.xfers += 1
+
+		return self._rd[1]
+
+	#read several registers within one CS frame: every byte clocked out is the
+	#address of the next register. Values are returned at index 1.. of the result.
+	def _rregs(self, q):
+
 		self.cs.value(0)
-		self.spi.write(b'%c' % int(0xff & (((reg << 1) & 0x7e) | 0x80)))
-		val = self.spi.read(1)
+		self.spi.write_readinto(q, self._rqv[len(q)])
 		self.cs.value(1)
+		self.xfers += 1
+
+		return self._rq
 
-		return val[0]
+	#burst write of the first n frame bytes: after the address byte all following bytes go to the FIFO
+	def _wfifo(self, n):
+
+		self.cs.value(0)
+		self.spi.write(self._txv[n + 1])
+		self.cs.value(1)
+		self.xfers += 1
+
+	#burst read of n bytes from the FIFO into the receive buffer in a single transaction
+	def _rfifo(self, n):
+
+		self._fq[n] = 0x00
+		self.cs.value(0)
+		self.spi.write_readinto(self._fqv[n + 1], self._rxv[n + 1])
+		self.cs.value(1)
+		self._fq[n] = 0x92
+		self.xfers += 1
+
+	#BitFramingReg: bits of the last byte sent (TxLastBits) and where received bits go (RxAlign)
+	def _framing(self, val):
+
+		self._bf = val
+		self._wreg(0x0D, val)
 
 	def _sflags(self, reg, mask):
 		self._wreg(reg, self._rreg(reg) | mask)
@@ -66,10 +169,19 @@ class MFRC522:
 	def _cflags(self, reg, mask):
 		self._wreg(reg, self._rreg(reg) & (~mask))
 
-	def _tocard(self, cmd, send):
+	#read/modify/write of several registers: one read transaction for all of them,
+	#then one write per register
+	def _modflags(self, q, setmasks, clrmasks):
 
-		recv = []
-		bits = irq_en = wait_irq = n = 0
+		vals = self._rregs(q)
+		for i in range(len(q) - 1):
+			self._wreg((q[i] >> 1) & 0x3f, (vals[i + 1] | setmasks[i]) & (~clrmasks[i]))
+
+	#send the first n bytes of the frame buffer, the answer is left in the receive buffer
+	def _frame(self, cmd, n):
+
+		bits = irq_en = wait_irq = 0
+		self.rlen = 0
 		stat = self.ERR
 
 		if cmd == 0x0E:
@@ -79,37 +191,42 @@ class MFRC522:
 			irq_en = 0x77
 			wait_irq = 0x30
 
-		self._wreg(0x02, irq_en | 0x80)
-		self._cflags(0x04, 0x80)
-		self._sflags(0x0A, 0x80)
+		if self._ien != irq_en:
+			self._wreg(0x02, irq_en | 0x80)
+			self._ien = irq_en
+		#clear all ComIrqReg bits and flush the FIFO, no need to read them first
+		self._wreg(0x04, 0x7F)
+		self._wreg(0x0A, 0x80)
 		self._wreg(0x01, 0x00)
-		#print("send:")
-		#print([hex(x) for x in send])
-		for c in send:
-			self._wreg(0x09, c)
+		self._wfifo(n)
 		self._wreg(0x01, cmd)
 
 		if cmd == 0x0C:
-			self._sflags(0x0D, 0x80)
+			self._wreg(0x0D, self._bf | 0x80)
 
 		i = 500 #2000
 		while True:
-			n = self._rreg(0x04)
+			irq = self._rreg(0x04)
 			i -= 1
-			if ~((i != 0) and ~(n & 0x01) and ~(n & wait_irq)):
+			#stop on the awaited irq or on TimerIRq (no answer), instead of spinning all retries
+			if (i == 0) or (irq & 0x01) or (irq & wait_irq):
 				break
 
-		self._cflags(0x0D, 0x80)
+		self._wreg(0x0D, self._bf)
 
 		if i:
-			if (self._rreg(0x06) & 0x1B) == 0x00:
-				stat = self.OK
-
-				if n & irq_en & 0x01:
+			#ErrorReg, FIFOLevelReg and ControlReg in one go
+			st = self._rregs(self._q_status)
+			err = st[1] & 0x1B
+			#a bit collision (CollErr) still leaves the bits up to the collision in the FIFO
+			if err == 0x00 or (err == 0x08 and cmd == 0x0C):
+				stat = self.OK if err == 0x00 else self.COLLERR
+
+				if (irq & 0x01) and not (irq & wait_irq):
 					stat = self.NOTAGERR
 				elif cmd == 0x0C:
-					n = self._rreg(0x0A)
-					lbits = self._rreg(0x0C) & 0x07
+					n = st[2]
+					lbits = st[3] & 0x07
 					if lbits != 0:
 						bits = (n - 1) * 8 + lbits
 					else:
@@ -120,46 +237,114 @@ class MFRC522:
 					elif n > 16:
 						n = 16
 
-					for _ in range(n):
-						recv.append(self._rreg(0x09))
+					self._rfifo(n)
+					self.rlen = n
 			else:
 				stat = self.ERR
+
+		self.bits = bits
+		return stat
+
+	def _tocard(self, cmd, send):
+
+		n = len(send)
+		for i in range(n):
+			self._tx[i + 1] = send[i]
+		stat = self._frame(cmd, n)
 		#print("recv:")
-		#print(stat,[hex(x) for x in recv],bits)
-		return stat, recv, bits
+		#print(stat,[hex(x) for x in self._rx[1:self.rlen + 1]],self.bits)
+		return stat, [self._rx[i + 1] for i in range(self.rlen)], self.bits
 
-	def _crc(self, data):
+	#append the CRC_A of the first n frame bytes to the frame, returns the new frame length
+	def _crc_tx(self, n):
+
+		#frames with a CRC are whole bytes, also right after a detect() (7 bit REQA/WUPA)
+		if self._bf:
+			self._framing(0x00)
+		if self.soft_crc:
+			crc = crc_a(self._tx, 1, n + 1)
+			self._tx[n + 1] = crc & 0xFF
+			self._tx[n + 2] = crc >> 8
+			return n + 2
+
+		return self._crc_tx_hw(n)
 
-		self._cflags(0x05, 0x04)
-		self._sflags(0x0A, 0x80)
+	def _crc_tx_hw(self, n):
 
-		for c in data:
-			self._wreg(0x09, c)
+		self._modflags(self._q_div_fifo, b'\x00\x80', b'\x04\x00')
+
+		self._wfifo(n)
 
 		self._wreg(0x01, 0x03)
 
 		i = 0xFF
 		while True:
-			n = self._rreg(0x05)
+			v = self._rreg(0x05)
 			i -= 1
-			if not ((i != 0) and not (n & 0x04)):
+			if not ((i != 0) and not (v & 0x04)):
 				break
 
-		return [self._rreg(0x22), self._rreg(0x21)]
+		res = self._rregs(self._q_crc)
+		self._tx[n + 1] = res[1]
+		self._tx[n + 2] = res[2]
+
+		return n + 2
+
+	def _crc(self, data):
+
+		n = len(data)
+		for i in range(n):
+			self._tx[i + 1] = data[i]
+		self._crc_tx(n)
+
+		return [self._tx[n + 1], self._tx[n + 2]]
+
+	#compare the software CRC_A with the coprocessor for frames of every length, True if all match
+	def verify_crc(self):
+
+		for n in range(1, 17):
+			for i in range(n):
+				self._tx[i + 1] = (i * 37 + n * 11) & 0xFF
+			self._crc_tx_hw(n)
+			crc = crc_a(self._tx, 1, n + 1)
+			if self._tx[n + 1] != crc & 0xFF or self._tx[n + 2] != crc >> 8:
+				return False
+
+		return True
+
+	#registers set by init(): timer, TxASK, ModeReg
+	SETUP = ((0x2A, 0x8D), (0x2B, 0x3E), (0x2D, 30), (0x2C, 0), (0x15, 0x40), (0x11, 0x3D))
 
 	def init(self):
 
 		self.reset()
-		self._wreg(0x2A, 0x8D)
-		self._wreg(0x2B, 0x3E)
-		self._wreg(0x2D, 30)
-		self._wreg(0x2C, 0)
-		self._wreg(0x15, 0x40)
-		self._wreg(0x11, 0x3D)
+		self.restore()
+
+	#write the init() registers again, e.g. after the chip lost them in a brown-out
+	def restore(self):
+
+		for reg, val in self.SETUP:
+			self._wreg(reg, val)
 		self.antenna_on()
 
+	#soft power-down: oscillator, receiver and RF field off, all registers keep their contents
+	def power_down(self):
+		self._wreg(0x01, 0x10)
+
+	#leave soft power-down, returns once the oscillator runs again (PowerDown reads 0)
+	def power_up(self):
+
+		self._wreg(0x01, 0x00)
+		i = 100
+		while (self._rreg(0x01) & 0x10) and i:
+			i -= 1
+		if self._rreg(0x2A) != 0x8D:
+			self.restore()
+
 	def reset(self):
 		self._wreg(0x01, 0x0F)
+		self._bf = 0
+		self._ien = None
 
 	def antenna_on(self, on=True):
 
@@ -168,19 +353,66 @@ class MFRC522:
 		else:
 			self._cflags(0x14, 0x03)
 
-	def request(self, mode):
+	#allocation free variant of request() for the idle poll loop, the answer length is left in self.bits
+	def detect(self, mode):
 
-		self._wreg(0x0D, 0x07)
-		(stat, recv, bits) = self._tocard(0x0C, [mode])
+		self._framing(0x07)
+		self._tx[1] = mode
+		stat = self._frame(0x0C, 1)
+
+		#ATQAs of different tags may collide, that is still a tag
+		if (stat != self.OK and stat != self.COLLERR) | (self.bits != 0x10):
+			return self.ERR
 
-		if (stat != self.OK) | (bits != 0x10):
+		return self.OK
+
+	#IRQ driven detection: irq_arm() sends a REQA and returns immediately, the IRQ output goes
+	#low as soon as a card answers, so the host can sleep instead of polling the bus.
+	#shared: several readers on one IRQ line (wired-OR with a pull-up), the pin is open drain then
+	def irq_setup(self, shared=False):
+		self._wreg(0x03, 0x00 if shared else 0x80) #DivIEnReg: IRQ pin open drain / push-pull
+
+	def irq_arm(self, mode):
+
+		self._ien = None
+		self._wreg(0x02, 0x80) #ComIEnReg: IRqInv, no sources yet
+		self._wreg(0x01, 0x00)
+		self._wreg(0x04, 0x7F) #clear all ComIrqReg bits, the IRQ line goes inactive
+		self._wreg(0x0A, 0x80) #flush FIFO
+		self._tx[1] = mode
+		self._wfifo(1)
+		self._wreg(0x02, 0xA0) #ComIEnReg: IRqInv | RxIEn
+		self._wreg(0x01, 0x0C)
+		self._bf = 0x07
+		self._wreg(0x0D, 0x87) #StartSend, 7 bit frame
+
+	#evaluate a request started with irq_arm(), OK when a card answered with an ATQA
+	def irq_result(self):
+
+		stat = self.NOTAGERR
+		self.bits = 0
+		if self._rreg(0x04) & 0x20:
+			st = self._rregs(self._q_status)
 			stat = self.ERR
+			if (st[1] & 0x13) == 0x00 and st[2] == 2 and (st[3] & 0x07) == 0:
+				self.bits = 0x10
+				stat = self.OK
+		self._wreg(0x02, 0x80)
+		self._ien = None
+		self._wreg(0x01, 0x00)
+		self._framing(0x07)
+
+		return stat
+
+	def request(self, mode):
+
+		stat = self.detect(mode)
 
-		return stat, bits
+		return stat, self.bits
 
 	def requestRawAnswer(self, mode):
 
-		self._wreg(0x0D, 0x07)
+		self._framing(0x07)
 		(stat, recv, bits) = self._tocard(0x0C, [mode])
 
 		if (stat != self.OK):
@@ -188,79 +420,306 @@ class MFRC522:
 
 		return stat, recv, bits
 
-	def anticoll(self):
+	#anticollision into a caller supplied buffer of 5 bytes (4 UID bytes + BCC)
+	def anticoll_into(self, buf):
 
 		ser_chk = 0
-		ser = [0x93, 0x20]
-
-		self._wreg(0x0D, 0x00)
-		(stat, recv, bits) = self._tocard(0x0C, ser)
+		self._framing(0x00)
+		self._tx[1] = 0x93
+		self._tx[2] = 0x20
+		stat = self._frame(0x0C, 2)
 
 		if stat == self.OK:
-			if len(recv) == 5:
+			if self.rlen == 5:
 				for i in range(4):
-					ser_chk = ser_chk ^ recv[i]
-				if ser_chk != recv[4]:
+					ser_chk = ser_chk ^ self._rx[i + 1]
+				if ser_chk != self._rx[5]:
 					stat = self.ERR
+				else:
+					for i in range(5):
+						buf[i] = self._rx[i + 1]
 			else:
 				stat = self.ERR
 
-		return stat, recv
+		return stat
+
+	def anticoll(self):
+
+		recv = [0] * 5
+		stat = self.anticoll_into(recv)
+
+		return stat, recv if stat == self.OK else [self._rx[i + 1] for i in range(self.rlen)]
 	#PICC_HALT https://www.rubydoc.info/gems/mfrc522/0.0.1/Mfrc522#picc_halt-instance_method:
 	def halt(self):
 		PICC_HALT = 0x50
-		buf = [PICC_HALT, 0x00]
-		buf += self._crc(buf)
-		(stat, recv, bits) = self._tocard(0x0C, buf)
-		return self.OK if (stat == self.OK) and (bits == 0x18) else self.ERR	
+		self._tx[1] = PICC_HALT
+		self._tx[2] = 0x00
+		stat = self._frame(0x0C, self._crc_tx(2))
+		return self.OK if (stat == self.OK) and (self.bits == 0x18) else self.ERR
 
 	#PICC_WUPA =0x52
 	#REQuest command, Type A. Invites PICCs in state IDLE to go to READY and prepare for anticollision or selection. 7 bit frame.
 	def wake(self):
 		PICC_WUPA = 0x52
-		(stat, recv, bits) = self._tocard(0x0C, [PICC_WUPA])
-		return self.OK if (stat == self.OK) and (bits == 0x18) else self.ERR
+		self._tx[1] = PICC_WUPA
+		stat = self._frame(0x0C, 1)
+		return self.OK if (stat == self.OK) and (self.bits == 0x18) else self.ERR
 
 
+	#SELECT of cascade level sel (0x93, 0x95, 0x97) with the bytes in _cl, returns the SAK or -1
+	def _select_level(self, sel):
+
+		tx = self._tx
+		tx[1] = sel
+		tx[2] = 0x70
+		for i in range(5):
+			tx[i + 3] = self._cl[i]
+		stat = self._frame(0x0C, self._crc_tx(7))
+		return self._rx[1] if (stat == self.OK) and (self.bits == 0x18) else -1
+
+	#select the tag with this uid: 4, 7 or 10 bytes, or 4 + BCC as anticoll() returns them. Needs no
+	#anticollision before, the tag only has to be READY. Other tags in the field are left out
 	def select_tag(self, ser):
 
-		buf = [0x93, 0x70] + ser[:5]
-		buf += self._crc(buf)
-		(stat, recv, bits) = self._tocard(0x0C, buf)
-		return self.OK if (stat == self.OK) and (bits == 0x18) else self.ERR
+		n = 4 if len(ser) == 5 else len(ser)
+		cl = self._cl
+		i = 0
+		for sel in (0x93, 0x95, 0x97):
+			#every level but the last starts with the cascade tag 0x88
+			k = 0
+			if n - i > 4:
+				cl[0] = 0x88
+				k = 1
+			for j in range(k, 4):
+				cl[j] = ser[i]
+				i += 1
+			cl[4] = cl[0] ^ cl[1] ^ cl[2] ^ cl[3]
+			sak = self._select_level(sel)
+			if sak < 0:
+				return self.ERR
+			if i >= n:
+				return self.OK
+		return self.ERR
+
+	#anticollision of one cascade level (ISO 14443-3): the UID bytes + BCC end up in _cl. On a bit
+	#collision the tags with a 1 at that bit go on, the others drop out until the next round
+	def _anticoll_level(self, sel):
+
+		tx = self._tx
+		rx = self._rx
+		cl = self._cl
+		known = 0
+		self._cflags(0x0E, 0x80) #CollReg: bits after a collision are received as 0
+		for _ in range(33):
+			nb = known >> 3
+			lb = known & 7
+			n = nb + (1 if lb else 0)
+			tx[1] = sel
+			tx[2] = ((nb + 2) << 4) | lb #NVB: bytes and bits sent
+			for i in range(n):
+				tx[i + 3] = cl[i]
+			self._framing((lb << 4) | lb) #RxAlign and TxLastBits
+			stat = self._frame(0x0C, n + 2)
+			if stat != self.OK and stat != self.COLLERR:
+				break
+			#the answer continues the last byte sent, its first lb bits are ours
+			m = (0xFF << lb) & 0xFF
+			for i in range(min(self.rlen, 5 - nb)):
+				cl[nb + i] = (cl[nb + i] & ~m) | (rx[i + 1] & m) if i == 0 else rx[i + 1]
+			if stat == self.OK:
+				self._framing(0x00)
+				return self.OK if cl[0] ^ cl[1] ^ cl[2] ^ cl[3] == cl[4] else self.ERR
+			coll = self._rreg(0x0E)
+			#CollPos counts from the first bit of the FIFO (the RxAlign bits included), 0 = 32
+			pos = (nb << 3) + ((coll & 0x1F) or 32)
+			if (coll & 0x20) or pos <= known or pos > 32:
+				break
+			known = pos
+			cl[(pos - 1) >> 3] |= 1 << ((pos - 1) & 7)
+		self._framing(0x00)
+		return self.ERR
+
+	#full anticollision over all cascade levels, the tag that wins ends up selected (ACTIVE).
+	#Returns (stat, uid) with 4, 7 or 10 UID bytes
+	def select_any(self):
+
+		uid = bytearray(10)
+		n = 0
+		for sel in (0x93, 0x95, 0x97):
+			if self._anticoll_level(sel) != self.OK:
+				break
+			sak = self._select_level(sel)
+			if sak < 0:
+				break
+			cl = self._cl
+			if not sak & 0x04:
+				uid[n:n + 4] = cl[0:4]
+				return self.OK, bytes(uid[:n + 4])
+			#UID not complete, the level started with the cascade tag
+			uid[n:n + 3] = cl[1:4]
+			n += 3
+		return self.ERR, None
+
+	#every tag in the field (e.g. a wallet with several cards): one after the other is selected and
+	#halted, until no tag answers a REQA anymore. The tags must be READY (after detect() or wake()).
+	#Returns their uids, the tags are left halted: wake() and select_tag() to talk to one of them
+	def tags(self, limit=4):
+
+		uids = []
+		while len(uids) < limit:
+			stat, uid = self.select_any()
+			if stat != self.OK:
+				break
+			uids.append(uid)
+			self.halt()
+			if self.detect(self.REQIDL) != self.OK:
+				break
+		return uids
 
 	def auth(self, mode, addr, sect, ser):
-		return self._tocard(0x0E, [mode, addr] + sect + ser[:4])[0]
+
+		tx = self._tx
+		tx[1] = mode
+		tx[2] = addr
+		for i in range(6):
+			tx[i + 3] = sect[i]
+		#7 and 10 byte UIDs authenticate with their last 4 bytes
+		o = len(ser) - 4 if len(ser) > 5 else 0
+		for i in range(4):
+			tx[i + 9] = ser[o + i]
+		return self._frame(0x0E, 12)
 
 	def stop_crypto1(self):
 		self._cflags(0x08, 0x08)
 
+	#read a block into a caller supplied buffer, 16 bytes from off
+	def readinto(self, addr, buf, off=0):
+
+		self._tx[1] = 0x30
+		self._tx[2] = addr
+		stat = self._frame(0x0C, self._crc_tx(2))
+		if stat == self.OK:
+			for i in range(self.rlen):
+				buf[off + i] = self._rx[i + 1]
+		return stat
+
 	def read(self, addr):
 
-		data = [0x30, addr]
-		data += self._crc(data)
-		(stat, recv, _) = self._tocard(0x0C, data)
-		return recv if stat == self.OK else None
+		self._tx[1] = 0x30
+		self._tx[2] = addr
+		stat = self._frame(0x0C, self._crc_tx(2))
+		return [self._rx[i + 1] for i in range(self.rlen)] if stat == self.OK else None
 
-	def write(self, addr, data):
+	def _ack(self, stat):
+		return stat == self.OK and self.bits == 4 and (self._rx[1] & 0x0F) == 0x0A
 
-		buf = [0xA0, addr]
-		buf += self._crc(buf)
-		(stat, recv, bits) = self._tocard(0x0C, buf)
+	#data can be any buffer with at least 16 bytes from off (list, bytes, bytearray, memoryview)
+	def write(self, addr, data, off=0):
 
-		if not (stat == self.OK) or not (bits == 4) or not ((recv[0] & 0x0F) == 0x0A):
+		tx = self._tx
+		tx[1] = 0xA0
+		tx[2] = addr
+		stat = self._frame(0x0C, self._crc_tx(2))
+
+		if not self._ack(stat):
 			stat = self.ERR
 		else:
-			buf = []
 			for i in range(16):
-				buf.append(data[i])
-			buf += self._crc(buf)
-			(stat, recv, bits) = self._tocard(0x0C, buf)
-			if not (stat == self.OK) or not (bits == 4) or not ((recv[0] & 0x0F) == 0x0A):
+				tx[i + 1] = data[off + i]
+			stat = self._frame(0x0C, self._crc_tx(16))
+			if not self._ack(stat):
 				stat = self.ERR
 
 		return stat
 
+	#access conditions and user byte of a sector trailer (its bytes 6-9), see trailer().
+	#LOCKED: data blocks read with key A or B, written with key B, the trailer only written with key B.
+	#OPEN: transport configuration, key A can do everything
+	ACCESS_LOCKED = b'\x78\x77\x88\x69'
+	ACCESS_OPEN = b'\xff\x07\x80\x69'
+
+	#sector trailer into buf at off: key A, access (ACCESS_LOCKED, ACCESS_OPEN), key B
+	@staticmethod
+	def trailer(buf, keya, access, keyb, off=0):
+
+		for i in range(6):
+			buf[off + i] = keya[i]
+			buf[off + 10 + i] = keyb[i]
+		for i in range(4):
+			buf[off + 6 + i] = access[i]
+		return buf
+
+	#Sector operations: one authentication for the sector, then count blocks from block first of it
+	#(the 4th block is the sector trailer) from/into one buffer, 16 bytes per block starting at off.
+	#status: a buffer that gets the status of each block at its block number (bytearray(64) for a
+	#whole card), e.g. to see which block of an enrollment failed. A failed block ends the operation,
+	#the tag left the authenticated state: the blocks after it get its status too.
+	#Returns OK or the status of the first block that failed
+	def _sector(self, op, sector, buf, key, ser, mode, first, count, off, status):
+
+		blk = sector * 4 + first
+		stat = self.auth(mode, blk, key, ser)
+		for b in range(blk, blk + count):
+			if stat == self.OK:
+				stat = op(b, buf, off)
+				off += 16
+			if status is not None:
+				status[b] = stat
+		return stat
+
+	def read_sector(self, sector, buf, key, ser, mode=AUTHENT1A, first=0, count=4, off=0, status=None):
+		return self._sector(self.readinto, sector, buf, key, ser, mode, first, count, off, status)
+
+	def write_sector(self, sector, data, key, ser, mode=AUTHENT1B, first=0, count=4, off=0, status=None):
+		return self._sector(self.write, sector, data, key, ser, mode, first, count, off, status)
+
+	#read the blocks back and compare them with data (the keys of a trailer read as zeros, so
+	#count=3 checks the data blocks only). ERR for a block that differs
+	def verify_sector(self, sector, data, key, ser, mode=AUTHENT1A, first=0, count=3, off=0, status=None):
+		return self._sector(self._verify, sector, data, key, ser, mode, first, count, off, status)
+
+	def _verify(self, addr, data, off):
+
+		vb = self._vb
+		stat = self.readinto(addr, vb)
+		if stat == self.OK:
+			for i in range(16):
+				if vb[i] != data[off + i]:
+					return self.ERR
+		return stat
+
+	#the tag dropped out of the authenticated state after a failed sector: wake it up and select
+	#it again for the next one (a woken tag ignores the next wake-up, so up to two)
+	def _reselect(self, ser):
+
+		self.stop_crypto1()
+		for _ in range(2):
+			if self.detect(self.REQALL) == self.OK and self.select_tag(ser) == self.OK:
+				return True
+		return False
+
+	#Whole card operations: the sectors in the list one after the other, each with the key of the
+	#same index in keys, buf holds count blocks per sector in that order. A sector that fails does
+	#not stop the others (the tag is selected again). status as above, returns OK if every block was
+	def _card(self, op, sectors, buf, keys, ser, status, mode, first, count):
+
+		stat = self.OK
+		for k in range(len(sectors)):
+			if op(sectors[k], buf, keys[k], ser, mode, first, count, k * count * 16, status) != self.OK:
+				stat = self.ERR
+				if not self._reselect(ser):
+					break
+		return stat
+
+	def read_card(self, sectors, buf, keys, ser, status=None, mode=AUTHENT1A, first=0, count=4):
+		return self._card(self.read_sector, sectors, buf, keys, ser, status, mode, first, count)
+
+	def write_card(self, sectors, data, keys, ser, status=None, mode=AUTHENT1B, first=0, count=4):
+		return self._card(self.write_sector, sectors, data, keys, ser, status, mode, first, count)
+
+	def verify_card(self, sectors, data, keys, ser, status=None, mode=AUTHENT1A, first=0, count=3):
+		return self._card(self.verify_sector, sectors, data, keys, ser, status, mode, first, count)
+
 	def checkChinaUID(self):
 		answer = False
 		#try to send magic command to the sector 0 
@@ -287,27 +746,7 @@ class MFRC522:
 	#https://learn.adafruit.com/adafruit-pn532-rfid-nfc/ndef
 	def setKey(self,sector,keya,keyb):
 		#https://www.az-delivery.de/blogs/azdelivery-blog-fur-arduino-und-raspberry-pi/zugangsbeschrankung-zu-geraten-per-contactless-card-mit-der-nodemcu-und-dem-rc522-modul-vierter-teil-down-the-rabbit-hole?ls=de&cache=false
-		sectorkeytable = [3,7,11,15,19,23,27,31,35,39,43,47,51,55,59,63]
-		key = []
-		key.extend(keya[:6])
-		key.append(0x78) #Data Block 0-3 Access Conditions: Key B write / Key A Read
-		key.append(0x77) #KEY A & KEY B & Acces Bits Write:Key B  / Key A Read Access Bits
-		key.append(0x88) #Calculator: http://calc.gmss.ru/Mifare1k/
-		key.append(0x69) #Fixer Wert - > default hex 69
-		key.extend(keyb[:6])
-		
-		#print(key)
-		self.write(sectorkeytable[sector], key)
+		#Access bits calculator: http://calc.gmss.ru/Mifare1k/
+		return self.write(sector * 4 + 3, self.trailer(self._vb, keya, self.ACCESS_LOCKED, keyb))
 	def reSetKeyOpen(self,sector,keya,keyb):
-		#https://www.az-delivery.de/blogs/azdelivery-blog-fur-arduino-und-raspberry-pi/zugangsbeschrankung-zu-geraten-per-contactless-card-mit-der-nodemcu-und-dem-rc522-modul-vierter-teil-down-the-rabbit-hole?ls=de&cache=false
-		sectorkeytable = [3,7,11,15,19,23,27,31,35,39,43,47,51,55,59,63]
-		key = []
-		key.extend(keya[:6])
-		key.append(0xFF) #Data Block 0-3 Access Conditions: Key B write / Key A Read
-		key.append(0x07) #KEY A & KEY B & Acces Bits Write:Key B  / Key A Read Access Bits
-		key.append(0x80) #Calculator: http://calc.gmss.ru/Mifare1k/
-		key.append(0x69) #Fixer Wert - > default hex 69
-		key.extend(keyb[:6])
-		
-		#print(key)
-		self.write(sectorkeytable[sector], key)		
\ No newline at end of file
+		return self.write(sector * 4 + 3, self.trailer(self._vb, keya, self.ACCESS_OPEN, keyb))		
\ No newline at end of file
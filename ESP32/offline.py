@@ -0,0 +1,131 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# Offline grants: after a successful tap auth.php hands out a grant for this tag and device,
+# signed with $offline_grant_key. It holds the anti-tamper text the tag carries now and a
+# spare one for a single offline tap. If the server does not answer, the reader checks the
+# tag against the grant, writes the spare text and opens the door itself. The tap is
+# reported to auth.php ("offline" command) as soon as it answers again, until then the
+# grant stays pending and is not used a second time.
+
+import time
+import ubinascii
+import uhashlib
+import ujson
+
+#signed fields, in this order, joined with "|" (same as offline_grant() in auth.php)
+FIELDS = ("uid", "dev", "exp", "blk", "rkey", "wkey", "txt", "otxt")
+
+
+def hmac_sha256(key, msg):
+    if len(key) > 64:
+        key = uhashlib.sha256(key).digest()
+    key = key + bytes(64 - len(key))
+    inner = uhashlib.sha256(bytes(b ^ 0x36 for b in key))
+    inner.update(msg)
+    outer = uhashlib.sha256(bytes(b ^ 0x5C for b in key))
+    outer.update(inner.digest())
+    return outer.digest()
+
+
+def signature(key, grant):
+    msg = "|".join(str(grant[f]) for f in FIELDS)
+    return ubinascii.hexlify(hmac_sha256(key, msg.encode())).decode()
+
+
+class GrantCache:
+    """Grants by uid, least recently used first, stored in a json file on flash."""
+
+    def __init__(self, path, key, device_id, size=16):
+        self.path = path
+        self.key = key
+        self.device_id = device_id
+        self.size = size
+        self.grants = {}
+        self.order = []     #uids, least recently used first
+        self.unreported = {} #uid -> spare text written during an offline tap, not reported yet
+        self.offset = None  #server time - time.time(), unknown until the server answered once
+        self.known = None   #server time that has passed for sure: the last answer or save
+        try:
+            with open(path) as f:
+                d = ujson.load(f)
+            self.grants = d["grants"]
+            self.order = d["order"]
+            self.unreported = d["unreported"]
+            self.offset = d["offset"]
+            self.known = d["time"]
+        except (OSError, ValueError, KeyError):
+            pass
+        if self.offset is not None and time.time() + self.offset < self.known:
+            #the RTC started over (power cycle): at least the time since boot has passed since the last save,
+            #how long the reader was off is unknown. Counting it as nothing keeps grants usable through an
+            #outage that took the power and the network; each one still opens the door once.
+            self.offset = self.known - time.time()
+
+    def _save(self):
+        self.known = self.now()
+        with open(self.path, "w") as f:
+            ujson.dump({"grants": self.grants, "order": self.order, "unreported": self.unreported,
+                        "offset": self.offset, "time": self.known}, f)
+
+    def _drop(self, uid):
+        if uid in self.grants:
+            self.order.remove(uid)
+            del self.grants[uid]
+
+    def now(self):
+        """Server time, None if the reader never talked to the server."""
+        if self.offset is None:
+            return None
+        return time.time() + self.offset
+
+    def put(self, grant, server_now):
+        """Store a grant from auth.php, False if it is not for us or the signature is wrong."""
+        self.offset = server_now - time.time()
+        if grant.get("dev") != self.device_id or grant.get("sig") != signature(self.key, grant):
+            return False
+        uid = grant["uid"]
+        self._drop(uid)
+        self.grants[uid] = grant
+        self.order.append(uid)
+        while len(self.order) > self.size:
+            self._drop(self.order[0])
+        self._save()
+        return True
+
+    def get(self, uid):
+        """Usable grant for uid or None (none stored, expired or the clock is unknown)."""
+        g = self.grants.get(uid)
+        now = self.now()
+        if g is None or now is None or now > g["exp"]:
+            return None
+        self.order.remove(uid)
+        self.order.append(uid)
+        return g
+
+    def forget(self, uid):
+        """Drop the grant of uid, the tag does not carry its text anymore."""
+        if uid in self.grants:
+            self._drop(uid)
+            self._save()
+
+    def use(self, uid):
+        """The tag carries the spare text now: one offline tap per grant."""
+        self.unreported[uid] = self.grants[uid]["otxt"]
+        self._drop(uid)
+        self._save()
+
+    def pending(self):
+        """(uid, spare text) of the offline taps auth.php does not know about yet."""
+        return list(self.unreported.items())
+
+    def reported(self, uid):
+        del self.unreported[uid]
+        self._save()
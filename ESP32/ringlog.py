@@ -0,0 +1,61 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# The last log lines of main.py in a fixed piece of RAM: a new line overwrites the oldest ones,
+# nothing is allocated after the start. On the REPL logs.dump() prints them, auth.php can ask
+# the reader to send them ($reader_log_devices in configuration.php).
+
+class RingLog:
+    """Lines of text in a ring of size bytes."""
+
+    def __init__(self, size=2048):
+        self.buf = bytearray(size)
+        self.pos = 0        #where the next line goes
+        self.full = False   #the ring went round at least once, the oldest line is cut
+
+    def write(self, line):
+        """Add a line, longer ones keep their end."""
+        b = line.encode() if isinstance(line, str) else line
+        size = len(self.buf)
+        if len(b) >= size:
+            b = b[len(b) - size + 1:]
+        n = min(len(b), size - self.pos)
+        self.buf[self.pos:self.pos + n] = b[:n]
+        self.buf[:len(b) - n] = b[n:]
+        end = self.pos + len(b)
+        if end >= size:
+            self.full = True
+        self.buf[end % size] = 10
+        self.pos = (end + 1) % size
+        if self.pos == 0:
+            self.full = True
+
+    def lines(self):
+        """The whole lines in the ring, oldest first."""
+        if self.full:
+            #the byte before pos is always the newline of the latest line, whether the bytes from pos on
+            #are the start of a line got lost with what overwrote it: drop them up to the first newline,
+            #unless that is the end of the latest line (cut by write() to the size of the ring)
+            data = bytes(self.buf[self.pos:]) + bytes(self.buf[:self.pos])
+            i = data.find(b"\n") + 1
+            if i < len(data):
+                data = data[i:]
+        else:
+            data = bytes(self.buf[:self.pos])
+        return [str(l, "utf-8", "ignore") for l in data.split(b"\n") if l]
+
+    def dump(self):
+        """Print the lines (REPL)."""
+        for l in self.lines():
+            print(l)
+
+    def clear(self):
+        self.pos = 0
+        self.full = False
@@ -0,0 +1,95 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# Per-tap latency tracing. The tap is cut into spans with lap(): each call closes the span
+# since the previous one under the given phase. The spans go into a preallocated buffer, so
+# tracing does not allocate while the tap runs. finish() turns them into a one line summary
+#   <uid> <total ms> <phase>:<ms>,<phase>:<ms>,...
+# that is sent along with the next request of the same device_id to auth.php, which appends it
+# to $tap_trace_log. main.py adds one line per start with "boot" as uid (see fastboot.py).
+# The total runs from the detection to the last span, the LED/sleep time after a tap is not in it.
+
+import array
+import time
+
+#phases, the numbers index NAMES
+DETECT = 0      #REQA/WUPA that found the tag
+CHINA = 1       #checkChinaUID() and reporting a magic tag
+ANTICOLL = 2
+SELECT = 3
+STAGE1 = 4      #stage1 request (or the cached answer of a known tag)
+RF = 5          #auth/read/write on the tag
+STAGE2 = 6      #stage2 or sess2 request
+HELD = 7        #waiting for a long tap
+STAGE3 = 8      #stage3 or sess3 request
+STAGE4 = 9
+CODE = 10       #PIN/GAuth entry on the keypad
+PROVISION = 11  #init/reset of the sectors
+OFFLINE = 12    #offline grant used
+NAMES = ("det", "ch", "ac", "sel", "s1", "rf", "s2", "held", "s3", "s4", "code", "prov", "off")
+
+
+class Tracer:
+
+    def __init__(self, size=24, keep=4):
+        self.phases = bytearray(size)
+        self.us = array.array("I", bytes(4 * size))
+        self.n = 0
+        self.t0 = self.t = time.ticks_us()
+        self.keep = keep    #summaries waiting to be sent, the oldest are dropped. 0 = none are kept
+        self.pending = []   #(device_id, summary)
+        self.attached = []
+
+    def begin(self):
+        """Start of a (possible) tap, called right before the detection."""
+        self.n = 0
+        self.t0 = self.t = time.ticks_us()
+
+    def lap(self, phase):
+        """Close the span since the previous lap() as phase. A phase following itself is merged."""
+        t = time.ticks_us()
+        d = time.ticks_diff(t, self.t)
+        self.t = t
+        n = self.n
+        if n and self.phases[n - 1] == phase:
+            self.us[n - 1] += d
+        elif n < len(self.phases):
+            self.phases[n] = phase
+            self.us[n] = d
+            self.n = n + 1
+
+    def finish(self, uid, device_id):
+        """Summary line of the tap, queued for the next request of device_id."""
+        spans = ",".join("%s:%d.%d" % (NAMES[self.phases[i]], self.us[i] // 1000, self.us[i] % 1000 // 100)
+                         for i in range(self.n))
+        s = "%s %d %s" % (uid, time.ticks_diff(self.t, self.t0) // 1000, spans)
+        self.n = 0
+        self.note(device_id, s)
+        return s
+
+    def note(self, device_id, s):
+        """Queue a summary line of another kind (e.g. the boot time) for the next request of device_id."""
+        if self.keep:
+            self.pending.append((device_id, s))
+            if len(self.pending) > self.keep:
+                self.pending.pop(0)
+
+    def attach(self, js):
+        """Add the summaries waiting for the device of the request js."""
+        self.attached = [p for p in self.pending if p[0] == js["device_id"]]
+        if self.attached:
+            js["trace"] = [p[1] for p in self.attached]
+
+    def sent(self):
+        """The request with the summaries got an answer, drop them."""
+        for p in self.attached:
+            if p in self.pending:
+                self.pending.remove(p)
+        self.attached = []
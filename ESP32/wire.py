@@ -0,0 +1,126 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# Compact binary encoding of the requests and answers (useBinaryWire in main.py): the subset of
+# CBOR (RFC 8949) the protocol needs, maps, arrays, text and byte strings, integers, true, false
+# and null. Keys and block contents travel as byte strings, they go into the MFRC522 buffers
+# without unhexlify/encode. A streamed init/reset answer is a sequence of CBOR items, decode()
+# tells when the bytes received so far do not hold a whole item yet.
+# auth.php does the same in cbor.php, the requests carry Content-Type: application/cbor.
+
+CONTENT_TYPE = "application/cbor"
+
+
+def _head(out, major, n):
+    if n < 24:
+        out.append(major << 5 | n)
+    elif n < 0x100:
+        out.append(major << 5 | 24)
+        out.append(n)
+    elif n < 0x10000:
+        out.append(major << 5 | 25)
+        out.extend(n.to_bytes(2, "big"))
+    elif n < 0x100000000:
+        out.append(major << 5 | 26)
+        out.extend(n.to_bytes(4, "big"))
+    else:
+        out.append(major << 5 | 27)
+        out.extend(n.to_bytes(8, "big"))
+
+
+def _encode(out, v):
+    if v is None:
+        out.append(0xF6)
+    elif v is True:
+        out.append(0xF5)
+    elif v is False:
+        out.append(0xF4)
+    elif isinstance(v, int):
+        if v >= 0:
+            _head(out, 0, v)
+        else:
+            _head(out, 1, -1 - v)
+    elif isinstance(v, (bytes, bytearray, memoryview)):
+        _head(out, 2, len(v))
+        out.extend(v)
+    elif isinstance(v, str):
+        b = v.encode()
+        _head(out, 3, len(b))
+        out.extend(b)
+    elif isinstance(v, dict):
+        _head(out, 5, len(v))
+        for k in v:
+            _encode(out, k)
+            _encode(out, v[k])
+    elif isinstance(v, (list, tuple)):
+        _head(out, 4, len(v))
+        for x in v:
+            _encode(out, x)
+    else:
+        raise TypeError("CBOR: %s" % type(v))
+
+
+def dumps(v):
+    """CBOR encoding of v."""
+    out = bytearray()
+    _encode(out, v)
+    return out
+
+
+def decode(buf, i=0):
+    """(item, index after it) of the item at buf[i]. EOFError if buf ends before the item does."""
+    if i >= len(buf):
+        raise EOFError
+    ib = buf[i]
+    i += 1
+    major = ib >> 5
+    n = ib & 0x1F
+    if n >= 24:
+        if n > 27:
+            raise ValueError("CBOR: %02x" % ib)
+        k = 1 << (n - 24)
+        if i + k > len(buf):
+            raise EOFError
+        n = int.from_bytes(bytes(buf[i:i + k]), "big")
+        i += k
+    if major == 0:
+        return n, i
+    if major == 1:
+        return -1 - n, i
+    if major == 2 or major == 3:
+        if i + n > len(buf):
+            raise EOFError
+        v = bytes(buf[i:i + n])
+        return (v if major == 2 else v.decode()), i + n
+    if major == 4:
+        v = []
+        for _ in range(n):
+            x, i = decode(buf, i)
+            v.append(x)
+        return v, i
+    if major == 5:
+        v = {}
+        for _ in range(n):
+            k, i = decode(buf, i)
+            v[k], i = decode(buf, i)
+        return v, i
+    if major == 7 and 20 <= n <= 22:
+        return (False, True, None)[n - 20], i
+    raise ValueError("CBOR: %02x" % ib)
+
+
+def loads(buf):
+    """The item buf holds."""
+    return decode(buf)[0]
+
+
+def is_cbor(buf):
+    """An answer in CBOR starts with a map, one in JSON with "{"; anything else is an error text."""
+    return len(buf) > 0 and 0xA0 <= buf[0] <= 0xBB
@@ -20,16 +20,27 @@ if (isset($_GET["QR"])) {
 }
 
 $json = file_get_contents('php://input');
-$post = json_decode($json,true);
+//readers with useBinaryWire send CBOR and get their answers in CBOR (see cbor.php)
+$cbor = isset($_SERVER["CONTENT_TYPE"]) && $_SERVER["CONTENT_TYPE"] == "application/cbor";
+if ($cbor) {
+	include('cbor.php');
+	$i = 0;
+	$post = cbor_decode($json,$i);
+} else {
+	$post = json_decode($json,true);
+}
 if(!is_array($post)){
     die('Received content contained invalid JSON!');
 }
+if ($cbor) {
+	header("Content-Type: application/cbor");
+}
 
 $uid = $post["uid"];
 $cmd = $post["cmd"];
 $device_id = $post["device_id"];
 
-if ((!isset($uid) && $cmd != "keyauth") ||  $cmd == "" || $device_id == "") {
+if ((!isset($uid) && $cmd != "keyauth" && $cmd != "log" && $cmd != "events") ||  $cmd == "" || $device_id == "") {
 	die('Not enough arguments! Sorry mate :)');
 }
 
@@ -42,9 +53,39 @@ if (array_key_exists("doorcmd",$post)) {
 if (array_key_exists("gcode",$post)) {
 	$gcode=$post["gcode"];
 }
+//reader wants an offline grant with the answer (see offline_grant)
+$want_grant = array_key_exists("grant",$post) && $post["grant"];
+//reader parses init/reset answers line by line (see emit_line)
+$stream = array_key_exists("stream",$post) && $post["stream"];
 
 include('configuration.php');
 
+//timing summaries of earlier taps (trace.py on the reader), one line per tap:
+//date device_id uid total_ms phase:ms,phase:ms,...
+if (array_key_exists("trace",$post) && is_array($post["trace"]) && $tap_trace_log != "") {
+	$lines = "";
+	$dev = preg_replace('/[^\w.-]/', '_', $device_id);
+	foreach ($post["trace"] as $t) {
+		$lines .= date("Y-m-d H:i:s")." ".$dev." ".preg_replace('/[^0-9a-z.:, -]/', '', strval($t))."\n";
+	}
+	file_put_contents($tap_trace_log, $lines, FILE_APPEND);
+}
+
+//log lines of a reader (ringlog.py), sent after a tap because an answer asked for them (see answer):
+//date device_id ms_since_start level text
+if ($cmd=="log") {
+	if (array_key_exists("lines",$post) && is_array($post["lines"]) && $reader_log != "") {
+		$lines = "";
+		$dev = preg_replace('/[^\w.-]/', '_', $device_id);
+		foreach ($post["lines"] as $l) {
+			$lines .= date("Y-m-d H:i:s")." ".$dev." ".preg_replace('/[^\x20-\x7e]/', '?', strval($l))."\n";
+		}
+		file_put_contents($reader_log, $lines, FILE_APPEND);
+	}
+	answer(array("status"=>"ok"));
+	return;
+}
+
 $keys=json_decode(file_get_contents($json_rfid_userdb),true);
 
 function generate_antitamper_txt($name,$num) {
@@ -73,7 +114,54 @@ if ($cmd=="chinauid" && $uid != "") {
 		$name = "unknown";
 	}
 	china_uid_detected($device_id,$uid,$name);
-	echo json_encode(array("status"=>"err"));
+	answer(array("status"=>"err"));
+	return;
+}
+
+//notifications a reader queued and sends in batches (eventqueue.py), each one like the request it stands for.
+//"t" is the reader's time of the event, "now" its time when sending. "ok" takes all of them, also the ones
+//that lead nowhere: sending them again would not change that
+if ($cmd=="events") {
+	$grants = array();
+	if (array_key_exists("events",$post) && is_array($post["events"])) {
+		$now = array_key_exists("now",$post) ? intval($post["now"]) : 0;
+		$boot = array_key_exists("boot",$post) ? intval($post["boot"]) : null;
+		foreach ($post["events"] as $e) {
+			if (!is_array($e) || !array_key_exists("ev",$e) || !array_key_exists("uid",$e) || !is_string($e["uid"])) {
+				continue;
+			}
+			$dev = array_key_exists("device_id",$e) ? strval($e["device_id"]) : $device_id;
+			$euid = $e["uid"];
+			//seconds since the event, null = unknown: it is from an earlier start of the reader ("b" is not
+			//"boot", its clock may have started over since) or its time is after "now"
+			$ago = null;
+			if (array_key_exists("t",$e) && ($boot === null || (array_key_exists("b",$e) && intval($e["b"]) == $boot))
+				&& intval($e["t"]) <= $now) {
+				$ago = $now - intval($e["t"]);
+			}
+			if ($e["ev"] == "chinauid") {
+				china_uid_detected($dev,$euid,array_key_exists($euid,$keys) ? $keys[$euid]["key_name"] : "unknown");
+			} elseif ($e["ev"] == "seen" && !array_key_exists($euid,$keys)) {
+				//a tag the reader could not ask stage1 about
+				//dated when it came in if its age is unknown
+				file_put_contents ($unknown_uid_log, date("Y-m-d H:i:s",time() - ($ago === null ? 0 : $ago))." ".$euid."\n", FILE_APPEND);
+				unknown_uid_detected($dev,$euid);
+			} elseif ($e["ev"] == "close" && array_key_exists("key",$e) && array_key_exists($euid,$keys) && commit_antitamper($euid,strval($e["key"]))) {
+				//the stage3/sess3 "close" of a long tap, the tag carries the new text either way
+				if (!isset($late_close_s) || ($ago !== null && $ago <= $late_close_s)) {
+					door_command($dev,$euid,"close");
+				}
+				//the offline grant of the reader still has the old text, it gets one for the new text
+				if (array_key_exists("grant",$e) && $e["grant"]) {
+					$g = offline_grant($euid,$dev);
+					if (array_key_exists("grant",$g)) {
+						$grants[] = $g["grant"];
+					}
+				}
+			}
+		}
+	}
+	answer(count($grants) ? array("status"=>"ok","grants"=>$grants,"now"=>time()) : array("status"=>"ok"));
 	return;
 }
 
@@ -93,13 +181,13 @@ if ($cmd=="keyauth") {
 				$verify = $g->validateCode($googlecode);
 				if ($verify) {
 						door_toggle($device_id,$uid);
-						echo json_encode(array("status"=>"kk"));
+						answer(array("status"=>"kk"));
 				} else {
-						echo json_encode(array("status"=>"err"));
+						answer(array("status"=>"err"));
 				}
 				return;
 			} else {
-				echo json_encode(array("status"=>"err"));
+				answer(array("status"=>"err"));
 				return;
 			}
 	}
@@ -108,6 +196,19 @@ if ($cmd=="keyauth") {
 
 }
 
+//several tags in the field at once (a wallet): the reader lists the others in "uids", the tap is
+//about the first one that is configured here. The stage1 answer names it in "uid" then
+$picked = array();
+if ($cmd=="stage1" && array_key_exists("uids",$post) && is_array($post["uids"]) && !array_key_exists($uid,$keys)) {
+	foreach ($post["uids"] as $u) {
+		if (is_string($u) && array_key_exists($u,$keys)) {
+			$uid = $u;
+			$picked = array("uid"=>$uid);
+			break;
+		}
+	}
+}
+
 //NFC Authentication
 //STAGE1: check if the tag UID is configured, if not write the ID to unknown_uids.txt
 if ($cmd=="stage1" && $uid != "") {
@@ -115,11 +216,10 @@ if ($cmd=="stage1" && $uid != "") {
 	        if (array_key_exists("reset",$keys[$uid])) {
 			resetfob($uid);
 		} elseif (array_key_exists("anti_tamper_block_readkey",$keys[$uid])) {
-			//if this key is allowed on the requested device OR if this user doesn't have any device_ids set
-			if (!array_key_exists("device_ids",$keys[$uid]) || in_array("all",$keys[$uid]["device_ids"]) || in_array($device_id,$keys[$uid]["device_ids"])) {
-				echo json_encode(array("status"=>"k","antiblk"=>$keys[$uid]["anti_tamper_block"],"key"=>$keys[$uid]["anti_tamper_block_readkey"],"len"=>$keys[$uid]["anti_tamper_len"]));
+			if (device_allowed($uid,$device_id)) {
+				answer(array_merge(array("status"=>"k","antiblk"=>$keys[$uid]["anti_tamper_block"],"key"=>$keys[$uid]["anti_tamper_block_readkey"],"len"=>$keys[$uid]["anti_tamper_len"]),$picked));
 			} else {
-				echo json_encode(array("status"=>"err","message"=>"You're not allowed on this device!"));
+				answer(array("status"=>"err","message"=>"You're not allowed on this device!"));
 			}
 		} elseif (array_key_exists("key_name",$keys[$uid]) && !array_key_exists("anti_tamper_block_readkey",$keys[$uid])) {
 			initfob($uid);
@@ -128,147 +228,268 @@ if ($cmd=="stage1" && $uid != "") {
 	} else {
 		file_put_contents ($unknown_uid_log, date("Y-m-d H:i:s")." ".$uid."\n", FILE_APPEND);
 		unknown_uid_detected($device_id,$uid);
-		echo json_encode(array("status"=>"err"));
+		answer(array("status"=>"err"));
 	}
 
 //STAGE2: verify the stored key on the tag	
+//A reader that remembered the stage1 parameters of the tag skipped stage1, so the checks of stage1 are
+//repeated here. "forget" tells it to ask stage1 again next time (which also does a pending reset)
 } elseif ($cmd=="stage2" && $uid != "" && $key != "") {
-	if (array_key_exists($uid,$keys)) {
-		if (check_antitamper_txt($keys[$uid]["key_name"],$keys[$uid]["anti_tamper_num"],$key)) {
-			$newnum = rand();
-			$newcode = generate_antitamper_txt($keys[$uid]["key_name"],$newnum);
-			$keys[$uid]["anti_tamper_num_temp"] = $newnum;
-                        $keys[$uid]["anti_tamper_temp_lastset"] = date("Y-m-d H:i:s");
-
-			file_put_contents($json_rfid_userdb,json_encode($keys,JSON_PRETTY_PRINT));
+	if (!array_key_exists($uid,$keys) || array_key_exists("reset",$keys[$uid]) || !device_allowed($uid,$device_id)) {
+		answer(array("status"=>"err","forget"=>1));
+	} elseif (($write = rotate_antitamper($uid,$key)) !== false) {
+		answer(array_merge(array("status"=>"kk"),$write));
+	} else {
+		answer(array("status"=>"err"));
+	}
 
-			echo json_encode(array("status"=>"kk","setantiblk"=>$keys[$uid]["anti_tamper_block"],"key"=>$keys[$uid]["anti_tamper_block_writekey"],"txt"=>$newcode));
+//STAGE3: Last stage for NFC Only authentication, verify the new key the fob has stored and open/close the door
+} elseif ($cmd=="stage3" && $uid != "" && $key != "" && $doorcmd != "") {
+	if (array_key_exists($uid,$keys) && commit_antitamper($uid,$key)) {
+		$req_gauth_numbers = required_code_len($uid);
+		if ($doorcmd == "open" && $req_gauth_numbers > 0) {
+			//if google authenticator or PIN is setup, ask for the code
+			answer(array("status"=>"getcode","num" => $req_gauth_numbers));
+		} elseif ($doorcmd == "open" || $doorcmd == "close") {
+			door_command($device_id,$uid,$doorcmd);
+			answer(array_merge(array("status"=>"done"),$want_grant ? offline_grant($uid,$device_id) : array()));
+		}
+	} else {
+		answer(array("status"=>"err"));
+	}
 
-		} elseif (check_antitamper_txt($keys[$uid]["key_name"],$keys[$uid]["anti_tamper_num_temp"],$key)) {
-			#on some rare race-condition if the user removes the fob at stage stage 3, the new value did get written to the fob but not to the local
-			#database. So we check if the "temp" number is what the fob has stored and we adjust accordingly.
-			$newnum = rand();
-			$newcode = generate_antitamper_txt($keys[$uid]["key_name"],$newnum);
-			$keys[$uid]["anti_tamper_num"] = $keys[$uid]["anti_tamper_num_temp"];
-			$keys[$uid]["anti_tamper_num_temp"] = $newnum;
-			$keys[$uid]["anti_tamper_temp_lastset"] = date("Y-m-d H:i:s");
+//STAGE4: Last stage for NFC+Google Auth Authentication, verify the key on the tag again + verify GoogleAuth Key and PIN(if configured), then open/close the door
+} elseif ($cmd=="stage4" && $uid != "" && $key != "" && $doorcmd != "" && $gcode != "") {
+	if (array_key_exists($uid,$keys) && check_antitamper_txt($keys[$uid]["key_name"],$keys[$uid]["anti_tamper_num"],$key) && check_second_factor($uid,$gcode)) {
+		door_command($device_id,$uid,$doorcmd);
+		answer(array("status"=>"done"));
+	} else {
+		answer(array("status"=>"err"));
+	}
 
-			file_put_contents($json_rfid_userdb,json_encode($keys,JSON_PRETTY_PRINT));
-			file_put_contents ("antitamper_temp_race_condition.txt", date("Y-m-d H:i:s")." ".$uid." ".$keys[$uid]["key_name"]."\n", FILE_APPEND);
-			echo json_encode(array("status"=>"kk","setantiblk"=>$keys[$uid]["anti_tamper_block"],"key"=>$keys[$uid]["anti_tamper_block_writekey"],"txt"=>$newcode));
+//SESSION MODE: the same anti-tamper scheme as stage2-4 in fewer round trips.
+//SESS2: the reader sends the tag content it already read, gets back the write instruction together with
+//the number of keypad digits an "open" needs. The door is not touched yet, that needs the proof that the
+//new key got written (otherwise a simulator that ignores writes would open the door forever).
+} elseif ($cmd=="sess2" && $uid != "" && $key != "") {
+	if (array_key_exists($uid,$keys) && array_key_exists("reset",$keys[$uid])) {
+		//reader skipped stage1 with remembered parameters, but the tag is due for a reset
+		resetfob($uid);
+	} elseif (!array_key_exists($uid,$keys) || !device_allowed($uid,$device_id)) {
+		//the remembered parameters are no good anymore (tag deleted or its device_ids changed)
+		answer(array("status"=>"err","forget"=>1));
+	} elseif (($write = rotate_antitamper($uid,$key)) !== false) {
+		//the reader asks for the code before sess3, so stage3 and stage4 collapse into one request
+		answer(array_merge(array("status"=>"kk","num"=>required_code_len($uid)),$write));
+	} else {
+		answer(array("status"=>"err"));
+	}
 
+//SESS3: verify the new key the fob has stored (+ the code if sess2 asked for one) and open/close the door.
+//The answer carries the stage1 parameters so the reader can skip stage1 on the next tap of this tag.
+} elseif ($cmd=="sess3" && $uid != "" && $key != "" && $doorcmd != "") {
+	if (array_key_exists($uid,$keys) && commit_antitamper($uid,$key)) {
+		$params = array("antiblk"=>$keys[$uid]["anti_tamper_block"],"key"=>$keys[$uid]["anti_tamper_block_readkey"],"len"=>$keys[$uid]["anti_tamper_len"]);
+		if ($doorcmd == "open" && required_code_len($uid) > 0 && !(isset($gcode) && check_second_factor($uid,$gcode))) {
+			answer(array_merge(array("status"=>"err"),$params));
+		} elseif ($doorcmd == "open" || $doorcmd == "close") {
+			door_command($device_id,$uid,$doorcmd);
+			answer(array_merge(array("status"=>"done"),$params,$want_grant ? offline_grant($uid,$device_id) : array()));
 		} else {
-			echo json_encode(array("status"=>"err"));
+			answer(array("status"=>"err"));
 		}
-    } else {
-        echo json_encode(array("status"=>"err"));
+	} else {
+		answer(array("status"=>"err"));
 	}
 
-//STAGE3: Last stage for NFC Only authentication, verify the new key the fob has stored and open/close the door
-} elseif ($cmd=="stage3" && $uid != "" && $key != "" && $doorcmd != "") {
-        if (array_key_exists($uid,$keys)) {
-                if (check_antitamper_txt($keys[$uid]["key_name"],$keys[$uid]["anti_tamper_num_temp"],$key)) {
-					$keys[$uid]["anti_tamper_num"]=$keys[$uid]["anti_tamper_num_temp"];
-					$keys[$uid]["last_use"] = date("Y-m-d H:i:s");
-					$keys[$uid]["used_cnt"] += 1;
-					file_put_contents($json_rfid_userdb,json_encode($keys,JSON_PRETTY_PRINT));
-
-					if ($doorcmd == "open") {
-						//if google authenticator is setup, ask for code
-						if (array_key_exists("gauth_secret",$keys[$uid])) {
-							//if PIN is also setup, tell the reader to ask for 10 numbers (6 GAuth + 4 PIN)
-							if (array_key_exists("gauth_pin",$keys[$uid])) {
-								$req_gauth_numbers = 10;
-							} else {
-								//else, ask the reader for 6 numbers
-								$req_gauth_numbers = 6;
-							}
-							echo json_encode(array("status"=>"getcode","num" => $req_gauth_numbers));
-						//If PIN + NFC is setup
-						} elseif (array_key_exists("nfc_pin",$keys[$uid])) {
-							$req_gauth_numbers = 4;
-							echo json_encode(array("status"=>"getcode","num" => $req_gauth_numbers));
-						} else {
-							door_open($device_id,$uid);
-							echo json_encode(array("status"=>"done"));
-						}
-
-					} elseif ($doorcmd == "close") {
-						door_close($device_id,$uid);
-						echo json_encode(array("status"=>"done"));
-					}
-				} else {
-                    echo json_encode(array("status"=>"err"));
-                }
-        } else {
-                echo json_encode(array("status"=>"err"));
-        }
+//OFFLINE: a reader reports a tap it granted while it could not reach us, the tag now carries the spare text of the grant.
+//"done" also if the tag was back online in the meantime (sess2/stage2 took the spare text already)
+} elseif ($cmd=="offline" && $uid != "" && $key != "") {
+	if (array_key_exists($uid,$keys) && (absorb_offline($uid,$key) || !array_key_exists("anti_tamper_num_offline",$keys[$uid]) || check_antitamper_txt($keys[$uid]["key_name"],$keys[$uid]["anti_tamper_num"],$key))) {
+		offline_opened($device_id,$uid);
+		answer(array("status"=>"done"));
+	} else {
+		answer(array("status"=>"err"));
+	}
+}
 
-//STAGE4: Last stage for NFC+Google Auth Authentication, verify the key on the tag again + verify GoogleAuth Key and PIN(if configured), then open/close the door
-} elseif ($cmd=="stage4" && $uid != "" && $key != "" && $doorcmd != "" && $gcode != "") {
-	if (array_key_exists($uid,$keys)) {
-			if (check_antitamper_txt($keys[$uid]["key_name"],$keys[$uid]["anti_tamper_num"],$key)) {
-				
-				//NFC + GAuth
-				if (array_key_exists("gauth_secret",$keys[$uid])) {
-					if (array_key_exists("gauth_pin",$keys[$uid])) {
-						$pin = substr($gcode,0,4);
-						$googlecode = substr($gcode,4);
-						if ($pin != $keys[$uid]["gauth_pin"]) {
-							echo json_encode(array("status"=>"err"));
-							return;
-						}
-					} else {
-						$googlecode = $gcode;
-					}
-					include('GoogleAuthenticator.php');
-					$g = new \GAuth\Auth($keys[$uid]["gauth_secret"]);
-		
-					$verify = $g->validateCode($gcode);
-					if ($verify) {
-
-						if ($doorcmd == "open") {
-							door_open($device_id,$uid);
-							echo json_encode(array("status"=>"done"));
-						
-
-						} elseif ($doorcmd == "close") {
-							door_close($device_id,$uid);
-							echo json_encode(array("status"=>"done"));
-						}
-					} else {
-						echo json_encode(array("status"=>"err"));
-					}
-				
-				//NFC + PIN
-				} elseif (array_key_exists("nfc_pin",$keys[$uid])) {
-					$pin = substr($gcode,0,4);
-					if ($pin != $keys[$uid]["nfc_pin"]) {
-						echo json_encode(array("status"=>"err"));
-						return;
-					} else {
-						if ($doorcmd == "open") {
-							door_open($device_id,$uid);
-							echo json_encode(array("status"=>"done"));
-						
-
-						} elseif ($doorcmd == "close") {
-							door_close($device_id,$uid);
-							echo json_encode(array("status"=>"done"));
-						}						
-					}					
-				}
-			} else {
-				echo json_encode(array("status"=>"err"));
-			}
+//if this key is allowed on the requested device OR if this user doesn't have any device_ids set
+function device_allowed($uid,$device_id) {
+	global $keys;
+	return !array_key_exists("device_ids",$keys[$uid]) || in_array("all",$keys[$uid]["device_ids"]) || in_array($device_id,$keys[$uid]["device_ids"]);
+}
+
+//verify the anti-tamper text read from the tag and generate the next one (stage2 / sess2)
+//returns the write instruction for the reader or false if the text is wrong
+function rotate_antitamper($uid,$txt) {
+	global $keys, $json_rfid_userdb;
+	if (check_antitamper_txt($keys[$uid]["key_name"],$keys[$uid]["anti_tamper_num"],$txt)) {
+		$newnum = rand();
+		$keys[$uid]["anti_tamper_num_temp"] = $newnum;
+	} elseif (check_antitamper_txt($keys[$uid]["key_name"],$keys[$uid]["anti_tamper_num_temp"],$txt)) {
+		#on some rare race-condition if the user removes the fob at stage stage 3, the new value did get written to the fob but not to the local
+		#database. So we check if the "temp" number is what the fob has stored and we adjust accordingly.
+		$newnum = rand();
+		$keys[$uid]["anti_tamper_num"] = $keys[$uid]["anti_tamper_num_temp"];
+		$keys[$uid]["anti_tamper_num_temp"] = $newnum;
+		file_put_contents ("antitamper_temp_race_condition.txt", date("Y-m-d H:i:s")." ".$uid." ".$keys[$uid]["key_name"]."\n", FILE_APPEND);
+	} elseif (absorb_offline($uid,$txt)) {
+		#the tag was used at a reader that could not reach us, and is back before that reader reported it
+		$newnum = rand();
+		$keys[$uid]["anti_tamper_num_temp"] = $newnum;
 	} else {
-			echo json_encode(array("status"=>"err"));
+		return false;
 	}
+	$newcode = generate_antitamper_txt($keys[$uid]["key_name"],$newnum);
+	$keys[$uid]["anti_tamper_temp_lastset"] = date("Y-m-d H:i:s");
+
+	file_put_contents($json_rfid_userdb,json_encode($keys,JSON_PRETTY_PRINT));
+
+	return array("setantiblk"=>$keys[$uid]["anti_tamper_block"],"key"=>$keys[$uid]["anti_tamper_block_writekey"],"txt"=>$newcode);
 }
 
-function resetfob($uid) {
+//the tag reported the new anti-tamper text, it becomes the current one (stage3 / sess3)
+function commit_antitamper($uid,$txt) {
 	global $keys, $json_rfid_userdb;
-	echo json_encode(array("status"=>"reset","keya" => $keys[$uid]["keya"],"keyb" => $keys[$uid]["keyb"]));
+	if (!check_antitamper_txt($keys[$uid]["key_name"],$keys[$uid]["anti_tamper_num_temp"],$txt)) {
+		return false;
+	}
+	$keys[$uid]["anti_tamper_num"]=$keys[$uid]["anti_tamper_num_temp"];
+	$keys[$uid]["last_use"] = date("Y-m-d H:i:s");
+	$keys[$uid]["used_cnt"] += 1;
+	file_put_contents($json_rfid_userdb,json_encode($keys,JSON_PRETTY_PRINT));
+	return true;
+}
+
+//offline grant for the reader (see ESP32/offline.py): the current anti-tamper text of the tag and a spare
+//one the reader may write during a single tap while it cannot reach us. Only for NFC only users, the
+//reader cannot check a PIN or GAuth code on its own
+function offline_grant($uid,$device_id) {
+	global $keys, $json_rfid_userdb, $offline_grant_key, $offline_grant_ttl;
+	if (!isset($offline_grant_key) || $offline_grant_key == "" || required_code_len($uid) > 0) {
+		return array();
+	}
+	$num = rand();
+	$keys[$uid]["anti_tamper_num_offline"] = $num;
+	file_put_contents($json_rfid_userdb,json_encode($keys,JSON_PRETTY_PRINT));
+	$grant = array("uid"=>$uid,"dev"=>$device_id,"exp"=>time()+$offline_grant_ttl,
+		"blk"=>$keys[$uid]["anti_tamper_block"],"rkey"=>$keys[$uid]["anti_tamper_block_readkey"],"wkey"=>$keys[$uid]["anti_tamper_block_writekey"],
+		"txt"=>generate_antitamper_txt($keys[$uid]["key_name"],$keys[$uid]["anti_tamper_num"]),
+		"otxt"=>generate_antitamper_txt($keys[$uid]["key_name"],$num));
+	$grant["sig"] = hash_hmac('sha256', implode("|",$grant), $offline_grant_key);
+	return array("grant"=>$grant,"now"=>time());
+}
+
+//the tag carries the spare text of its offline grant: it was used offline, the spare text becomes the current one
+function absorb_offline($uid,$txt) {
+	global $keys, $json_rfid_userdb;
+	if (!array_key_exists("anti_tamper_num_offline",$keys[$uid]) || !check_antitamper_txt($keys[$uid]["key_name"],$keys[$uid]["anti_tamper_num_offline"],$txt)) {
+		return false;
+	}
+	$keys[$uid]["anti_tamper_num"] = $keys[$uid]["anti_tamper_num_offline"];
+	unset($keys[$uid]["anti_tamper_num_offline"]);
+	$keys[$uid]["last_use"] = date("Y-m-d H:i:s");
+	$keys[$uid]["used_cnt"] += 1;
+	file_put_contents($json_rfid_userdb,json_encode($keys,JSON_PRETTY_PRINT));
+	file_put_contents("offline_uses.txt", date("Y-m-d H:i:s")." ".$uid." ".$keys[$uid]["key_name"]."\n", FILE_APPEND);
+	return true;
+}
+
+//number of keypad digits needed after NFC: 10 = PIN + GAuth, 6 = GAuth, 4 = PIN, 0 = NFC only
+function required_code_len($uid) {
+	global $keys;
+	if (array_key_exists("gauth_secret",$keys[$uid])) {
+		return array_key_exists("gauth_pin",$keys[$uid]) ? 10 : 6;
+	} elseif (array_key_exists("nfc_pin",$keys[$uid])) {
+		return 4;
+	}
+	return 0;
+}
+
+//verify the keypad code: NFC + GAuth (with or without PIN) or NFC + PIN
+function check_second_factor($uid,$gcode) {
+	global $keys;
+	if (array_key_exists("gauth_secret",$keys[$uid])) {
+		if (array_key_exists("gauth_pin",$keys[$uid])) {
+			if (substr($gcode,0,4) != $keys[$uid]["gauth_pin"]) {
+				return false;
+			}
+			$googlecode = substr($gcode,4);
+		} else {
+			$googlecode = $gcode;
+		}
+		include_once('GoogleAuthenticator.php');
+		$g = new \GAuth\Auth($keys[$uid]["gauth_secret"]);
+		try {
+			return $g->validateCode($googlecode);
+		} catch (\InvalidArgumentException $e) {
+			return false;
+		}
+	} elseif (array_key_exists("nfc_pin",$keys[$uid])) {
+		return substr($gcode,0,4) == $keys[$uid]["nfc_pin"];
+	}
+	return false;
+}
+
+function door_command($device_id,$uid,$doorcmd) {
+	if ($doorcmd == "open") {
+		door_open($device_id,$uid);
+	} elseif ($doorcmd == "close") {
+		door_close($device_id,$uid);
+	}
+}
+
+//an answer in the encoding of the request
+function answer($arr) {
+	global $cbor;
+	$arr = ask_for_log($arr);
+	echo $cbor ? cbor_encode(wire_raw($arr)) : json_encode($arr);
+}
+
+//one line of a streamed answer, sent out right away so the reader can work on it while the rest is generated.
+//In CBOR one item after the other, the reader knows where each ends
+function emit_line($arr) {
+	global $cbor;
+	$arr = ask_for_log($arr);
+	echo $cbor ? cbor_encode(wire_raw($arr)) : json_encode($arr)."\n";
+	flush();
+}
+
+//readers in $reader_log_devices send their log lines after the tap, the status line of an answer asks for them
+function ask_for_log($arr) {
+	global $reader_log_devices, $device_id, $cmd;
+	if (isset($reader_log_devices) && $cmd != "log" && array_key_exists("status",$arr) && in_array($device_id,$reader_log_devices)) {
+		$arr["sendlog"] = 1;
+	}
+	return $arr;
+}
+
+//CBOR answers carry the keys as their 6 bytes and the block contents as byte strings, they go
+//straight to the MFRC522. The offline grant stays text, its signature is over the text
+function wire_raw($arr) {
+	foreach (array("key","keya","keyb") as $f) {
+		if (array_key_exists($f,$arr)) {
+			$arr[$f] = is_array($arr[$f]) ? array_map(function($k) { return new CborBytes(hex2bin($k)); },$arr[$f]) : new CborBytes(hex2bin($arr[$f]));
+		}
+	}
+	foreach (array("txt","filler") as $f) {
+		if (array_key_exists($f,$arr)) {
+			$arr[$f] = is_array($arr[$f]) ? array_map(function($t) { return new CborBytes($t); },$arr[$f]) : new CborBytes($arr[$f]);
+		}
+	}
+	return $arr;
+}
+
+function resetfob($uid) {
+	global $keys, $json_rfid_userdb, $stream, $picked;
+	if ($stream) {
+		emit_line(array_merge(array("status"=>"reset","stream"=>1),$picked));
+		for ($i=1;$i<16;$i++) {
+			emit_line(array("s"=>$i,"keyb"=>$keys[$uid]["keyb"][$i]));
+		}
+	} else {
+		answer(array_merge(array("status"=>"reset","keya" => $keys[$uid]["keya"],"keyb" => $keys[$uid]["keyb"]),$picked));
+	}
 	$name =  $keys[$uid]["key_name"];
 	
 	//save Google AUthenticator data if it is setup
@@ -333,7 +554,7 @@ function get_rand_filler() {
 
 //initialize a new keyfob / tag
 function initfob($uid) {
-	global $keys,$json_rfid_userdb;
+	global $keys,$json_rfid_userdb,$stream,$picked;
     if (array_key_exists($uid,$keys)) {
 		if (array_key_exists("key_name",$keys[$uid])) {
 			if (!array_key_exists("anti_tamper_block_readkey",$keys[$uid])) {
@@ -360,16 +581,24 @@ function initfob($uid) {
 				
 				//generate (pseudo)random chars between 0 and f to fill the card
 				$randfill = get_rand_filler();
-				echo json_encode(array("status"=>"init","setantiblk"=>$keys[$uid]["anti_tamper_block"],"key"=>$keys[$uid]["anti_tamper_block_writekey"],"txt"=>$newcode,"keya" => $keys[$uid]["keya"],"keyb" => $keys[$uid]["keyb"], "filler" => $randfill));
+				if ($stream) {
+					//status line first, then one line per sector with its keys and the filler for its 3 data blocks
+					emit_line(array_merge(array("status"=>"init","stream"=>1,"setantiblk"=>$keys[$uid]["anti_tamper_block"],"key"=>$keys[$uid]["anti_tamper_block_writekey"],"txt"=>$newcode),$picked));
+					for ($i=1;$i<16;$i++) {
+						emit_line(array("s"=>$i,"keya"=>$keys[$uid]["keya"][$i],"keyb"=>$keys[$uid]["keyb"][$i],"filler"=>array_slice($randfill,($i-1)*4,3)));
+					}
+				} else {
+					answer(array_merge(array("status"=>"init","setantiblk"=>$keys[$uid]["anti_tamper_block"],"key"=>$keys[$uid]["anti_tamper_block_writekey"],"txt"=>$newcode,"keya" => $keys[$uid]["keya"],"keyb" => $keys[$uid]["keyb"], "filler" => $randfill),$picked));
+				}
 
 			} else {
-				echo json_encode(array("status"=>"err", "message" => "uid already populated (:"));
+				answer(array("status"=>"err", "message" => "uid already populated (:"));
 			}
 		} else {
-			echo json_encode(array("status"=>"err", "message" => "key_name not defined!"));
+			answer(array("status"=>"err", "message" => "key_name not defined!"));
 		}
 	} else {
-		echo json_encode(array("status"=>"err", "message" => "uid not defined"));
+		answer(array("status"=>"err", "message" => "uid not defined"));
 	}
 }
 
@@ -0,0 +1,154 @@
+<?php
+/*
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+*/
+
+//The part of CBOR (RFC 8949) the readers use with useBinaryWire (wire.py): maps, arrays, text and
+//byte strings, integers, true, false and null. auth.php answers a request sent as application/cbor
+//in CBOR, keys and block contents as byte strings (see wire_raw in auth.php).
+
+//a string that goes out as a CBOR byte string instead of a text string
+class CborBytes {
+	public $data;
+	function __construct($data) {
+		$this->data = $data;
+	}
+}
+
+function cbor_head($major,$n) {
+	$m = $major << 5;
+	if ($n < 24) {
+		return chr($m | $n);
+	} elseif ($n < 0x100) {
+		return chr($m | 24).chr($n);
+	} elseif ($n < 0x10000) {
+		return chr($m | 25).pack("n",$n);
+	} elseif ($n < 0x100000000) {
+		return chr($m | 26).pack("N",$n);
+	}
+	return chr($m | 27).pack("J",$n);
+}
+
+function cbor_encode($v) {
+	if ($v === null) {
+		return "\xf6";
+	} elseif ($v === true) {
+		return "\xf5";
+	} elseif ($v === false) {
+		return "\xf4";
+	} elseif (is_int($v)) {
+		return $v >= 0 ? cbor_head(0,$v) : cbor_head(1,-1-$v);
+	} elseif ($v instanceof CborBytes) {
+		return cbor_head(2,strlen($v->data)).$v->data;
+	} elseif (is_array($v)) {
+		$out = "";
+		//like json_encode: an array with the keys 0..n-1 is a list, anything else a map
+		if ($v === array() || array_keys($v) === range(0,count($v)-1)) {
+			foreach ($v as $x) {
+				$out .= cbor_encode($x);
+			}
+			return cbor_head(4,count($v)).$out;
+		}
+		foreach ($v as $k => $x) {
+			$out .= cbor_encode(strval($k)).cbor_encode($x);
+		}
+		return cbor_head(5,count($v)).$out;
+	}
+	$v = strval($v);
+	return cbor_head(3,strlen($v)).$v;
+}
+
+//the item at $s[$i], $i is moved past it. Byte strings become strings like text strings do.
+//null if $s ends before the item does or holds something else. The body comes from anyone, so a
+//length is checked against the bytes left before anything is read or allocated for it
+function cbor_decode($s,&$i,$depth=0) {
+	if ($i >= strlen($s)) {
+		return null;
+	}
+	$ib = ord($s[$i++]);
+	$major = $ib >> 5;
+	$n = $ib & 0x1f;
+	if ($n >= 24) {
+		if ($n > 27) {
+			return null;
+		}
+		$k = 1 << ($n - 24);
+		if ($i + $k > strlen($s)) {
+			return null;
+		}
+		$n = 0;
+		for ($x = 0; $x < $k; $x++) {
+			$n = ($n << 8) | ord($s[$i++]);
+		}
+		if ($n < 0) {
+			//above PHP_INT_MAX
+			return null;
+		}
+	}
+	switch ($major) {
+		case 0:
+			return $n;
+		case 1:
+			return -1 - $n;
+		case 2:
+		case 3:
+			if ($i + $n > strlen($s)) {
+				return null;
+			}
+			$v = substr($s,$i,$n);
+			$i += $n;
+			return $v;
+		case 4:
+			//every item takes at least one byte
+			if ($n > strlen($s) - $i || $depth >= 16) {
+				return null;
+			}
+			$v = array();
+			for ($x = 0; $x < $n; $x++) {
+				$start = $i;
+				$v[] = cbor_decode($s,$i,$depth+1);
+				if (cbor_failed($s,$start,end($v))) {
+					return null;
+				}
+			}
+			return $v;
+		case 5:
+			if ($n > (strlen($s) - $i) / 2 || $depth >= 16) {
+				return null;
+			}
+			$v = array();
+			for ($x = 0; $x < $n; $x++) {
+				$k = cbor_decode($s,$i,$depth+1);
+				if (!is_string($k) && !is_int($k)) {
+					return null;
+				}
+				$start = $i;
+				$v[$k] = cbor_decode($s,$i,$depth+1);
+				if (cbor_failed($s,$start,$v[$k])) {
+					return null;
+				}
+			}
+			return $v;
+		case 7:
+			if ($n == 20) {
+				return false;
+			} elseif ($n == 21) {
+				return true;
+			}
+			return null;
+	}
+	return null;
+}
+
+//a nested cbor_decode() that started at $s[$start] returned $v: true if it failed, not if it read a CBOR null
+function cbor_failed($s,$start,$v) {
+	return $v === null && ($start >= strlen($s) || $s[$start] !== "\xf6");
+}
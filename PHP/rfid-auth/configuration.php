@@ -2,9 +2,22 @@
 $json_rfid_userdb = "rfid.txt";
 $json_gauth_userdb = "googleauth.txt";
 $unknown_uid_log = "unknown_uids.txt";
+$tap_trace_log = "tap_traces.txt"; //tap timings the readers send (useTrace in main.py), "" = not logged
+$reader_log = "reader_logs.txt"; //log lines the readers send when asked for them, "" = not logged
+$reader_log_devices = array(); //device_ids asked for their log lines (ringlog.py) after every tap, e.g. array("frontdoor")
 
 $hmac_hash_key = 'YourSecretKeyForTagKeyGeneration'; //be sure this is unique
 
+//offline grants: readers with their own door relay may open for a known tag while this server is unreachable.
+//Must be the same as offline_grant_key in the reader's main.py, empty = no offline grants
+$offline_grant_key = '';
+$offline_grant_ttl = 86400; //seconds a grant stays valid
+
+//a long tap closes the door with the next batch of events of the reader (eventqueue.py). A close that
+//reaches us later than this (seconds, the reader could not reach us) does not lock the door anymore,
+//neither does one from before a reset of the reader (its age is unknown)
+$late_close_s = 60;
+
 $ctx = stream_context_create(
     array(
         'http' => array(
@@ -46,6 +59,12 @@ function china_uid_detected($device_id,$uid,$name) {
     //file_get_contents("http://localhost/fhem?cmd.telegram=set%20telegram%20message%20@12345678%20!!!%20Cloned%20UID%20".$uid."%20%20for%20fob%20".$name."%20detected%20at%20door%20access%20!!!&XHR=1",0,$ctx);
 }
 
+//A reader opened the door offline for this tag and reported it now. What to do?
+function offline_opened($device_id,$uid) {
+    global $ctx;
+    //file_get_contents("http://localhost/fhem?cmd.telegram=set%20telegram%20message%20@12345678%20Door%20".$device_id."%20was%20opened%20offline%20for%20".$uid."&XHR=1",0,$ctx);
+}
+
 //Unknown UID detected. What to do?
 function unknown_uid_detected($device_id,$uid) {
     global $ctx;
@@ -0,0 +1,60 @@
+<?php
+/*
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+*/
+
+//tap latency per device from $tap_trace_log, on the command line:
+//  php tap_stats.php [logfile]
+//p50/p99 of the whole tap and of each phase (summed per tap, in ms). "wait" is the total
+//without the time the user spent holding the tag (held) or typing a code (code).
+//Lines with "boot" as uid are the starts of a reader (reset to ready for tap), listed on their own
+
+if (php_sapi_name() != "cli") {
+	die();
+}
+include('configuration.php');
+$file = $argc > 1 ? $argv[1] : $tap_trace_log;
+
+function percentile($v, $p) {
+	sort($v);
+	return $v[min(count($v) - 1, (int)floor(count($v) * $p / 100))];
+}
+
+$taps = array();
+foreach (file($file, FILE_IGNORE_NEW_LINES | FILE_SKIP_EMPTY_LINES) as $line) {
+	$f = explode(" ", $line);
+	if (count($f) < 6) {
+		continue;
+	}
+	$dev = $f[3] == "boot" ? $f[2]." boot" : $f[2];
+	$t = array("total" => (float)$f[4]);
+	foreach (explode(",", $f[5]) as $span) {
+		list($name, $ms) = array_pad(explode(":", $span), 2, 0);
+		$t[$name] = (isset($t[$name]) ? $t[$name] : 0) + (float)$ms;
+	}
+	if ($f[3] != "boot") {
+		$t["wait"] = $t["total"] - (isset($t["held"]) ? $t["held"] : 0) - (isset($t["code"]) ? $t["code"] : 0);
+	}
+	$taps[$dev][] = $t;
+}
+
+foreach ($taps as $dev => $list) {
+	echo $dev.": ".count($list).(substr($dev, -5) == " boot" ? " starts" : " taps")."\n";
+	$phases = array();
+	foreach ($list as $t) {
+		foreach ($t as $name => $ms) {
+			$phases[$name][] = $ms;
+		}
+	}
+	foreach ($phases as $name => $v) {
+		printf("  %-6s n=%-5d p50 %8.1f ms  p99 %8.1f ms\n", $name, count($v), percentile($v, 50), percentile($v, 99));
+	}
+}
@@ -0,0 +1,232 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# Runs the firmware in ESP32/ unchanged on a PC (boot.py, then main.py). emulator/mp holds the MicroPython
+# modules it imports (machine, network, esp32, neopixel, usocket, ...), emulator.rc522 is the MFRC522 on the
+# SPI bus, emulator.mifare the tags, emulator.keypad the keypad and emulator.authserver stands
+# in for auth.php. Everything runs on a virtual clock (emulator.clock).
+#
+#   w = World({"0acd3f15": {"key_name": "alice"}})
+#   card = mifare.Classic1K(b"\x0a\xcd\x3f\x15")
+#   w.tap(card, 2000)       #first tap enrolls the tag
+#   w.tap(card, 9000)
+#   w.run(15000)            #executes main.py until 15 s virtual time
+#   print(w.server.doors)
+#
+# A second reader (nfc_readers in main.py) is w.readers[1], w.tap(card, ms, reader=1) taps there.
+#
+# Only one World can run per process, the fake hardware lives in module globals like the real one.
+
+import ast
+import importlib.util
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+import traceback
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIRMWARE = os.path.join(ROOT, "ESP32")
+_installed = False
+
+
+def install():
+    """Put the fake MicroPython modules and the firmware on sys.path and start the virtual clock."""
+    global _installed
+    if _installed:
+        return
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "mp"))
+    sys.path.insert(1, FIRMWARE)
+    from emulator import clock
+    clock.install()
+    os.uname = lambda: ("esp32", "nfc-door", "1.20.0", "emulator", "ESP32 module with ESP32")
+    sys.print_exception = _print_exception
+    _installed = True
+
+
+def _print_exception(exc, file=None):
+    #MicroPython's sys.print_exception(), the firmware prints the tracebacks of debugmode with it
+    traceback.print_exception(type(exc), exc, exc.__traceback__, file=file or sys.stdout)
+
+
+def firmware_module(name):
+    """A module of ESP32/ (plain Python ones like wire) without putting the folder on sys.path,
+    where its trace.py would hide the one of the standard library."""
+    spec = importlib.util.spec_from_file_location("esp32_" + name, os.path.join(FIRMWARE, name + ".py"))
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def main_source(name="main.py"):
+    with open(os.path.join(FIRMWARE, name)) as f:
+        return f.read()
+
+
+def default_setting(name, src=None):
+    """Value of a config variable as set in main.py."""
+    m = re.search(r"^%s\s*=\s*(?:const\((.*)\)|(.*?))\s*(#.*)?$" % name, src or main_source(), re.M)
+    return ast.literal_eval(m.group(1) or m.group(2))
+
+
+class World:
+    """The readers with their keypad and LEDs, the tags around them and the auth server."""
+
+    def __init__(self, keys=None, gauth=None, config=None):
+        install()
+        import esp32
+        import machine
+        import network
+        import usocket
+        from emulator import clock
+        from emulator.authserver import AuthServer
+        from emulator.keypad import Keypad
+        from emulator.rc522 import RC522
+        clock.reset()
+        machine._reset()
+        network._reset()
+        esp32._reset()
+        usocket._reset()
+        self.clock = clock
+        self.net = usocket
+        self.wifi = network
+        self.config = dict(config or {})
+        self.src = main_source()
+        self.server = AuthServer(keys, gauth)
+        self.requests = []  #(ms, post, first line of the answer, as JSON also for a CBOR answer)
+        usocket.server = self
+        self.server.time = clock.wall
+        irq = self.setting("pin_nfc_irq")
+        self.reader = RC522(cs=self.setting("pin_nfc_cs"), irq=irq)
+        self.readers = [self.reader] + [RC522(cs=cs, irq=irq) for cs, rst, dev in self.setting("nfc_readers")]
+        self.keypad = Keypad(self.setting("pins_keypad_rows"), self.setting("pins_keypad_cols"))
+        self.taps = []      #(card, ms placed, ms removed)
+        self.resets = []    #(ms, power cycle) of the resets so far
+        self.tap_xfers = [] #SPI transfers of the reader when the tag was placed and removed
+        self.g = None       #globals of main.py after run()
+        self.flash = tempfile.mkdtemp(prefix="nfc-flash-")  #the files main.py writes (grants.json, events.txt, ...)
+
+    def setting(self, name):
+        if name in self.config:
+            return self.config[name]
+        return default_setting(name, self.src)
+
+    def driver(self, i=0):
+        """The MFRC522 driver of the firmware on reader i, for tests of the driver without main.py."""
+        import mfrc522
+        cs = self.setting("pin_nfc_cs") if i == 0 else self.setting("nfc_readers")[i - 1][0]
+        return mfrc522.MFRC522(sck=14, mosi=13, miso=12, rst=26, cs=cs)
+
+    def handle(self, post, cbor=False):
+        body = self.server.handle(post, cbor)
+        first = body.split(b"\n", 1)[0]
+        if cbor and self.server.first is not None:
+            first = json.dumps(self.server.first).encode()
+        self.requests.append((self.clock.now_ms(), post, first))
+        return body
+
+    def tap(self, card, at_ms, hold_ms=1500, reader=0):
+        """Hold card to reader (index into readers) at at_ms for hold_ms."""
+        i = len(self.taps)
+        rd = self.readers[reader]
+        self.taps.append((card, at_ms, at_ms + hold_ms))
+        self.tap_xfers.append([0, 0])
+
+        def place():
+            self.tap_xfers[i][0] = rd.xfers
+            rd.place(card)
+
+        def remove():
+            self.tap_xfers[i][1] = rd.xfers
+            rd.remove(card)
+        self.clock.at(at_ms, place)
+        self.clock.at(at_ms + hold_ms, remove)
+
+    def warm_start(self, lease_age_s=600):
+        """Start like after a watchdog reset of a door that was online before: AP in NVS, lease in RTC memory
+        (got lease_age_s ago)."""
+        import esp32
+        import machine
+        import network
+        machine.cause[0] = machine.WDT_RESET
+        esp32.store[("fastboot", "ap")] = network.ap_bssid + bytes([network.ap_channel])
+        machine.rtc_memory[0] = (b"FB1" + int(time.time() - lease_age_s).to_bytes(4, "big")
+                                 + b"192.168.1.57 255.255.255.0 192.168.1.1 192.168.1.1")
+
+    def reset(self, at_ms, power=False):
+        """Reset the ESP32 at at_ms like the watchdog does, boot.py and main.py start over with the flash as it is.
+        power=True: a power cycle, the RTC memory is gone and the RTC (time.time()) starts over at 0."""
+        def fire():
+            self.resets.append((at_ms, power))
+            raise self.clock.Stop()
+        self.clock.at(at_ms, fire)
+
+    def at(self, ms, fn):
+        self.clock.at(ms, fn)
+
+    def run(self, until_ms):
+        """Run main.py with the config overrides until the virtual clock reaches until_ms."""
+        src = self.src
+        for k, v in self.config.items():
+            src, n = re.subn(r"^%s\s*=.*$" % k, lambda m: "%s = %r" % (k, v), src, count=1, flags=re.M)
+            if not n:
+                raise KeyError("main.py has no setting " + k)
+        self.clock.stop_ms = until_ms
+        cwd = os.getcwd()
+        os.chdir(self.flash)
+        try:
+            while True:
+                #the firmware modules start with fresh globals, like after a reset
+                for name, m in list(sys.modules.items()):
+                    if os.path.dirname(getattr(m, "__file__", None) or "") == FIRMWARE:
+                        del sys.modules[name]
+                #boot.py and main.py share the globals of __main__, like on the ESP32
+                self.g = {"__name__": "__main__"}
+                boots = len(self.resets)
+                try:
+                    exec(compile(main_source("boot.py"), os.path.join(FIRMWARE, "boot.py"), "exec"), self.g)
+                    exec(compile(src, os.path.join(FIRMWARE, "main.py"), "exec"), self.g)
+                except self.clock.Stop:
+                    if len(self.resets) == boots:
+                        raise
+                #do_work() ends on the Stop of a reset like on the one of the end of the run
+                if len(self.resets) == boots:
+                    break
+                import machine
+                import network
+                machine._restart(self.resets[-1][1])
+                network._restart()
+        except self.clock.Stop:
+            pass
+        finally:
+            os.chdir(cwd)
+        return self.g
+
+    def door_requests(self):
+        """(ms, post, answer) of every request that carried a door command, each close of a batch of events as one."""
+        out = []
+        for ms, post, ans in self.requests:
+            if post.get("doorcmd"):
+                out.append((ms, post, ans))
+            elif post.get("cmd") == "events":
+                out.extend((ms, e, ans) for e in post.get("events", ()) if e.get("ev") == "close")
+        return out
+
+    def tap_latencies(self):
+        """ms from placing the tag to the request that opened/closed the door, per tap (None = no door command)."""
+        out = []
+        for i, (card, t0, t1) in enumerate(self.taps):
+            end = min([t[1] for t in self.taps[i + 1:] if t[0] is card] or [float("inf")])
+            done = [ms for ms, post, ans in self.door_requests()
+                    if t0 <= ms < end and (b'"done"' in ans or post.get("ev") == "close") and post.get("uid") == card.uid_hex]
+            out.append(done[0] - t0 if done else None)
+        return out
@@ -0,0 +1,361 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# python -m emulator [scenario] [options], from the repository root:
+#   tap     enroll a new tag, tap it twice, then a long tap (closes the door)
+#   pin     NFC + PIN: tap, then type the PIN on the keypad
+#   reset   enroll a tag, then mark it for reset in the user database and tap it again
+#   china   a "Chinese" magic tag with a writable block 0 is reported to the server
+#   bench   enroll a tag and time -n taps: latency, SPI transfers, server requests
+#   doors   a second reader inside the door (nfc_readers), taps on both, also at the same time
+#   wallet  a tag with a 7 byte UID, and taps with several tags at once (the known one among unknown cards)
+#   revoke  a tag the reader remembers (card cache) loses this door in device_ids, then gets it back
+#   stale   the key the reader remembers for a tag stops working, the tap asks stage1 and still opens
+#   outage  the server is down while an unknown tag and a magic tag are tapped, the reader reports them later
+#           and opens the door for the next tap
+#   lateclose the close of a long tap cannot go out before a reset, after it the close no longer locks
+#   offline the reader has an offline grant (relay wired), a long tap closes, then the server goes down and
+#           the tag still gets in with the grant that came with the close
+#   reboot  like offline, with a power cycle of the reader while the server is down
+#
+# After the run the check of the scenario (CHECKS) asserts on the outcome, an AssertionError says what
+# went wrong. The emulator/test_*.py files play the scenarios (play()) with the blocking loop, with
+# uasyncio and with stage1-4:
+#   > python -m unittest discover -s emulator -t .
+
+import argparse
+import ast
+import statistics
+import time
+
+from emulator import World, mifare
+
+UID = b"\x0a\xcd\x3f\x15"
+UID2 = b"\x5b\x21\x9e\x07"
+UID7 = b"\x04\xa1\xb2\xc3\xd4\xe5\xf6"
+INSIDE = (22, 23, "frontdoor-inside")   #cs, rst, device_id of the second reader of "doors"
+
+
+def check_tap(w, card):
+    assert w.server.doors == [("frontdoor", card.uid_hex, c) for c in ("open", "open", "close")], w.server.doors
+
+
+def scenario_tap(w, card):
+    w.tap(card, 2000, 4000)
+    w.tap(card, 10000)
+    w.tap(card, 20000)
+    w.tap(card, 30000, 8000)
+    return 45000
+
+
+def scenario_pin(w, card):
+    w.server.keys[card.uid_hex]["nfc_pin"] = "1234"
+    w.tap(card, 2000, 4000)
+    w.tap(card, 10000, 1000)
+    w.keypad.type(12500, "1234")
+    return 25000
+
+
+def check_pin(w, card):
+    assert w.server.doors == [("frontdoor", card.uid_hex, "open")], w.server.doors
+
+
+def scenario_reset(w, card):
+    w.tap(card, 2000, 4000)
+    w.at(9000, lambda: w.server.keys[card.uid_hex].__setitem__("reset", 1))
+    w.tap(card, 10000, 4000)
+    return 20000
+
+
+def check_reset(w, card):
+    assert "keya" not in w.server.keys[card.uid_hex], "tag still enrolled"
+    for sector in range(16):
+        assert card.blocks[sector * 4 + 3] == mifare.TRANSPORT_TRAILER, "sector %d not reset" % sector
+    assert not w.server.doors, w.server.doors
+
+
+def scenario_china(w, card):
+    w.tap(mifare.Classic1K(b"\x01\x02\x03\x04", magic=True), 2000)
+    return 10000
+
+
+def check_china(w, card):
+    assert w.server.china == [("frontdoor", "01020304", "unknown")], w.server.china
+    assert not w.server.doors, w.server.doors
+
+
+def scenario_doors(w, card):
+    other = mifare.Classic1K(UID2)
+    w.tap(card, 2000, 4000)
+    w.tap(other, 10000, 4000, reader=1)
+    w.tap(card, 20000)
+    w.tap(other, 20300, 3000, reader=1)  #both readers at once
+    w.tap(card, 30000, 8000)        #a long tap outside does not block the inside reader
+    w.tap(other, 31000, 4000, reader=1)
+    return 45000
+
+
+def check_doors(w, card):
+    #the blocking loop misses the last inside tap while the long tap outside runs, the uasyncio one does not
+    want = [("frontdoor", card.uid_hex, "open"), ("frontdoor-inside", UID2.hex(), "open"), ("frontdoor", card.uid_hex, "close")]
+    assert w.server.doors[:3] == want, w.server.doors
+    if w.setting("useAsyncio"):
+        assert w.server.doors[3:] == [("frontdoor-inside", UID2.hex(), "open")], w.server.doors
+
+
+def scenario_wallet(w, card):
+    tag7 = mifare.Classic1K(UID7)
+    bank = mifare.Classic1K(UID7[:6] + b"\xf7")    #differs from tag7 in the very last UID bit
+    other = mifare.Classic1K(b"\xde\xad\xbe\xef")
+    w.tap(card, 2000, 4000)
+    w.tap(tag7, 10000, 4000)
+    for c in (card, bank, other):
+        w.tap(c, 20000)
+    for c in (tag7, bank):
+        w.tap(c, 30000)
+    w.tap(tag7, 40000)
+    return 50000
+
+
+def check_wallet(w, card):
+    #the known tags are found among the others, the bank card differs from tag7 only in the last UID bit
+    want = [("frontdoor", card.uid_hex, "open"), ("frontdoor", UID7.hex(), "open"), ("frontdoor", UID7.hex(), "open")]
+    assert w.server.doors == want, w.server.doors
+    #anticollision found all three tags of the first wallet tap, the stage1 names every one of them
+    asked = [[post["uid"]] + post.get("uids", []) for ms, post, ans in w.requests if 20000 <= ms < 30000 and post["cmd"] == "stage1"]
+    assert asked and sorted(asked[0]) == sorted([card.uid_hex, "04a1b2c3d4e5f7", "deadbeef"]), asked
+
+
+def scenario_revoke(w, card):
+    w.tap(card, 2000, 4000)
+    w.tap(card, 10000)
+    w.at(15000, lambda: w.server.keys[card.uid_hex].__setitem__("device_ids", ["backdoor"]))
+    w.tap(card, 20000)
+    w.at(25000, lambda: w.server.keys[card.uid_hex].__setitem__("device_ids", ["backdoor", "frontdoor"]))
+    w.tap(card, 30000)
+    return 40000
+
+
+def check_revoke(w, card):
+    assert w.server.doors == [("frontdoor", card.uid_hex, "open")] * 2, w.server.doors
+    assert w.tap_latencies()[2] is None, "revoked tag got in"
+    #the answer to the revoked tap dropped it from the card cache
+    assert [post["cmd"] for ms, post, ans in w.requests if ms >= 30000][:1] == ["stage1"], w.requests
+
+
+def scenario_stale(w, card):
+    #the remembered key stops reading the tag (it got new keys elsewhere): stage1 in the same tap
+    w.tap(card, 2000, 4000)
+    w.tap(card, 10000)
+    w.at(15000, lambda: w.g["cards"].cards[card.uid_hex].__setitem__(1, "ffffffffffff"))
+    w.tap(card, 20000)
+    return 30000
+
+
+def check_stale(w, card):
+    assert [d[2] for d in w.server.doors] == ["open", "open"], w.server.doors
+    assert [post["cmd"] for ms, post, ans in w.requests if ms >= 20000][:1] == ["stage1"], w.requests
+    assert w.g["cards"].cards[card.uid_hex][1] != "ffffffffffff", "stale key kept"
+
+
+def scenario_outage(w, card):
+    w.tap(card, 2000, 4000)
+    w.at(8000, lambda: setattr(w.net, "down", True))
+    w.tap(mifare.Classic1K(b"\xde\xad\xbe\xef"), 10000)
+    w.tap(mifare.Classic1K(b"\x01\x02\x03\x04", magic=True), 15000)
+    w.at(20000, lambda: setattr(w.net, "down", False))
+    w.tap(card, 40000)
+    return 60000
+
+
+def check_outage(w, card):
+    back = [post for ms, post, ans in w.requests if ms >= 20000 and post["cmd"] == "events"]
+    sent = [e["ev"] for post in back for e in post["events"]]
+    assert "seen" in sent and "chinauid" in sent, "queued events not sent after the outage: %s" % sent
+    assert [u for d, u in w.server.unknown] == ["deadbeef"], w.server.unknown
+    assert [c[1] for c in w.server.china] == ["01020304"], w.server.china
+    assert w.g["events"].count == 0, "events left in the queue"
+    assert w.tap_latencies()[-1] is not None, "no door command for the tap after the outage"
+
+
+def scenario_lateclose(w, card):
+    #the close of a long tap cannot go out and the reader is reset: after the start its age is unknown
+    w.tap(card, 2000, 4000)
+    w.tap(card, 10000)
+    w.at(22000, lambda: setattr(w.net, "down", True))
+    w.tap(card, 20000, 8000)
+    w.reset(32000)
+    w.at(36000, lambda: setattr(w.net, "down", False))
+    w.tap(card, 45000)
+    return 55000
+
+
+def check_lateclose(w, card):
+    closes = [(post, e) for ms, post, ans in w.requests if ms >= 32000 and post["cmd"] == "events"
+              for e in post["events"] if e["ev"] == "close"]
+    assert closes, "close not sent after the reset"
+    assert all(e["b"] != post["boot"] for post, e in closes), closes
+    assert [d[2] for d in w.server.doors] == ["open", "open"], w.server.doors
+    assert w.tap_latencies()[-1] is not None, "the tag lost its text with the close"
+
+
+def scenario_offline(w, card):
+    import machine
+    #the relay stays on past the end of the tap, while the keypad scanning starts again
+    w.config.update(pin_offline_relay=32, offline_grant_key=b"emulator", offline_relay_ms=5000)
+    w.server.grant_key = "emulator"
+    w.relay = []    #(ms, level) the firmware drives on the relay pin
+    machine.Pin(32)._st.watchers.append(lambda v: w.relay.append((w.clock.now_ms(), v)))
+    w.tap(card, 2000, 4000)
+    w.tap(card, 10000)
+    w.tap(card, 20000, 8000)
+    w.at(35000, lambda: setattr(w.net, "down", True))
+    w.tap(card, 40000)
+    return 50000
+
+
+def check_offline(w, card):
+    assert [d[2] for d in w.server.doors] == ["open", "close"], w.server.doors
+    assert [u for u, otxt in w.g["grants"].pending()] == [card.uid_hex], "no offline tap after the close"
+    on = [ms for ms, v in w.relay if v]
+    off = [ms for ms, v in w.relay if not v and on and ms > on[0]]
+    assert on and off, "relay not switched off after the offline tap: %s" % w.relay
+    assert off[0] - on[0] == w.setting("offline_relay_ms"), w.relay
+
+
+def scenario_reboot(w, card):
+    #the door loses its power while the server is down, the grant and the server time come back from flash
+    scenario_offline(w, card)
+    w.reset(37000, power=True)
+    w.tap(card, 40000)
+    return 50000
+
+
+def check_reboot(w, card):
+    assert w.g["machine"].reset_cause() == w.g["machine"].PWRON_RESET, "no reset"
+    assert [u for u, otxt in w.g["grants"].pending()] == [card.uid_hex], "no offline tap after the reboot"
+    on = [ms for ms, v in w.relay if v]
+    assert on and on[0] > 37000, w.relay
+
+
+def scenario_bench(w, card, n=20):
+    w.tap(card, 2000, 4000)
+    t = 10000
+    for _ in range(n):
+        w.tap(card, t)
+        t += 10000
+    return t + 5000
+
+
+def check_bench(w, card):
+    assert None not in w.tap_latencies()[1:], w.tap_latencies()
+
+
+SCENARIOS = {"tap": scenario_tap, "pin": scenario_pin, "reset": scenario_reset, "china": scenario_china, "bench": scenario_bench,
+             "doors": scenario_doors, "wallet": scenario_wallet, "revoke": scenario_revoke, "stale": scenario_stale,
+             "outage": scenario_outage, "lateclose": scenario_lateclose, "offline": scenario_offline,
+             "reboot": scenario_reboot}
+CHECKS = {"tap": check_tap, "pin": check_pin, "reset": check_reset, "china": check_china, "bench": check_bench,
+          "doors": check_doors, "wallet": check_wallet, "revoke": check_revoke, "stale": check_stale,
+          "outage": check_outage, "lateclose": check_lateclose, "offline": check_offline, "reboot": check_reboot}
+
+
+def setup(scenario, config, n=20, latency_ms=30, handshake_ms=250):
+    """World with the users of the scenarios, the scenario scheduled: (world, card, ms to run)."""
+    config = dict(config)
+    if scenario == "doors":
+        config.setdefault("nfc_readers", [INSIDE])
+    w = World({UID.hex(): {"key_name": "alice"}, UID2.hex(): {"key_name": "bob"}, UID7.hex(): {"key_name": "carol"}},
+              config=config)
+    w.net.latency_ms = latency_ms
+    w.net.handshake_ms = handshake_ms
+    card = mifare.Classic1K(UID)
+    if scenario == "bench":
+        return w, card, scenario_bench(w, card, n)
+    return w, card, SCENARIOS[scenario](w, card)
+
+
+def check(scenario, w, card):
+    """Assert on the outcome of the scenario after w.run()."""
+    assert not w.g["wdt"].expired(), "watchdog: %d ms without feed" % w.g["wdt"].longest
+    CHECKS[scenario](w, card)
+
+
+def play(scenario, n=5, **config):
+    """setup(), run and check() a scenario with the config overrides, quietly: the world after the run."""
+    w, card, until = setup(scenario, dict({"debugmode": False}, **config), n=n)
+    w.run(until)
+    check(scenario, w, card)
+    return w
+
+
+def main():
+    p = argparse.ArgumentParser(prog="python -m emulator", description="Run the ESP32 firmware against emulated hardware.")
+    p.add_argument("scenario", nargs="?", default="tap", choices=sorted(SCENARIOS))
+    p.add_argument("-v", "--verbose", action="store_true", help="debugmode = True, print the firmware log")
+    p.add_argument("-n", type=int, default=20, help="taps for bench")
+    p.add_argument("--async", dest="asyncio", action="store_true", help="useAsyncio = True")
+    p.add_argument("--irq", type=int, metavar="PIN", help="pin_nfc_irq, the MFRC522 IRQ line is wired")
+    p.add_argument("--stages", action="store_true", help="useSessionProtocol = False (stage1-4)")
+    p.add_argument("--latency", type=int, default=30, metavar="MS", help="server time per request")
+    p.add_argument("--handshake", type=int, default=250, metavar="MS", help="TCP + TLS handshake per connection")
+    p.add_argument("--warm", action="store_true", help="start after a watchdog reset, Wi-Fi AP and DHCP lease cached")
+    p.add_argument("--sendlog", action="store_true", help="$reader_log_devices lists the readers, they send their log after a tap")
+    p.add_argument("--set", action="append", default=[], metavar="NAME=VALUE", help="any other main.py setting")
+    a = p.parse_args()
+
+    config = {"debugmode": a.verbose, "log_level": 3 if a.verbose else 2, "useAsyncio": a.asyncio, "pin_nfc_irq": a.irq,
+              "useSessionProtocol": not a.stages}
+    for s in a.set:
+        name, _, value = s.partition("=")
+        config[name] = ast.literal_eval(value)
+    w, card, until = setup(a.scenario, config, a.n, a.latency, a.handshake)
+    if a.sendlog:
+        w.server.log_devices = [w.setting("device_id")] + [dev for cs, rst, dev in w.setting("nfc_readers")]
+    if a.warm:
+        w.warm_start()
+
+    started = time.perf_counter()
+    w.run(until)
+    wall = time.perf_counter() - started
+
+    if "boot_ms" in w.g:
+        print("reset -> ready for tap: %d ms (Wi-Fi: %s, %d scans, %d DHCP)"
+              % (w.g["boot_ms"], w.g["fastboot"].how, w.wifi.stats["scans"], w.wifi.stats["dhcp"]))
+    print("server requests: %s" % " ".join(post["cmd"] for ms, post, ans in w.requests))
+    print("door commands:   %s" % w.server.doors)
+    if w.server.china:
+        print("china tags:      %s" % w.server.china)
+    if w.server.unknown:
+        print("unknown tags:    %s" % w.server.unknown)
+    print("tag blocks written: %d, reader SPI transfers: %d, RF frames: %d, CalcCRC: %d"
+          % (card.writes, w.reader.xfers, w.reader.transceives, w.reader.crc_calcs))
+    print("connections: %(connects)d, requests: %(requests)d, bytes: %(bytes)d received, %(sent)d sent" % w.net.stats)
+    if w.server.traces:
+        print("tap traces at the server: %d, last: %s" % (len(w.server.traces), w.server.traces[-1][1]))
+    if w.server.reader_logs:
+        print("log lines at the server: %d, last: %s" % (len(w.server.reader_logs), w.server.reader_logs[-1][1]))
+    if w.g.get("wdt") is not None and w.g["wdt"].expired():
+        print("WATCHDOG: %d ms without feed (timeout %d)" % (w.g["wdt"].longest, w.g["wdt"].timeout))
+    lat = w.tap_latencies()
+    print("tap -> door command (virtual ms): %s" % lat)
+    check(a.scenario, w, card)
+    print("check: ok")
+    if a.scenario == "bench":
+        lat = [x for x in lat[1:] if x is not None]
+        xfers = [removed - placed for placed, removed in w.tap_xfers[1:]]
+        if lat:
+            print("taps: %d/%d, latency median %d ms, max %d ms, SPI transfers per tap %d"
+                  % (len(lat), a.n, statistics.median(lat), max(lat), statistics.median(xfers)))
+        print("%.3f s wall time for %d s of virtual time" % (wall, until // 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,385 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# auth.php in Python, for the emulator. Same commands, same answers (including the streamed
+# init/reset lines) and the same user database layout as rfid.txt / googleauth.txt, so the
+# firmware cannot tell the difference. The door and the log files are replaced by lists.
+# handle(post, cbor=True) answers in CBOR like auth.php does for an application/cbor request.
+
+import base64
+import hashlib
+import hmac
+import json
+import random
+import struct
+import time
+
+from emulator import firmware_module
+
+wire = firmware_module("wire")
+
+
+def hmac_hex(key, msg):
+    return hmac.new(key.encode(), msg.encode(), hashlib.sha256).hexdigest()
+
+
+def totp(secret, t=None):
+    """Google Authenticator code of a base32 secret."""
+    return hotp(secret, int((t or time.time()) // 30))
+
+
+def hotp(secret, counter):
+    key = base64.b32decode(secret + "=" * (-len(secret) % 8))
+    h = hmac.new(key, struct.pack(">Q", counter), hashlib.sha1).digest()
+    o = h[-1] & 0xF
+    return "%06d" % ((struct.unpack(">I", h[o:o + 4])[0] & 0x7FFFFFFF) % 1000000)
+
+
+def totp_valid(secret, code, window=2):
+    #GoogleAuthenticator.php accepts the codes of 2 periods before and after now
+    if len(code) != 6:
+        return False
+    now = int(time.time() // 30)
+    return any(hotp(secret, c) == code for c in range(now - window, now + window + 1))
+
+
+def wire_raw(d):
+    """d the way cbor.php sends it: keys as their bytes, block contents as byte strings."""
+    d = dict(d)
+    for f in ("key", "keya", "keyb"):
+        if f in d:
+            d[f] = [bytes.fromhex(v) for v in d[f]] if isinstance(d[f], list) else bytes.fromhex(d[f])
+    for f in ("txt", "filler"):
+        if f in d:
+            d[f] = [v.encode() for v in d[f]] if isinstance(d[f], list) else d[f].encode()
+    return d
+
+
+def text(v):
+    """A decoded CBOR request value as PHP sees it: byte strings are strings too."""
+    if isinstance(v, bytes):
+        return v.decode("latin-1")
+    if isinstance(v, list):
+        return [text(x) for x in v]
+    return v
+
+
+class AuthServer:
+
+    def __init__(self, keys=None, gauth=None, hmac_key="YourSecretKeyForTagKeyGeneration",
+                 grant_key="", grant_ttl=86400, late_close_s=60):
+        self.keys = keys if keys is not None else {}    #rfid.txt
+        self.gauth = gauth if gauth is not None else {} #googleauth.txt
+        self.hmac_key = hmac_key                         #$hmac_hash_key
+        self.grant_key = grant_key                       #$offline_grant_key
+        self.grant_ttl = grant_ttl
+        self.late_close_s = late_close_s                 #$late_close_s
+        self.time = time.time                            #time() of PHP, World puts it on the virtual clock
+        self.rand = random.Random()
+        #what configuration.php and the log files of auth.php would see
+        self.doors = []     #(device_id, uid, "open"/"close"/"toggle")
+        self.unknown = []   #unknown_uids.txt
+        self.races = []     #antitamper_temp_race_condition.txt
+        self.china = []     #china_uid_detected()
+        self.offline = []   #offline_uses.txt
+        self.traces = []    #tap_traces.txt: (device_id, "uid total_ms phase:ms,...")
+        self.reader_logs = []   #reader_logs.txt: (device_id, "ms level text")
+        self.log_devices = []   #$reader_log_devices
+
+    def _rand(self):
+        return self.rand.randint(0, 2147483647)
+
+    def antitamper_txt(self, name, num):
+        return hmac_hex(self.hmac_key, name + str(num))[8:24]
+
+    def keys_txt(self, name, num):
+        return hmac_hex(self.hmac_key, name + str(num))[8:20]
+
+    def _check(self, k, field, txt):
+        return field in k and self.antitamper_txt(k["key_name"], k[field]) == txt
+
+    def handle(self, post, cbor=False):
+        """Body auth.php answers to a request (the decoded JSON or CBOR post)."""
+        self.cbor = cbor
+        self.first = None   #the first answer as a dict, None if it was an error text
+        if cbor:
+            post = {k: text(v) for k, v in post.items()}
+        out = []
+        self._handle(post, out)
+        return b"".join(x if isinstance(x, bytes) else x.encode() for x in out)
+
+    def _encode(self, d, line=False):
+        #an answer or an item of a streamed answer (a line in JSON)
+        if "status" in d and self.cmd != "log" and self.device_id in self.log_devices:
+            d = dict(d, sendlog=1)
+        if self.first is None:
+            self.first = d
+        if self.cbor:
+            return bytes(wire.dumps(wire_raw(d)))
+        return json.dumps(d) + ("\n" if line else "")
+
+    def answer(self, post):
+        """The answer as a dict (the first line of a streamed one)."""
+        return json.loads(self.handle(post).split(b"\n", 1)[0])
+
+    def _handle(self, post, out):
+        emit = lambda d: out.append(self._encode(d))
+        err = lambda: emit({"status": "err"})
+        uid = post.get("uid")
+        cmd = post.get("cmd", "")
+        device_id = post.get("device_id", "")
+        self.cmd = cmd
+        self.device_id = device_id
+        if (uid is None and cmd not in ("keyauth", "log", "events")) or cmd == "" or device_id == "":
+            out.append("Not enough arguments! Sorry mate :)")
+            return
+        key = post.get("key", "")
+        doorcmd = post.get("doorcmd", "")
+        gcode = post.get("gcode")
+        self.stream = bool(post.get("stream"))
+        self.traces.extend((device_id, t) for t in post.get("trace", ()))
+        if cmd == "log":
+            self.reader_logs.extend((device_id, l) for l in post.get("lines", ()))
+            emit({"status": "ok"})
+            return
+        if cmd == "events":
+            grants = self._events(post)
+            emit({"status": "ok", "grants": grants, "now": int(self.time())} if grants else {"status": "ok"})
+            return
+        k = self.keys.get(uid)
+        #a wallet: the first configured tag of "uids" if uid is not, named in "uid" of the stage1 answer
+        self.picked = {}
+        if cmd == "stage1" and k is None and isinstance(post.get("uids"), list):
+            for u in post["uids"]:
+                if u in self.keys:
+                    uid, k = u, self.keys[u]
+                    self.picked = {"uid": u}
+                    break
+
+        if cmd == "chinauid" and uid != "":
+            self.china.append((device_id, uid, k["key_name"] if k else "unknown"))
+            err()
+        elif cmd == "keyauth":
+            if key != "" and len(key) == 10:
+                g = self.gauth.get(key[:4])
+                if g is not None and totp_valid(g["GAuthSecret"], key[4:]):
+                    self.doors.append((device_id, uid, "toggle"))
+                    emit({"status": "kk"})
+                else:
+                    err()
+            else:
+                out.append("sorry")
+        elif cmd == "stage1" and uid != "":
+            if k is None:
+                self.unknown.append((time.strftime("%Y-%m-%d %H:%M:%S"), uid))
+                err()
+            elif "reset" in k:
+                self._resetfob(uid, out)
+            elif "anti_tamper_block_readkey" in k:
+                if self.device_allowed(k, device_id):
+                    emit(dict({"status": "k", "antiblk": k["anti_tamper_block"], "key": k["anti_tamper_block_readkey"],
+                               "len": k["anti_tamper_len"]}, **self.picked))
+                else:
+                    emit({"status": "err", "message": "You're not allowed on this device!"})
+            elif "key_name" in k:
+                self._initfob(uid, out)
+        elif cmd == "stage2" and uid != "" and key != "":
+            if k is None or "reset" in k or not self.device_allowed(k, device_id):
+                #the reader may have skipped stage1, so its checks are repeated
+                emit({"status": "err", "forget": 1})
+            else:
+                write = self.rotate(uid, key)
+                if write is not None:
+                    emit(dict({"status": "kk"}, **write))
+                else:
+                    err()
+        elif cmd == "stage3" and uid != "" and key != "" and doorcmd != "":
+            if k is not None and self.commit(uid, key):
+                num = self.required_code_len(k)
+                if doorcmd == "open" and num > 0:
+                    emit({"status": "getcode", "num": num})
+                elif doorcmd in ("open", "close"):
+                    self.doors.append((device_id, uid, doorcmd))
+                    emit(dict({"status": "done"}, **(self.offline_grant(uid, device_id) if post.get("grant") else {})))
+            else:
+                err()
+        elif cmd == "stage4" and uid != "" and key != "" and doorcmd != "" and gcode:
+            if k is not None and self._check(k, "anti_tamper_num", key) and self.second_factor(k, gcode):
+                self.doors.append((device_id, uid, doorcmd))
+                emit({"status": "done"})
+            else:
+                err()
+        elif cmd == "sess2" and uid != "" and key != "":
+            if k is not None and "reset" in k:
+                self._resetfob(uid, out)
+            elif k is None or not self.device_allowed(k, device_id):
+                emit({"status": "err", "forget": 1})
+            else:
+                write = self.rotate(uid, key)
+                if write is not None:
+                    emit(dict({"status": "kk", "num": self.required_code_len(k)}, **write))
+                else:
+                    err()
+        elif cmd == "sess3" and uid != "" and key != "" and doorcmd != "":
+            if k is not None and self.commit(uid, key):
+                params = {"antiblk": k["anti_tamper_block"], "key": k["anti_tamper_block_readkey"], "len": k["anti_tamper_len"]}
+                if doorcmd == "open" and self.required_code_len(k) > 0 and not (gcode is not None and self.second_factor(k, gcode)):
+                    emit(dict({"status": "err"}, **params))
+                elif doorcmd in ("open", "close"):
+                    self.doors.append((device_id, uid, doorcmd))
+                    emit(dict(dict({"status": "done"}, **params), **(self.offline_grant(uid, device_id) if post.get("grant") else {})))
+                else:
+                    err()
+            else:
+                err()
+        elif cmd == "offline" and uid != "" and key != "":
+            if k is not None and (self.absorb_offline(uid, key) or "anti_tamper_num_offline" not in k
+                                  or self._check(k, "anti_tamper_num", key)):
+                emit({"status": "done"})
+            else:
+                err()
+
+    def _events(self, post):
+        #notifications a reader queued (eventqueue.py), like the requests they stand for. Returns the
+        #new offline grants of the closes that asked for one
+        now = post.get("now", 0)
+        boot = post.get("boot")
+        grants = []
+        for e in post.get("events", ()):
+            if not isinstance(e, dict) or "ev" not in e or not isinstance(e.get("uid"), str):
+                continue
+            dev = e.get("device_id", post["device_id"])
+            uid = e["uid"]
+            k = self.keys.get(uid)
+            #None: the event is from an earlier start of the reader or after "now", its age is unknown
+            ago = None
+            if "t" in e and (boot is None or e.get("b") == boot) and e["t"] <= now:
+                ago = now - e["t"]
+            if e["ev"] == "chinauid":
+                self.china.append((dev, uid, k["key_name"] if k else "unknown"))
+            elif e["ev"] == "seen" and k is None:
+                self.unknown.append((time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.time() - (ago or 0))), uid))
+            elif e["ev"] == "close" and k is not None and self.commit(uid, e.get("key", "")):
+                if self.late_close_s is None or ago is not None and ago <= self.late_close_s:
+                    self.doors.append((dev, uid, "close"))
+                #the offline grant of the reader still has the old text, it gets one for the new text
+                if e.get("grant"):
+                    g = self.offline_grant(uid, dev)
+                    if "grant" in g:
+                        grants.append(g["grant"])
+        return grants
+
+    def device_allowed(self, k, device_id):
+        return "device_ids" not in k or "all" in k["device_ids"] or device_id in k["device_ids"]
+
+    def rotate(self, uid, txt):
+        """stage2/sess2: check the text of the tag, returns the write instruction or None."""
+        k = self.keys[uid]
+        if self._check(k, "anti_tamper_num", txt):
+            pass
+        elif self._check(k, "anti_tamper_num_temp", txt):
+            #the tag was taken away after the write in stage3 but before the server heard about it
+            k["anti_tamper_num"] = k["anti_tamper_num_temp"]
+            self.races.append((time.strftime("%Y-%m-%d %H:%M:%S"), uid, k["key_name"]))
+        elif self.absorb_offline(uid, txt):
+            pass
+        else:
+            return None
+        newnum = self._rand()
+        k["anti_tamper_num_temp"] = newnum
+        k["anti_tamper_temp_lastset"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        return {"setantiblk": k["anti_tamper_block"], "key": k["anti_tamper_block_writekey"],
+                "txt": self.antitamper_txt(k["key_name"], newnum)}
+
+    def commit(self, uid, txt):
+        """stage3/sess3: the tag carries the new text now."""
+        k = self.keys[uid]
+        if not self._check(k, "anti_tamper_num_temp", txt):
+            return False
+        k["anti_tamper_num"] = k["anti_tamper_num_temp"]
+        k["last_use"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        k["used_cnt"] = k.get("used_cnt", 0) + 1
+        return True
+
+    def offline_grant(self, uid, device_id):
+        k = self.keys[uid]
+        if not self.grant_key or self.required_code_len(k) > 0:
+            return {}
+        num = self._rand()
+        k["anti_tamper_num_offline"] = num
+        grant = {"uid": uid, "dev": device_id, "exp": int(self.time()) + self.grant_ttl,
+                 "blk": k["anti_tamper_block"], "rkey": k["anti_tamper_block_readkey"], "wkey": k["anti_tamper_block_writekey"],
+                 "txt": self.antitamper_txt(k["key_name"], k["anti_tamper_num"]),
+                 "otxt": self.antitamper_txt(k["key_name"], num)}
+        grant["sig"] = hmac_hex(self.grant_key, "|".join(str(v) for v in grant.values()))
+        return {"grant": grant, "now": int(self.time())}
+
+    def absorb_offline(self, uid, txt):
+        k = self.keys[uid]
+        if not self._check(k, "anti_tamper_num_offline", txt):
+            return False
+        k["anti_tamper_num"] = k.pop("anti_tamper_num_offline")
+        k["last_use"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        k["used_cnt"] = k.get("used_cnt", 0) + 1
+        self.offline.append((time.strftime("%Y-%m-%d %H:%M:%S"), uid, k["key_name"]))
+        return True
+
+    def required_code_len(self, k):
+        if "gauth_secret" in k:
+            return 10 if "gauth_pin" in k else 6
+        if "nfc_pin" in k:
+            return 4
+        return 0
+
+    def second_factor(self, k, gcode):
+        if "gauth_secret" in k:
+            if "gauth_pin" in k:
+                if gcode[:4] != k["gauth_pin"]:
+                    return False
+                gcode = gcode[4:]
+            return totp_valid(k["gauth_secret"], gcode)
+        if "nfc_pin" in k:
+            return gcode[:4] == k["nfc_pin"]
+        return False
+
+    def _resetfob(self, uid, out):
+        k = self.keys[uid]
+        if self.stream:
+            out.append(self._encode(dict({"status": "reset", "stream": 1}, **self.picked), True))
+            for i in range(1, 16):
+                out.append(self._encode({"s": i, "keyb": k["keyb"][i]}, True))
+        else:
+            out.append(self._encode(dict({"status": "reset", "keya": k["keya"], "keyb": k["keyb"]}, **self.picked)))
+        self.keys[uid] = {f: k[f] for f in ("key_name", "gauth_pin", "gauth_secret", "nfc_pin") if f in k}
+
+    def _initfob(self, uid, out):
+        k = self.keys[uid]
+        name = k["key_name"]
+        #never sector 0 and never the trailer
+        k["anti_tamper_block"] = self.rand.randint(1, 15) * 4 + self.rand.randint(0, 2)
+        k["anti_tamper_len"] = 8
+        k["used_cnt"] = 1
+        k["keya"] = [self.keys_txt(name, self._rand()) for _ in range(16)]
+        k["keyb"] = [self.keys_txt(name, self._rand()) for _ in range(16)]
+        k["anti_tamper_block_readkey"] = k["keya"][k["anti_tamper_block"] // 4]
+        k["anti_tamper_block_writekey"] = k["keyb"][k["anti_tamper_block"] // 4]
+        newnum = self._rand()
+        k["anti_tamper_num"] = newnum
+        txt = self.antitamper_txt(name, newnum)
+        filler = ["".join(self.rand.choice("0123456789abcdef") for _ in range(16)) for _ in range(60)]
+        if self.stream:
+            out.append(self._encode(dict({"status": "init", "stream": 1, "setantiblk": k["anti_tamper_block"],
+                                          "key": k["anti_tamper_block_writekey"], "txt": txt}, **self.picked), True))
+            for i in range(1, 16):
+                out.append(self._encode({"s": i, "keya": k["keya"][i], "keyb": k["keyb"][i],
+                                         "filler": filler[(i - 1) * 4:(i - 1) * 4 + 3]}, True))
+        else:
+            out.append(self._encode(dict({"status": "init", "setantiblk": k["anti_tamper_block"], "key": k["anti_tamper_block_writekey"],
+                                          "txt": txt, "keya": k["keya"], "keyb": k["keyb"], "filler": filler}, **self.picked)))
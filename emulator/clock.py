@@ -0,0 +1,93 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# Virtual clock. time.sleep*/ticks_*/time() of the firmware run on it, so a tap that takes seconds
+# on the door runs in milliseconds and every run is reproducible. Scheduled events (a card
+# placed on the reader, a key pressed, a timer callback) fire while the firmware sleeps.
+
+import builtins
+import time
+
+MASK = 0x3FFFFFFF
+
+now_us = 0
+events = []     #[ms, seq, fn] sorted by time, seq keeps the order of events at the same ms
+stop_ms = None  #advance() raises Stop once the clock gets there
+wall_s = 0      #real time when the virtual clock started, wall() of the server goes on from there
+rtc_s = 0       #time.time() of the ESP32 - wall(), a power cycle starts its RTC over
+boot_us = 0     #now_us of the last reset of the ESP32, its ticks start there
+_seq = 0
+_time = time.time
+
+
+class Stop(KeyboardInterrupt):
+    """End of the run. A KeyboardInterrupt, so do_work() leaves its loop the way it does on the REPL."""
+
+
+def reset():
+    global now_us, stop_ms, wall_s, rtc_s, boot_us
+    now_us = boot_us = 0
+    stop_ms = None
+    wall_s = int(_time())
+    rtc_s = 0
+    del events[:]
+
+
+def now_ms():
+    return now_us // 1000
+
+
+def wall():
+    """Seconds since the epoch on the virtual clock, the time of the server."""
+    return wall_s + now_us // 1000000
+
+
+def at(ms, fn):
+    """Call fn() once the clock reaches ms."""
+    global _seq
+    _seq += 1
+    events.append([ms, _seq, fn])
+    events.sort()
+
+
+def after(ms, fn):
+    at(now_ms() + ms, fn)
+
+
+def advance(ms):
+    """Let ms pass, events fire at their own time (a periodic timer fires once per period)."""
+    global now_us
+    end = now_us + int(ms * 1000)
+    while events and events[0][0] * 1000 <= end:
+        t, _, fn = events.pop(0)
+        now_us = max(now_us, t * 1000)
+        fn()
+    now_us = end
+    if stop_ms is not None and now_us >= stop_ms * 1000:
+        raise Stop()
+
+
+def _ticks_diff(a, b):
+    d = (a - b) & MASK
+    return d - MASK - 1 if d > MASK // 2 else d
+
+
+def install():
+    """Replace the clock functions of the time module and provide MicroPython's const() builtin."""
+    time.sleep = lambda s: advance(s * 1000)
+    time.sleep_ms = advance
+    time.sleep_us = lambda us: advance(us / 1000)
+    time.ticks_ms = lambda: ((now_us - boot_us) // 1000) & MASK
+    time.ticks_us = lambda: (now_us - boot_us) & MASK
+    time.ticks_cpu = time.ticks_us
+    time.ticks_add = lambda a, b: (a + b) & MASK
+    time.ticks_diff = _ticks_diff
+    time.time = lambda: wall() + rtc_s
+    builtins.const = lambda x: x
@@ -0,0 +1,67 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# 4x4 matrix keypad on the fake GPIOs. A column input reads high while a pressed key connects
+# it to a row the firmware drives high, like the real one with its pull-downs. Keys are pressed
+# on a schedule, optionally with contact bounce, and the column interrupt fires on the press.
+
+import random
+
+import machine
+from emulator import clock
+
+CHARS = "123A456B789C*0#D"
+
+
+class Keypad:
+
+    def __init__(self, rows, cols, bounce_ms=0, seed=1):
+        self.rows = rows
+        self.cols = cols
+        self.bounce_ms = bounce_ms
+        self.random = random.Random(seed)
+        self.down = {}      #key code -> (ms pressed, ms released)
+        for c in cols:
+            machine.Pin(c)._st.listeners.append(self._col)
+
+    def _col(self, pin):
+        ci = self.cols.index(pin)
+        t = clock.now_us / 1000
+        for r, rp in enumerate(self.rows):
+            if not machine._pins.get(rp) or not machine._pins[rp].value:
+                continue
+            span = self.down.get(r * len(self.cols) + ci)
+            if span is None:
+                continue
+            t0, t1 = span
+            if t0 <= t < t1 + self.bounce_ms:
+                if t - t0 < self.bounce_ms or t >= t1:
+                    return self.random.random() < 0.5
+                return 1
+        return 0
+
+    def press(self, at_ms, ch, hold_ms=70):
+        """Press key ch at at_ms for hold_ms."""
+        code = CHARS.index(ch)
+        col = self.cols[code % len(self.cols)]
+
+        def edge():
+            self.down[code] = (at_ms, at_ms + hold_ms)
+            pin = machine.Pin(col)
+            if pin.value():
+                pin._edge(1)
+        clock.at(at_ms, edge)
+
+    def type(self, at_ms, keys, gap_ms=200, hold_ms=70):
+        """Type a sequence, one key every gap_ms. Returns the ms after the last key."""
+        for ch in keys:
+            self.press(at_ms, ch, hold_ms)
+            at_ms += gap_ms
+        return at_ms
@@ -0,0 +1,393 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# python -m emulator.loadgen [options]: many readers tapping at once against the auth server.
+#
+# Every reader is a thread with a keep-alive connection that speaks the protocol like main.py
+# (sess2/sess3 or stage1-4 with --stages, stage1 skipped for the tags it saw before). The tags
+# are users of a generated user database: plain tags, NFC + PIN, NFC + GAuth and NFC + PIN +
+# GAuth, each carrying its anti-tamper text. A tap picks a free tag and a flow from --mix:
+#   tap      open the door, typing the PIN/GAuth code if the tag needs one
+#   close    long tap, closes the door (a "close" event, like eventqueue.py sends it)
+#   keyauth  PIN + GAuth code on the keypad without a tag
+#   china    a magic tag is reported (a "chinauid" event)
+#   unknown  a tag that is not in the database
+# --pull is the share of taps where the tag leaves after its new text was written but before
+# sess3/stage3: the next tap of that tag is a race condition hit (antitamper_temp_race_condition.txt).
+#
+# Without --url a stand-in (emulator.standin) runs in-process. For auth.php write the user
+# database with --make-db DIR first, then run with --url and the same --users and --seed.
+#
+#   > python -m emulator.loadgen --readers 200 --duration 30 --latency 30
+#   > python -m emulator.loadgen --readers 200 --duration 30 --latency 30 --lock
+#   > python -m emulator.loadgen --make-db /tmp/db --users 400 && cp /tmp/db/*.txt /var/www/rfid-auth/
+#   > python -m emulator.loadgen --url http://door-server/rfid-auth/auth.php --users 400
+
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+import urllib.parse
+
+from emulator.authserver import totp
+from emulator.standin import StandIn, serve
+
+FLOWS = ("tap", "close", "keyauth", "china", "unknown")
+KINDS = ("plain", "pin", "gauth", "gauth_pin")
+B32 = "ABCDEFGHIJKLMNOPQRSTUVWXYZ234567"
+
+
+class Tag:
+
+    def __init__(self, n, kind, rand):
+        self.uid = "%08x" % rand.getrandbits(32)
+        self.kind = kind
+        self.name = "load%d" % n
+        self.pin = "%04d" % rand.randrange(10000)
+        self.secret = "".join(rand.choice(B32) for _ in range(16))
+        self.txt = None     #anti-tamper text on the tag, None until enrolled
+        self.pulled = False #left the reader between the write and sess3/stage3
+
+    def entry(self):
+        """The tag in rfid.txt."""
+        e = {"key_name": self.name}
+        if self.kind == "pin":
+            e["nfc_pin"] = self.pin
+        elif self.kind in ("gauth", "gauth_pin"):
+            e["gauth_secret"] = self.secret
+            if self.kind == "gauth_pin":
+                e["gauth_pin"] = self.pin
+        return e
+
+    def code(self, num):
+        """What the user types on the keypad when the server asks for num digits."""
+        if self.kind == "pin":
+            return self.pin
+        if self.kind == "gauth_pin":
+            return self.pin + totp(self.secret)
+        return totp(self.secret)[:num]
+
+
+def make_tags(n, seed):
+    rand = random.Random(seed)
+    return [Tag(i, KINDS[i % len(KINDS)], rand) for i in range(n)]
+
+
+def user_db(tags):
+    """rfid.txt and googleauth.txt for the tags."""
+    keys = {t.uid: t.entry() for t in tags}
+    gauth = {t.pin: {"GAuthSecret": t.secret} for t in tags if t.kind == "gauth_pin"}
+    return keys, gauth
+
+
+class Results:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.taps = {f: [] for f in FLOWS + ("enroll",)}   #(outcome, ms on the wire)
+        self.requests = {}  #cmd -> [ms]
+        self.races = 0      #taps of a pulled tag that the server accepted
+        self.pulled = 0
+
+    def tap(self, flow, outcome, ms):
+        with self.lock:
+            self.taps[flow].append((outcome, ms))
+
+    def request(self, cmd, ms):
+        with self.lock:
+            self.requests.setdefault(cmd, []).append(ms)
+
+
+class Failed(Exception):
+    """The server did not answer."""
+
+
+class Reader(threading.Thread):
+
+    def __init__(self, n, gen):
+        threading.Thread.__init__(self, daemon=True)
+        self.device_id = "door%d" % n
+        self.gen = gen
+        self.rand = random.Random(gen.seed * 1000 + n)
+        self.conn = None
+        self.cards = {}         #uid -> (antiblk, key, len) of the tags seen here, like the card cache of main.py
+        self.wire_ms = 0
+
+    def post(self, js):
+        js["device_id"] = self.device_id
+        data = json.dumps(js).encode()
+        t = time.perf_counter()
+        while True:
+            reused = self.conn is not None
+            if not reused:
+                self.conn = self.gen.connect()
+            try:
+                self.conn.request("POST", self.gen.path, data, {"Content-Type": "application/json"})
+                body = self.conn.getresponse().read()
+                break
+            except (OSError, http.client.HTTPException):
+                self.conn.close()
+                self.conn = None
+                #like httpclient.py: once more on a new connection if the kept one was closed meanwhile
+                if not reused:
+                    raise Failed()
+        ms = (time.perf_counter() - t) * 1000
+        self.wire_ms += ms
+        self.gen.results.request(js["cmd"], ms)
+        try:
+            return json.loads(body.split(b"\n", 1)[0])
+        except ValueError:
+            return {"status": body.decode(errors="replace")}
+
+    def run(self):
+        gen = self.gen
+        gen.pause(self.rand.uniform(0, gen.interval_ms / 1000))
+        while time.time() < gen.deadline:
+            flow = self.rand.choices(FLOWS, gen.mix)[0]
+            self.wire_ms = 0
+            outcome = "failed"
+            tag = gen.take(self.rand, flow)
+            if tag is None and flow in ("tap", "close"):
+                #every tag is at another reader right now
+                gen.pause(gen.interval_ms / 1000)
+                continue
+            try:
+                if tag is None:
+                    outcome = self.anonymous(flow)
+                else:
+                    if tag.txt is None:
+                        flow = "enroll"
+                    outcome = self.tag_tap(tag, flow)
+            except Failed:
+                pass
+            finally:
+                gen.give_back(tag)
+            gen.results.tap(flow, outcome, self.wire_ms)
+            gen.pause(self.rand.expovariate(1000 / gen.interval_ms))
+        if self.conn is not None:
+            self.conn.close()
+
+    def anonymous(self, flow):
+        if flow == "keyauth":
+            tag = self.rand.choice(self.gen.gauth_pin_tags)
+            return "ok" if self.post({"cmd": "keyauth", "uid": "", "key": tag.code(10)}).get("status") == "kk" else "rejected"
+        uid = "%08x" % self.rand.getrandbits(32)
+        if flow == "china":
+            return "ok" if self.event({"ev": "chinauid", "uid": uid}).get("status") == "ok" else "rejected"
+        return "ok" if self.post({"cmd": "stage1", "uid": uid}).get("status") == "err" else "rejected"
+
+    def event(self, ev):
+        #a batch of one event, the reader sends it after the tap
+        ev["device_id"] = self.device_id
+        ev["t"] = time.time()
+        return self.post({"cmd": "events", "now": time.time(), "events": [ev]})
+
+    def tag_tap(self, tag, flow):
+        gen = self.gen
+        doorcmd = "close" if flow == "close" else "open"
+        if tag.uid not in self.cards:
+            js = self.post({"cmd": "stage1", "uid": tag.uid})
+            if js.get("status") == "init":
+                tag.txt = js["txt"]
+                return "ok"
+            if js.get("status") != "k":
+                return "rejected"
+            self.cards[tag.uid] = (js["antiblk"], js["key"], js["len"])
+        pulled = tag.pulled
+        js = self.post({"cmd": "stage2" if gen.stages else "sess2", "uid": tag.uid, "key": tag.txt})
+        if "forget" in js:
+            del self.cards[tag.uid]
+        if js.get("status") != "kk":
+            return "rejected"
+        if pulled:
+            with gen.results.lock:
+                gen.results.races += 1
+            tag.pulled = False
+        #the new text is on the tag from here on
+        tag.txt = js["txt"]
+        if self.rand.random() < gen.pull:
+            tag.pulled = True
+            with gen.results.lock:
+                gen.results.pulled += 1
+            return "pulled"
+        if flow == "close":
+            time.sleep(gen.hold_ms / 1000)
+            return "ok" if self.event({"ev": "close", "uid": tag.uid, "key": tag.txt}).get("status") == "ok" else "rejected"
+        if gen.stages:
+            js = self.post({"cmd": "stage3", "uid": tag.uid, "key": tag.txt, "doorcmd": doorcmd})
+            if js.get("status") == "getcode":
+                time.sleep(gen.type_ms / 1000)
+                js = self.post({"cmd": "stage4", "uid": tag.uid, "key": tag.txt, "doorcmd": doorcmd,
+                                "gcode": tag.code(int(js["num"]))})
+        else:
+            sess3 = {"cmd": "sess3", "uid": tag.uid, "key": tag.txt, "doorcmd": doorcmd}
+            if doorcmd == "open" and int(js.get("num", 0)) > 0:
+                time.sleep(gen.type_ms / 1000)
+                sess3["gcode"] = tag.code(int(js["num"]))
+            js = self.post(sess3)
+            if "antiblk" in js:
+                self.cards[tag.uid] = (js["antiblk"], js["key"], js["len"])
+        return "ok" if js.get("status") == "done" else "rejected"
+
+
+class LoadGen:
+
+    def __init__(self, url, tags, readers, duration, mix, interval_ms=5000, stages=False, pull=0.0,
+                 hold_ms=2000, type_ms=3000, seed=1):
+        u = urllib.parse.urlsplit(url)
+        self.https = u.scheme == "https"
+        self.host = u.hostname
+        self.port = u.port or (443 if self.https else 80)
+        self.path = u.path or "/"
+        self.tags = tags
+        self.free = list(tags)
+        self.gauth_pin_tags = [t for t in tags if t.kind == "gauth_pin"] or tags
+        self.free_lock = threading.Lock()
+        self.duration = duration
+        self.mix = mix
+        self.interval_ms = interval_ms
+        self.stages = stages
+        self.pull = pull
+        self.hold_ms = hold_ms
+        self.type_ms = type_ms
+        self.seed = seed
+        self.deadline = 0
+        self.results = Results()
+        self.readers = [Reader(i, self) for i in range(readers)]
+
+    def connect(self):
+        if self.https:
+            return http.client.HTTPSConnection(self.host, self.port, timeout=5)
+        return http.client.HTTPConnection(self.host, self.port, timeout=5)
+
+    def take(self, rand, flow):
+        """A tag no other reader holds right now, None if all are in use or the flow needs none."""
+        if flow not in ("tap", "close"):
+            return None
+        with self.free_lock:
+            if not self.free:
+                return None
+            return self.free.pop(rand.randrange(len(self.free)))
+
+    def pause(self, s):
+        #between taps, not beyond the end of the run
+        time.sleep(max(0, min(s, self.deadline - time.time())))
+
+    def give_back(self, tag):
+        if tag is not None:
+            with self.free_lock:
+                self.free.append(tag)
+
+    def run(self):
+        started = time.time()
+        self.deadline = started + self.duration
+        for r in self.readers:
+            r.start()
+        for r in self.readers:
+            r.join()
+        return time.time() - started
+
+
+def percentile(v, p):
+    v = sorted(v)
+    return v[min(len(v) - 1, int(len(v) * p / 100))] if v else 0
+
+
+def report(gen, wall, standin=None):
+    res = gen.results
+    taps = sum(len(v) for v in res.taps.values())
+    reqs = sum(len(v) for v in res.requests.values())
+    print("%d readers, %d tags, %.1f s: %d taps (%.1f/s), %d requests (%.1f/s)"
+          % (len(gen.readers), len(gen.tags), wall, taps, taps / wall, reqs, reqs / wall))
+    print("%-8s %7s %7s %8s %7s %7s %8s %8s %8s %8s" % ("flow", "taps", "ok", "rejected", "failed", "pulled",
+                                                      "p50 ms", "p90 ms", "p99 ms", "max ms"))
+    for flow, v in res.taps.items():
+        if not v:
+            continue
+        ms = [m for o, m in v if o != "failed"]
+        print("%-8s %7d %7d %8d %7d %7d %8.1f %8.1f %8.1f %8.1f"
+              % (flow, len(v), sum(o == "ok" for o, m in v), sum(o == "rejected" for o, m in v),
+                 sum(o == "failed" for o, m in v), sum(o == "pulled" for o, m in v),
+                 percentile(ms, 50), percentile(ms, 90), percentile(ms, 99), max(ms or [0])))
+    print("(tap latency: time on the wire, without holding the tag and typing codes)")
+    print("%-8s %7s %8s %8s %8s %8s" % ("request", "n", "p50 ms", "p90 ms", "p99 ms", "max ms"))
+    for cmd, ms in sorted(res.requests.items()):
+        print("%-8s %7d %8.1f %8.1f %8.1f %8.1f"
+              % (cmd, len(ms), percentile(ms, 50), percentile(ms, 90), percentile(ms, 99), max(ms)))
+    print("tags pulled before sess3/stage3: %d, race condition hits: %d" % (res.pulled, res.races))
+    if standin is not None:
+        print("server: %(requests)d requests, %(dropped)d dropped, %(writes)d rfid.txt writes, %(lost_updates)d lost updates"
+              % standin.stats + ", %d race conditions logged, %d door commands" % (len(standin.races), len(standin.doors)))
+
+
+def main():
+    p = argparse.ArgumentParser(prog="python -m emulator.loadgen", description="Many readers tapping against the auth server.")
+    p.add_argument("--url", help="auth.php to test (default: an in-process stand-in)")
+    p.add_argument("--readers", type=int, default=100)
+    p.add_argument("--users", type=int, default=0, help="tags, default 2 per reader")
+    p.add_argument("--duration", type=float, default=20, metavar="S")
+    p.add_argument("--interval", type=int, default=5000, metavar="MS", help="mean pause of a reader between taps")
+    p.add_argument("--mix", default="tap=80,close=10,keyauth=4,china=2,unknown=4", help="weights of the flows")
+    p.add_argument("--stages", action="store_true", help="stage1-4 instead of the session protocol")
+    p.add_argument("--pull", type=float, default=0.01, metavar="RATE", help="share of taps where the tag leaves before sess3")
+    p.add_argument("--hold", type=int, default=2000, metavar="MS", help="long tap")
+    p.add_argument("--type", type=int, default=3000, metavar="MS", help="typing a PIN/GAuth code")
+    p.add_argument("--seed", type=int, default=1, help="the tags (uids, PINs, secrets) follow from it")
+    p.add_argument("--make-db", metavar="DIR", help="only write rfid.txt and googleauth.txt of the tags to DIR")
+    g = p.add_argument_group("in-process stand-in")
+    g.add_argument("--latency", type=int, default=30, metavar="MS")
+    g.add_argument("--jitter", type=int, default=20, metavar="MS")
+    g.add_argument("--fail", type=float, default=0.0, metavar="RATE")
+    g.add_argument("--lock", action="store_true", help="serialize the requests (auth.php does not)")
+    a = p.parse_args()
+
+    tags = make_tags(a.users or 2 * a.readers, a.seed)
+    keys, gauth = user_db(tags)
+    if a.make_db:
+        for name, d in (("rfid.txt", keys), ("googleauth.txt", gauth)):
+            with open("%s/%s" % (a.make_db, name), "w") as f:
+                json.dump(d, f, indent=4)
+        return
+    mix = dict((f, 0) for f in FLOWS)
+    for part in a.mix.split(","):
+        name, _, w = part.partition("=")
+        if name.strip() not in mix:
+            p.error("unknown flow %s" % name)
+        mix[name.strip()] = float(w)
+
+    standin = None
+    url = a.url
+    if url is None:
+        standin = StandIn(keys=keys, gauth=gauth, latency_ms=a.latency, jitter_ms=a.jitter, fail=a.fail, lock=a.lock)
+        url = "http://%s:%d/auth.php" % serve(standin).server_address
+    gen = LoadGen(url, tags, a.readers, a.duration, [mix[f] for f in FLOWS], a.interval, a.stages, a.pull,
+                  a.hold, a.type, a.seed)
+    print("enrolling %d tags..." % len(tags))
+    enroll = Reader(a.readers, gen)
+    for t in tags:
+        for attempt in range(10):
+            try:
+                enroll.tag_tap(t, "enroll")
+                break
+            except Failed:
+                pass
+    gen.results = Results()
+    if standin is not None:
+        #the report is about the load only
+        standin.stats.update(dict.fromkeys(standin.stats, 0))
+        del standin.races[:], standin.doors[:]
+    wall = gen.run()
+    report(gen, wall, standin)
+
+
+if __name__ == "__main__":
+    main()
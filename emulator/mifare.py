@@ -0,0 +1,282 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# MIFARE Classic 1K tag as the reader sees it over the air: ISO 14443-3 states (IDLE, READY,
+# ACTIVE, HALT), REQA/WUPA/anticollision/select/HLTA with 4, 7 or 10 byte UIDs (cascade levels,
+# bit oriented anticollision frames), and per sector authentication with the
+# keys and access bits of its trailer. Crypto1 itself is not modelled, the MFRC522 model hands
+# the key to authenticate() directly, but what a key allows afterwards follows the datasheet.
+# magic=True makes it a "Chinese" gen1 tag that answers the 0x40 backdoor and lets block 0 be written.
+
+IDLE, READY, ACTIVE, HALT = range(4)
+
+ACK = b"\x0a"
+NAK = b"\x04"
+
+#access conditions C1C2C3 of a data block -> (read, write) by key A / key B
+DATA_ACCESS = {
+    0b000: ("AB", "AB"),
+    0b010: ("AB", ""),
+    0b100: ("AB", "B"),
+    0b110: ("AB", "B"),
+    0b001: ("AB", ""),
+    0b011: ("B", "B"),
+    0b101: ("B", ""),
+    0b111: ("", ""),
+}
+
+#access conditions of the sector trailer -> (key A write, access bits read, access bits write, key B read, key B write)
+TRAILER_ACCESS = {
+    0b000: ("A", "A", "", "A", "A"),
+    0b010: ("", "A", "", "A", ""),
+    0b100: ("B", "AB", "", "", "B"),
+    0b110: ("", "AB", "", "", ""),
+    0b001: ("A", "A", "A", "A", "A"),
+    0b011: ("B", "AB", "B", "", "B"),
+    0b101: ("", "AB", "B", "", ""),
+    0b111: ("", "AB", "", "", ""),
+}
+
+TRANSPORT_TRAILER = b"\xff" * 6 + b"\xff\x07\x80\x69" + b"\xff" * 6
+
+SEL = (0x93, 0x95, 0x97)    #SEL of cascade level 1, 2, 3
+CT = 0x88                   #cascade tag
+
+
+def crc_a(data):
+    """CRC_A of ISO 14443-3 as the two bytes that go on the air."""
+    crc = 0x6363
+    for b in data:
+        b ^= crc & 0xFF
+        b = (b ^ (b << 4)) & 0xFF
+        crc = ((crc >> 8) ^ (b << 8) ^ (b << 3) ^ (b >> 4)) & 0xFFFF
+    return bytes((crc & 0xFF, crc >> 8))
+
+
+def bcc(uid):
+    x = 0
+    for b in uid:
+        x ^= b
+    return x
+
+
+class Classic1K:
+
+    def __init__(self, uid=b"\x0a\xcd\x3f\x15", magic=False):
+        self.uid = bytes(uid)
+        self.magic = magic
+        self.blocks = [bytearray(16) for _ in range(64)]
+        self.levels = {4: 1, 7: 2, 10: 3}[len(self.uid)]
+        self.atqa = bytes([(self.levels - 1) << 6 | 0x04, 0x00])
+        if self.levels == 1:
+            self.blocks[0][0:5] = self.uid + bytes([bcc(self.uid)])
+            self.blocks[0][5:8] = b"\x08" + self.atqa
+        else:
+            self.blocks[0][0:len(self.uid)] = self.uid
+            self.blocks[0][len(self.uid):len(self.uid) + 3] = b"\x08" + self.atqa
+        for s in range(16):
+            self.blocks[s * 4 + 3][:] = TRANSPORT_TRAILER
+        self.state = IDLE
+        self.halted = False
+        self.level = 0          #cascade level of the next anticollision/select in READY
+        self.auth_sector = -1
+        self.auth_key = ""      #"A" or "B" after a successful authentication
+        self.pending_write = -1
+        self.writes = 0         #blocks written, to count what a provisioning costs
+        self.reads = 0
+
+    @property
+    def uid_hex(self):
+        return self.uid.hex()
+
+    @property
+    def auth_uid(self):
+        """The 4 bytes the reader authenticates with: the UID, the last 4 bytes of a 7/10 byte one."""
+        return self.uid[-4:]
+
+    def cascade(self, level):
+        """UID CLn of a cascade level with its BCC, as sent during anticollision and select."""
+        if level + 1 < self.levels:
+            cl = bytes([CT]) + self.uid[level * 3:level * 3 + 3]
+        else:
+            cl = self.uid[-4:]
+        return cl + bytes([bcc(cl)])
+
+    def power_off(self):
+        """Taken out of the field (or the field went off): everything but the memory is lost."""
+        self.state = IDLE
+        self.halted = False
+        self.level = 0
+        self._logout()
+
+    def _logout(self):
+        self.auth_sector = -1
+        self.auth_key = ""
+        self.pending_write = -1
+
+    def _to_idle(self):
+        #any unexpected or failed command sends the tag back to IDLE (or HALT if it was halted)
+        self.state = HALT if self.halted else IDLE
+        self._logout()
+
+    def access_bits(self, block):
+        t = self.blocks[(block // 4) * 4 + 3]
+        i = block % 4
+        c1 = (t[7] >> (4 + i)) & 1
+        c2 = (t[8] >> i) & 1
+        c3 = (t[8] >> (4 + i)) & 1
+        return (c1 << 2) | (c2 << 1) | c3
+
+    def _key_b_readable(self, sector):
+        return "A" in TRAILER_ACCESS[self.access_bits(sector * 4 + 3)][3]
+
+    def _allowed(self, who):
+        #a key B that can be read from the trailer is no key: it authenticates, but allows nothing
+        if self.auth_key == "B" and self._key_b_readable(self.auth_sector):
+            return False
+        return self.auth_key in who
+
+    def can_read(self, block):
+        if block % 4 == 3:
+            return True
+        return self._allowed(DATA_ACCESS[self.access_bits(block)][0])
+
+    def can_write(self, block):
+        if block == 0:
+            return self.magic
+        if block % 4 == 3:
+            return any(self._allowed(w) for w in TRAILER_ACCESS[self.access_bits(block)][::2])
+        return self._allowed(DATA_ACCESS[self.access_bits(block)][1])
+
+    def authenticate(self, mode, block, key, uid):
+        """AUTHENT1A (0x60) / AUTHENT1B (0x61) with the key and the uid the reader sent."""
+        if self.state != ACTIVE or block >= 64 or bytes(uid[:4]) != self.auth_uid:
+            return False
+        t = self.blocks[(block // 4) * 4 + 3]
+        k = t[10:16] if mode == 0x61 else t[0:6]
+        if bytes(k) != bytes(key):
+            self._to_idle()
+            return False
+        self.auth_sector = block // 4
+        self.auth_key = "B" if mode == 0x61 else "A"
+        return True
+
+    def _read_trailer(self, blk):
+        kaw, accr, accw, kbr, kbw = TRAILER_ACCESS[self.access_bits(blk)]
+        t = self.blocks[blk]
+        d = bytearray(16)   #key A never reads back
+        if self._allowed(accr):
+            d[6:10] = t[6:10]
+        if self._allowed(kbr):
+            d[10:16] = t[10:16]
+        return d
+
+    def _write_trailer(self, blk, body):
+        #each part of the trailer is only written if the key allows it, the others stay as they are
+        kaw, accr, accw, kbr, kbw = [self._allowed(w) for w in TRAILER_ACCESS[self.access_bits(blk)]]
+        t = self.blocks[blk]
+        if kaw:
+            t[0:6] = body[0:6]
+        if accw:
+            t[6:10] = body[6:10]
+        if kbw:
+            t[10:16] = body[10:16]
+
+    def _anticoll(self, data):
+        #ANTICOLLISION: NVB says how many bits of UID CLn the reader already knows (in data[2:]).
+        #Only a tag whose UID starts with them answers, with the rest of UID CLn. The first byte
+        #is a partial one, its known low bits are sent as 0 (the reader's RxAlign skips them)
+        nb, lb = (data[1] >> 4) - 2, data[1] & 0x07
+        if nb < 0 or nb > 4 or (nb == 4 and lb) or len(data) < 2 + nb + (1 if lb else 0):
+            return None
+        cl = self.cascade(self.level)
+        for i in range(nb * 8 + lb):
+            if (data[2 + (i >> 3)] ^ cl[i >> 3]) >> (i & 7) & 1:
+                return None
+        resp = bytearray(cl[nb:])
+        resp[0] &= (0xFF << lb) & 0xFF
+        return bytes(resp), len(resp) * 8
+
+    def frame(self, data, txbits):
+        """One frame from the reader (txbits of the last byte), returns (answer, answer bits) or None."""
+        if len(data) == 0:
+            return None
+        cmd = data[0]
+        if txbits == 7 and len(data) == 1:
+            #a halted tag woken by WUPA stays halted (READY*/ACTIVE*): if anything goes wrong it
+            #falls back to HALT, not IDLE, until it leaves the field
+            if cmd == 0x26 and self.state == IDLE:
+                self.state = READY
+                self.level = 0
+                return self.atqa, 16
+            if cmd == 0x52 and self.state in (IDLE, HALT):
+                self.state = READY
+                self.level = 0
+                return self.atqa, 16
+            if cmd == 0x40 and self.magic and self.state in (IDLE, HALT):
+                return ACK, 4
+            if cmd in (0x26, 0x52) and self.state == READY:
+                self.level = 0
+                return self.atqa, 16
+            if self.state in (READY, ACTIVE):
+                self._to_idle()
+            return None
+        if self.state == READY and cmd == SEL[self.level] and len(data) >= 2 and data[1] != 0x70:
+            return self._anticoll(data)
+        if len(data) >= 3 and crc_a(data[:-2]) != bytes(data[-2:]):
+            if self.state in (READY, ACTIVE):
+                self._to_idle()
+            return None
+        body = data[:-2]
+        if self.state == READY and cmd == SEL[self.level] and len(body) == 7 and body[1] == 0x70:
+            if bytes(body[2:7]) != self.cascade(self.level):
+                return None
+            if self.level + 1 < self.levels:
+                self.level += 1
+                return b"\x04" + crc_a(b"\x04"), 24  #SAK: UID not complete
+            self.state = ACTIVE
+            return b"\x08" + crc_a(b"\x08"), 24
+        if self.state != ACTIVE:
+            if self.state == READY:
+                self._to_idle()
+            return None
+        if self.pending_write >= 0:
+            #second half of a WRITE: the 16 data bytes
+            blk = self.pending_write
+            self.pending_write = -1
+            if len(body) != 16:
+                self._to_idle()
+                return None
+            if blk % 4 == 3:
+                self._write_trailer(blk, body)
+            else:
+                self.blocks[blk][:] = body
+            self.writes += 1
+            return ACK, 4
+        if cmd == 0x50 and len(body) == 2:
+            self.halted = True
+            self._to_idle()
+            return None
+        if cmd == 0x30 and len(body) == 2:
+            blk = body[1]
+            if blk // 4 != self.auth_sector or not self.can_read(blk):
+                self._to_idle()
+                return NAK, 4
+            d = self._read_trailer(blk) if blk % 4 == 3 else bytearray(self.blocks[blk])
+            self.reads += 1
+            return bytes(d) + crc_a(d), 144
+        if cmd == 0xA0 and len(body) == 2:
+            blk = body[1]
+            if blk // 4 != self.auth_sector or not self.can_write(blk):
+                return NAK, 4
+            self.pending_write = blk
+            return ACK, 4
+        self._to_idle()
+        return None
@@ -0,0 +1,42 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# esp32 module of the emulator: NVS, kept in a dict (flash survives resets of the emulated ESP32).
+
+store = {}      #(namespace, key) -> bytes
+writes = [0]    #commit() calls, each one is a flash write
+
+
+def _reset():
+    store.clear()
+    writes[0] = 0
+
+
+class NVS:
+
+    def __init__(self, namespace):
+        self.ns = namespace
+
+    def set_blob(self, key, value):
+        store[(self.ns, key)] = bytes(value)
+
+    def get_blob(self, key, buf):
+        if (self.ns, key) not in store:
+            raise OSError(-4354)   #ESP_ERR_NVS_NOT_FOUND
+        v = store[(self.ns, key)]
+        buf[:len(v)] = v
+        return len(v)
+
+    def erase_key(self, key):
+        if store.pop((self.ns, key), None) is None:
+            raise OSError(-4354)
+
+    def commit(self):
+        writes[0] += 1
@@ -0,0 +1,253 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# machine module of the emulator: GPIOs, SPI bus, timers and the watchdog on the virtual clock.
+# Models (reader, keypad) attach to pins by number: a listener answers value() reads of an
+# input, a watcher sees every level the firmware drives on an output.
+
+from emulator import clock
+
+SLEEP = 2
+DEEPSLEEP = 4
+PWRON_RESET = 1
+HARD_RESET = 2
+WDT_RESET = 3
+DEEPSLEEP_RESET = 4
+SOFT_RESET = 5
+
+_pins = {}          #pin number -> _PinState
+_spi_devices = []   #models with a cs pin and spi_byte()
+_timers = {}        #hardware timer (group, index) -> generation of what runs on it, see Timer
+sleeps = [0, 0]     #lightsleep() calls, ms asked for
+cause = [PWRON_RESET]   #reset_cause() of this run
+rtc_memory = [b""]      #RTC.memory(), survives resets but not power cycles
+
+
+def _reset():
+    _pins.clear()
+    del _spi_devices[:]
+    _timers.clear()
+    sleeps[0] = sleeps[1] = 0
+    cause[0] = PWRON_RESET
+    rtc_memory[0] = b""
+    WDT.instance = None
+
+
+def _restart(power=False):
+    """The ESP32 resets: its timers and pin interrupts are gone, the models on the pins stay. A power cycle
+    also loses the RTC memory and the time of the RTC."""
+    for st in _pins.values():
+        st.handler = None
+        st.wake = None
+    for hw in _timers:
+        _timers[hw] += 1
+    WDT.instance = None
+    clock.boot_us = clock.now_us
+    cause[0] = PWRON_RESET if power else WDT_RESET
+    if power:
+        rtc_memory[0] = b""
+        clock.rtc_s = -clock.wall()
+
+
+class _PinState:
+
+    def __init__(self):
+        self.value = 0
+        self.handler = None
+        self.trigger = 0
+        self.wake = None
+        self.listeners = []
+        self.watchers = []
+
+
+class Pin:
+    IN = 1
+    OUT = 2
+    OPEN_DRAIN = 3
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 1
+    IRQ_RISING = 2
+    WAKE_LOW = 4
+    WAKE_HIGH = 5
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.id = id
+        self._st = _pins.setdefault(id, _PinState())
+        if value is not None:
+            self.value(value)
+
+    def init(self, mode=-1, pull=-1, value=None):
+        if value is not None:
+            self.value(value)
+
+    def value(self, v=None):
+        if v is None:
+            for f in self._st.listeners:
+                r = f(self.id)
+                if r is not None:
+                    return r
+            return self._st.value
+        self._set(1 if v else 0)
+
+    def _set(self, v):
+        """Drive the pin, from the firmware (value()) or a model (an IRQ output)."""
+        old = self._st.value
+        self._st.value = v
+        for f in self._st.watchers:
+            f(v)
+        if old != v:
+            self._edge(v)
+
+    def _edge(self, v):
+        """A model saw the level of an input change: run the irq handler if the edge matches."""
+        st = self._st
+        if st.handler and (v == 0 and st.trigger & Pin.IRQ_FALLING or v == 1 and st.trigger & Pin.IRQ_RISING):
+            st.handler(self)
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    def __call__(self, v=None):
+        return self.value(v)
+
+    def irq(self, handler=None, trigger=3, wake=None):
+        self._st.handler = handler
+        self._st.trigger = trigger
+        self._st.wake = trigger if wake else None
+
+
+class SPI:
+
+    def __init__(self, id=1, baudrate=0, **kw):
+        pass
+
+    def init(self, *a, **kw):
+        pass
+
+    def _dev(self):
+        for d in _spi_devices:
+            if d.cs in _pins and _pins[d.cs].value == 0:
+                return d
+        raise OSError("SPI transfer without a selected device")
+
+    def write(self, buf):
+        d = self._dev()
+        for b in bytes(buf):
+            d.spi_byte(b)
+
+    def read(self, n, write=0):
+        d = self._dev()
+        return bytes(d.spi_byte(write) for _ in range(n))
+
+    def readinto(self, buf, write=0):
+        d = self._dev()
+        for i in range(len(buf)):
+            buf[i] = d.spi_byte(write)
+
+    def write_readinto(self, wbuf, rbuf):
+        d = self._dev()
+        wb = bytes(wbuf)
+        for i in range(len(wb)):
+            rbuf[i] = d.spi_byte(wb[i])
+
+
+class Timer:
+    """Like the ESP32 port: Timer(id) is hardware timer group (id>>1)&1, index id&1, so ids that map to the
+    same one share it and init() of one ends what the other was running."""
+    PERIODIC = 1
+    ONE_SHOT = 0
+
+    def __init__(self, id=-1):
+        self.id = id
+        self.hw = ((id >> 1) & 1, id & 1) if id >= 0 else self
+        _timers.setdefault(self.hw, 0)
+
+    def init(self, mode=PERIODIC, period=1000, callback=None, freq=None):
+        if freq:
+            period = 1000 // freq
+        _timers[self.hw] += 1
+        gen = _timers[self.hw]
+
+        def fire():
+            if _timers[self.hw] != gen:
+                return
+            if mode == Timer.PERIODIC:
+                clock.after(period, fire)
+            callback(self)
+        if callback is not None:
+            clock.after(period, fire)
+
+    def deinit(self):
+        _timers[self.hw] += 1
+
+
+class WDT:
+    """Watchdog, records the longest time between two feeds instead of resetting the emulator."""
+
+    instance = None
+
+    def __init__(self, id=0, timeout=5000):
+        self.timeout = timeout
+        self.last = clock.now_ms()
+        self.longest = 0
+        WDT.instance = self
+
+    def feed(self):
+        now = clock.now_ms()
+        self.longest = max(self.longest, now - self.last)
+        self.last = now
+
+    def expired(self):
+        """True if the real watchdog would have reset the ESP32 at some point."""
+        return max(self.longest, clock.now_ms() - self.last) > self.timeout
+
+
+def idle():
+    clock.advance(1)
+
+
+def lightsleep(ms=None):
+    """Sleep until ms passed or a wake pin (irq(wake=SLEEP)) reaches its level."""
+    sleeps[0] += 1
+    sleeps[1] += ms or 0
+    end = clock.now_ms() + (ms or 0x3FFFFFFF)
+    while clock.now_ms() < end:
+        clock.advance(1)
+        for n, st in _pins.items():
+            if st.wake is not None and Pin(n).value() == (1 if st.wake == Pin.WAKE_HIGH else 0):
+                return
+
+
+class RTC:
+
+    def memory(self, data=None):
+        if data is None:
+            return rtc_memory[0]
+        rtc_memory[0] = bytes(data)
+
+
+def reset_cause():
+    return cause[0]
+
+
+def freq(f=None):
+    return 240000000
+
+
+def reset():
+    raise clock.Stop()
+
+
+def unique_id():
+    return b"\x24\x0a\xc4\x00\x00\x01"
@@ -0,0 +1,35 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# micropython module of the emulator.
+
+
+def const(x):
+    return x
+
+
+def alloc_emergency_exception_buf(n):
+    pass
+
+
+def schedule(f, arg):
+    f(arg)
+    return True
+
+
+def native(f):
+    return f
+
+
+viper = native
+
+
+def mem_info(verbose=None):
+    pass
@@ -0,0 +1,42 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# neopixel of the emulator, the LED sink: every write() of the strip is recorded with its time.
+
+from emulator import clock
+
+
+class NeoPixel:
+
+    def __init__(self, pin, n, bpp=3, timing=1):
+        self.n = n
+        self.buf = [(0, 0, 0)] * n
+        self.history = []   #(ms, frame) of every write()
+
+    def __setitem__(self, i, v):
+        self.buf[i] = tuple(v)
+
+    def __getitem__(self, i):
+        return self.buf[i]
+
+    def __len__(self):
+        return self.n
+
+    def fill(self, v):
+        for i in range(self.n):
+            self.buf[i] = tuple(v)
+
+    def write(self):
+        self.history.append((clock.now_ms(), tuple(self.buf)))
+
+    @property
+    def shown(self):
+        """Frame the strip shows right now."""
+        return self.history[-1][1] if self.history else tuple(self.buf)
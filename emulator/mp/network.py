@@ -0,0 +1,125 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# network module of the emulator: one access point, the association runs on the virtual clock.
+# Without a BSSID the driver scans every channel first, a DHCP lease takes dhcp_ms more unless
+# a static address was set with ifconfig().
+
+from emulator import clock
+
+STA_IF = 0
+AP_IF = 1
+STAT_IDLE = 1000
+STAT_CONNECTING = 1001
+STAT_GOT_IP = 1010
+STAT_NO_AP_FOUND = 201
+STAT_WRONG_PASSWORD = 202
+
+ap_ssid = "WIFI_Name"
+ap_bssid = b"\x3c\x84\x6a\x10\x20\x30"
+ap_channel = 6
+ap_rssi = -58
+scan_ms = 1800      #all channels
+assoc_ms = 120      #authentication and association with a known AP
+dhcp_ms = 700
+up = True           #False: the AP does not answer
+stats = {"scans": 0, "dhcp": 0}
+_wlan = None
+
+
+def _reset():
+    global ap_ssid, ap_bssid, ap_channel, scan_ms, assoc_ms, dhcp_ms, up, _wlan
+    ap_ssid = "WIFI_Name"
+    ap_bssid = b"\x3c\x84\x6a\x10\x20\x30"
+    ap_channel = 6
+    scan_ms = 1800
+    assoc_ms = 120
+    dhcp_ms = 700
+    up = True
+    stats.update(scans=0, dhcp=0)
+    _wlan = None
+
+
+def _restart():
+    #the ESP32 resets, the Wi-Fi driver starts from scratch
+    global _wlan
+    _wlan = None
+
+
+class WLAN:
+    """The station interface, one instance like on the ESP32."""
+
+    def __new__(cls, interface=STA_IF):
+        global _wlan
+        if _wlan is None:
+            _wlan = object.__new__(cls)
+            _wlan.on = False
+            _wlan.cfg = {"channel": 1, "dhcp_hostname": "espressif"}
+            _wlan.static = None     #ifconfig() tuple, None = DHCP
+            _wlan.up_ms = None      #virtual ms the link is (going to be) up
+            _wlan.dhcp_ms = None    #virtual ms a DHCP started on the running link has its lease
+            _wlan.st = STAT_IDLE
+        return _wlan
+
+    def active(self, on=None):
+        if on is not None:
+            self.on = on
+        return self.on
+
+    def config(self, name=None, **kw):
+        if name is not None:
+            return self.cfg[name]
+        self.cfg.update(kw)
+
+    def scan(self):
+        stats["scans"] += 1
+        clock.advance(scan_ms)
+        return [(ap_ssid.encode(), ap_bssid, ap_channel, ap_rssi, 3, False)] if up else []
+
+    def connect(self, ssid=None, key=None, bssid=None):
+        self.up_ms = None
+        if not up or ssid != ap_ssid or bssid is not None and bssid != ap_bssid:
+            self.st = STAT_NO_AP_FOUND
+            return
+        self.st = STAT_CONNECTING
+        ms = assoc_ms
+        if bssid is None or self.cfg["channel"] != ap_channel:
+            ms += scan_ms
+        if self.static is None:
+            ms += dhcp_ms
+            stats["dhcp"] += 1
+        self.up_ms = clock.now_ms() + ms
+
+    def disconnect(self):
+        self.up_ms = None
+        self.st = STAT_IDLE
+
+    def isconnected(self):
+        if self.up_ms is not None and clock.now_ms() >= self.up_ms:
+            self.st = STAT_GOT_IP
+            self.cfg["channel"] = ap_channel
+            return True
+        return False
+
+    def status(self, param=None):
+        if param == "rssi":
+            return ap_rssi
+        return self.st
+
+    def ifconfig(self, cfg=None):
+        if cfg is None:
+            if self.dhcp_ms is not None and clock.now_ms() < self.dhcp_ms:
+                return ("0.0.0.0", "0.0.0.0", "0.0.0.0", "0.0.0.0")
+            return self.static or ("192.168.1.57", "255.255.255.0", "192.168.1.1", "192.168.1.1")
+        if cfg == "dhcp" and self.static is not None and self.isconnected():
+            #DHCP starts on a link with a static address: no address until the lease is there
+            stats["dhcp"] += 1
+            self.dhcp_ms = clock.now_ms() + dhcp_ms
+        self.static = None if cfg == "dhcp" else tuple(cfg)
@@ -0,0 +1,112 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# uasyncio of the emulator: CPython asyncio with an event loop on the virtual clock. While all
+# tasks wait the loop advances the clock, so timers, cards and keys keep coming.
+
+import asyncio as _a
+import selectors
+
+import usocket
+from emulator import clock
+from asyncio import Event, Lock, gather, create_task, TimeoutError, CancelledError
+
+
+class ThreadSafeFlag:
+
+    def __init__(self):
+        self._e = _a.Event()
+
+    def set(self):
+        self._e.set()
+
+    async def wait(self):
+        await self._e.wait()
+        self._e.clear()
+
+
+def sleep_ms(ms):
+    return _a.sleep(ms / 1000)
+
+
+sleep = _a.sleep
+
+
+def wait_for_ms(aw, ms):
+    return _a.wait_for(aw, ms / 1000)
+
+
+wait_for = _a.wait_for
+
+
+class _Selector(selectors.DefaultSelector):
+
+    def select(self, timeout=None):
+        if timeout is None or timeout > 0.01:
+            timeout = 0.01
+        clock.advance(max(timeout * 1000, 0.05))
+        return []
+
+
+class _Loop(_a.SelectorEventLoop):
+
+    def __init__(self):
+        super().__init__(_Selector())
+
+    def time(self):
+        return clock.now_us / 1e6
+
+
+class _Stream:
+
+    def __init__(self, s):
+        self.s = s
+
+    async def readline(self):
+        return self.s.readline()
+
+    async def read(self, n=-1):
+        return self.s.read(n)
+
+    async def readexactly(self, n):
+        b = self.s.read(n)
+        if len(b) < n:
+            raise EOFError
+        return b
+
+    def write(self, d):
+        self.s.write(d)
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.s.close()
+
+    async def wait_closed(self):
+        pass
+
+
+async def open_connection(host, port, ssl=False):
+    s = usocket.socket()
+    s.connect((host, port))
+    st = _Stream(s)
+    return st, st
+
+
+def run(coro):
+    loop = _Loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        #the end of the run (clock.Stop) leaves the tasks waiting, like a reset does
+        for t in _a.all_tasks(loop):
+            t._log_destroy_pending = False
+        loop.close()
@@ -0,0 +1,46 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# urequests of the emulator, posts go to the same server stand-in as usocket, one full
+# connection per request like the real urequests.
+
+import ujson
+
+import usocket
+from emulator import clock
+
+
+class Response:
+
+    def __init__(self, content, status_code=200):
+        self.content = content
+        self.status_code = status_code
+
+    @property
+    def text(self):
+        return str(self.content, "utf-8")
+
+    def json(self):
+        return ujson.loads(self.content)
+
+    def close(self):
+        pass
+
+
+def post(url, data=None, json=None, headers=None):
+    if usocket.down:
+        clock.advance(usocket.down_ms)
+        raise OSError(113 if usocket.down_ms == 0 else 110)
+    req = json if json is not None else ujson.loads(data)
+    usocket.stats["connects"] += 1
+    usocket.stats["requests"] += 1
+    clock.advance(usocket.handshake_ms + usocket.latency_ms)
+    usocket.calls.append(req)
+    return Response(usocket.server.handle(req))
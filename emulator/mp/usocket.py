@@ -0,0 +1,150 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# usocket of the emulator. Every connection talks to an in-process HTTP/1.1 front of the
+# auth server stand-in (emulator.authserver): keep-alive with an idle timeout like apache,
+# chunked or content-length bodies, latency, handshake time and outages on the virtual clock.
+
+import json
+
+from emulator import clock, firmware_module
+
+wire = firmware_module("wire")
+
+AF_INET = 2
+SOCK_STREAM = 1
+
+server = None       #emulator.authserver.AuthServer, handle(post dict) -> body
+latency_ms = 0      #per request
+handshake_ms = 0    #per new connection (TCP + TLS)
+keepalive_ms = 5000 #the server closes connections idle for longer
+chunked = True      #Transfer-Encoding: chunked (else Content-Length)
+chunk_size = 0      #0 = the body in two chunks
+down = False        #server unreachable: connect() fails after down_ms (0 = at once, else a timeout)
+down_ms = 0
+cbor = True         #the server reads application/cbor requests (False = an auth.php without cbor.php)
+stats = {"connects": 0, "requests": 0, "bytes": 0, "sent": 0}  #bytes: answer bodies, sent: request bodies
+calls = []          #every post the server got
+
+
+def _reset():
+    global server, latency_ms, handshake_ms, keepalive_ms, chunked, chunk_size, down, down_ms, cbor
+    server = None
+    latency_ms = handshake_ms = chunk_size = down_ms = 0
+    keepalive_ms = 5000
+    chunked = True
+    down = False
+    cbor = True
+    stats.update(connects=0, requests=0, bytes=0, sent=0)
+    del calls[:]
+
+
+def getaddrinfo(host, port, af=0, type=0, proto=0, flags=0):
+    return [(AF_INET, SOCK_STREAM, 0, "", (host, port))]
+
+
+class socket:
+
+    def __init__(self, af=AF_INET, type=SOCK_STREAM, proto=0):
+        self.inbuf = b""
+        self.out = b""
+        self.open = False
+        self.last = 0
+
+    def settimeout(self, t):
+        pass
+
+    def setblocking(self, f):
+        pass
+
+    def connect(self, addr):
+        if down:
+            clock.advance(down_ms)
+            raise OSError(113 if down_ms == 0 else 110)
+        stats["connects"] += 1
+        clock.advance(handshake_ms)
+        self.open = True
+        self.last = clock.now_ms()
+
+    def _alive(self):
+        if self.open and clock.now_ms() - self.last > keepalive_ms:
+            self.open = False
+        return self.open
+
+    def write(self, data):
+        if not self._alive():
+            raise OSError(32)
+        self.inbuf += bytes(data)
+        self._process()
+        return len(data)
+
+    send = write
+
+    def _process(self):
+        head, sep, rest = self.inbuf.partition(b"\r\n\r\n")
+        if not sep:
+            return
+        n = 0
+        ctype = b""
+        for l in head.split(b"\r\n")[1:]:
+            k, _, v = l.partition(b":")
+            if k.strip().lower() == b"content-length":
+                n = int(v)
+            elif k.strip().lower() == b"content-type":
+                ctype = v.strip()
+        if len(rest) < n:
+            return
+        body, self.inbuf = rest[:n], rest[n:]
+        stats["requests"] += 1
+        clock.advance(latency_ms)
+        binary = ctype == wire.CONTENT_TYPE.encode()
+        if binary and not cbor:
+            req = None
+            resp = b"Received content contained invalid JSON!"
+        else:
+            req = wire.loads(body) if binary else json.loads(body)
+            calls.append(req)
+            resp = server.handle(req, binary)
+        stats["sent"] += len(body)
+        stats["bytes"] += len(resp)
+        ctype = b"application/cbor" if binary and cbor else b"application/json"
+        if chunked:
+            cs = chunk_size or max(1, len(resp) // 2)
+            parts = [resp[i:i + cs] for i in range(0, len(resp), cs)]
+            payload = b"".join(b"%x\r\n%s\r\n" % (len(c), c) for c in parts) + b"0\r\n\r\n"
+            hdr = b"HTTP/1.1 200 OK\r\nContent-Type: %s\r\nTransfer-Encoding: chunked\r\n\r\n" % ctype
+        else:
+            payload = resp
+            hdr = b"HTTP/1.1 200 OK\r\nContent-Type: %s\r\nContent-Length: %d\r\n\r\n" % (ctype, len(resp))
+        self.out += hdr + payload
+        self.last = clock.now_ms()
+
+    def readline(self):
+        i = self.out.find(b"\n") + 1 or len(self.out)
+        l, self.out = self.out[:i], self.out[i:]
+        return l
+
+    def read(self, n=-1):
+        if n < 0:
+            n = len(self.out)
+        d, self.out = self.out[:n], self.out[n:]
+        return d
+
+    recv = read
+
+    def readinto(self, buf, n=-1):
+        if n < 0:
+            n = len(buf)
+        d = self.read(n)
+        buf[:len(d)] = d
+        return len(d)
+
+    def close(self):
+        self.open = False
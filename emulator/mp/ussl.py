@@ -0,0 +1,15 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# ussl of the emulator: the connection to the auth server stand-in is not encrypted.
+
+
+def wrap_socket(sock, server_hostname=None, **kw):
+    return sock
@@ -0,0 +1,246 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# Register level MFRC522 behind the fake SPI bus. It decodes the address bytes of every CS
+# framed transfer and implements what mfrc522.py uses: the FIFO, CommandReg (Idle, CalcCRC,
+# Transceive, MFAuthent, SoftReset, soft power-down), the ComIrq/DivIrq flags with their IRQ
+# output, BitFramingReg/ControlReg bit counts, Status2Reg Crypto1on and the antenna driver.
+# Tags in the field (emulator.mifare) get the frames the firmware sends.
+# Bus and air time are charged to the virtual clock, so a tap takes about as long as on the door.
+
+import machine
+from emulator import clock
+from emulator.mifare import crc_a
+
+#commands of CommandReg
+IDLE = 0x00
+CALCCRC = 0x03
+TRANSCEIVE = 0x0C
+MFAUTHENT = 0x0E
+SOFTRESET = 0x0F
+
+ETU_US = 9.44   #one bit at 106 kbit/s
+
+
+class RC522:
+
+    def __init__(self, cs, irq=None, xfer_us=20, byte_us=1):
+        self.cs = cs
+        self.irq_pin = irq
+        self.xfer_us = xfer_us  #per CS framed transfer (driver call overhead + CS)
+        self.byte_us = byte_us  #per byte at 10 MHz SPI, rounded up
+        self.regs = bytearray(64)
+        self.fifo = bytearray()
+        self.field = []         #tags on the reader
+        self.frame = None       #bytes of the transfer in progress
+        self.xfers = 0          #CS framed transfers
+        self.crc_calcs = 0      #CalcCRC commands
+        self.transceives = 0    #frames sent over the air
+        self._soft_reset()
+        machine._spi_devices.append(self)
+        machine.Pin(cs)._st.watchers.append(self._cs)
+
+    def _soft_reset(self):
+        self.regs[:] = bytes(64)
+        self.regs[0x01] = 0x20  #CommandReg: RcvOff, Idle
+        self.regs[0x02] = 0x80  #ComIEnReg
+        self.regs[0x0E] = 0x80  #CollReg: ValuesAfterColl
+        self.regs[0x14] = 0x80  #TxControlReg: antenna off
+        self.regs[0x37] = 0x92  #VersionReg: MFRC522 v2.0
+        self.fifo = bytearray()
+        self._power_field()
+
+    def place(self, card):
+        """Hold a tag (emulator.mifare.Classic1K) to the reader."""
+        if card not in self.field:
+            self.field.append(card)
+
+    def remove(self, card=None):
+        """Take a tag (default: all) away."""
+        for c in list(self.field):
+            if card is None or c is card:
+                c.power_off()
+                self.field.remove(c)
+
+    def antenna(self):
+        """True while the RF field is on: both TX drivers enabled and not powered down."""
+        return (self.regs[0x14] & 0x03) == 0x03 and not (self.regs[0x01] & 0x10)
+
+    def _power_field(self):
+        if not self.antenna():
+            for c in self.field:
+                c.power_off()
+
+    def _cs(self, v):
+        if v == 0:
+            self.frame = []
+            self.xfers += 1
+        else:
+            if self.frame:
+                clock.advance((self.xfer_us + self.byte_us * len(self.frame)) / 1000)
+            self.frame = None
+            self._update_irq()
+
+    def spi_byte(self, b):
+        """One byte over MOSI, returns the MISO byte. The first byte of a transfer is the address."""
+        f = self.frame
+        if len(f) == 0 or f[0] & 0x80:
+            #read: every byte sent is the address of the next register to read
+            out = self._read((f[-1] >> 1) & 0x3F) if len(f) and f[-1] & 0x80 else 0
+            f.append(b)
+            return out
+        f.append(b)
+        self._write((f[0] >> 1) & 0x3F, b)
+        return 0
+
+    def _read(self, reg):
+        if reg == 0x09:
+            if self.fifo:
+                v = self.fifo[0]
+                del self.fifo[0]
+                return v
+            return 0
+        if reg == 0x0A:
+            return len(self.fifo)
+        return self.regs[reg]
+
+    def _write(self, reg, val):
+        if reg == 0x09:
+            if len(self.fifo) < 64:
+                self.fifo.append(val)
+            return
+        if reg == 0x0A:
+            if val & 0x80:
+                self.fifo = bytearray()
+            return
+        if reg == 0x04 or reg == 0x05:
+            #ComIrqReg/DivIrqReg: bit 7 says whether the marked bits are set or cleared
+            mask = val & 0x7F
+            if val & 0x80:
+                self.regs[reg] |= mask
+            else:
+                self.regs[reg] &= ~mask & 0xFF
+            self._update_irq()
+            return
+        if reg == 0x01:
+            self._command(val)
+            return
+        if reg == 0x0D:
+            self.regs[0x0D] = val
+            if (val & 0x80) and (self.regs[0x01] & 0x0F) == TRANSCEIVE:
+                self._transceive()
+            return
+        if reg == 0x14:
+            self.regs[0x14] = val
+            self._power_field()
+            return
+        self.regs[reg] = val
+
+    def _command(self, val):
+        cmd = val & 0x0F
+        if cmd == SOFTRESET:
+            self._soft_reset()
+            return
+        self.regs[0x01] = val & 0x3F
+        self._power_field()
+        if cmd == CALCCRC:
+            self.crc_calcs += 1
+            r = crc_a(self.fifo)
+            self.regs[0x22] = r[0]
+            self.regs[0x21] = r[1]
+            self.regs[0x05] |= 0x04
+            self.regs[0x01] &= 0xF0
+            self._update_irq()
+        elif cmd == MFAUTHENT:
+            data = bytes(self.fifo)
+            self.fifo = bytearray()
+            ok = False
+            if self.antenna() and len(data) >= 12:
+                clock.advance(ETU_US * 9 * 16 / 1000)
+                for c in self.field:
+                    if c.authenticate(data[0], data[1], data[2:8], data[8:12]):
+                        ok = True
+            if ok:
+                self.regs[0x08] |= 0x08     #Status2Reg: MFCrypto1On
+                self.regs[0x04] |= 0x10     #IdleIRq
+                self.regs[0x01] &= 0xF0
+            else:
+                self.regs[0x04] |= 0x01     #TimerIRq: no answer
+            self._update_irq()
+        elif cmd == TRANSCEIVE and (self.regs[0x0D] & 0x80):
+            self._transceive()
+
+    def _transceive(self):
+        self.transceives += 1
+        data = bytes(self.fifo)
+        self.fifo = bytearray()
+        txbits = self.regs[0x0D] & 0x07 or 8
+        self.regs[0x06] = 0
+        answers = []
+        if self.antenna():
+            for c in self.field:
+                r = c.frame(data, txbits if len(data) == 1 else 8)
+                if r is not None:
+                    answers.append(r)
+        self.regs[0x04] |= 0x40     #TxIRq
+        if answers:
+            resp, bits = answers[0]
+            self.regs[0x0E] = (self.regs[0x0E] & 0x80) | 0x20   #CollReg: CollPosNotValid
+            if len(answers) > 1 and any(a != answers[0] for a in answers):
+                resp = self._collide([a[0] for a in answers])
+                self.regs[0x06] |= 0x08     #ErrorReg: CollErr
+            clock.advance(ETU_US * 9 * (len(data) + len(resp) + 2) / 1000)
+            self.fifo = bytearray(resp)
+            self.regs[0x0C] = (self.regs[0x0C] & 0xF8) | (bits % 8)
+            self.regs[0x04] |= 0x20     #RxIRq
+        else:
+            #nobody answered: the timer set up by init() runs out (TReload 30 at ~40 us)
+            clock.advance(1.2)
+            self.regs[0x04] |= 0x01     #TimerIRq
+        self._update_irq()
+
+    def _collide(self, answers):
+        #several tags answered different bits at once. The first bit where they differ is a
+        #collision, CollReg gets its position counted from the first FIFO bit including the
+        #RxAlign ones (1..32, 32 reads as 0). The bits before it are what all tags sent, the bits
+        #from it on are 0, or what the tags sent ORed together if ValuesAfterColl is set
+        n = max(len(a) for a in answers)
+        answers = [a + bytes(n - len(a)) for a in answers]
+        first = bytearray(answers[0])
+        ored = bytearray(n)
+        for a in answers:
+            for i in range(n):
+                ored[i] |= a[i]
+        for p in range((self.regs[0x0D] >> 4) & 0x07, n * 8):
+            if any((a[p >> 3] ^ first[p >> 3]) >> (p & 7) & 1 for a in answers):
+                break
+        else:
+            return bytes(first)
+        self.regs[0x0E] = (self.regs[0x0E] & 0x80) | ((p + 1) & 0x1F)
+        after = ored if self.regs[0x0E] & 0x80 else bytes(n)
+        keep = (1 << (p & 7)) - 1
+        out = first[:p >> 3] + bytes([(first[p >> 3] & keep) | (after[p >> 3] & ~keep & 0xFF)]) + after[(p >> 3) + 1:]
+        return bytes(out)
+
+    def _update_irq(self):
+        if self.irq_pin is None:
+            return
+        if not self.regs[0x03] & 0x80:
+            #open drain (DivIEnReg IRQPushPull = 0): readers sharing the line pull it low, the pull-up makes it high
+            shared = [d for d in machine._spi_devices if isinstance(d, RC522) and d.irq_pin == self.irq_pin]
+            level = 0 if any(d._irq_level() == 0 for d in shared) else 1
+        else:
+            level = self._irq_level()
+        machine.Pin(self.irq_pin)._set(level)
+
+    def _irq_level(self):
+        act = (self.regs[0x02] & self.regs[0x04] & 0x7F) or (self.regs[0x03] & self.regs[0x05] & 0x14)
+        inv = self.regs[0x02] & 0x80
+        return (0 if act else 1) if inv else (1 if act else 0)
@@ -0,0 +1,220 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# python -m emulator.standin [options]: auth.php as a real HTTP server, for readers on the
+# network (point auth_url in main.py at it) or for emulator.loadgen.
+#
+# Every request runs like a PHP request: rfid.txt is read, the request is handled by
+# emulator.authserver and rfid.txt is written back whole if it changed. Like auth.php there is
+# no lock between concurrent requests, so a request that overwrites what another one wrote in
+# the meantime loses that update (counted as "lost updates"); --lock serializes the requests.
+# With --dir the files are the ones of auth.php (rfid.txt, googleauth.txt, unknown_uids.txt,
+# antitamper_temp_race_condition.txt, offline_uses.txt, tap_traces.txt, reader_logs.txt), else all in memory.
+#
+#   > python -m emulator.standin --dir PHP/rfid-auth --port 8080 --latency 30 --fail 0.01
+
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from emulator.authserver import AuthServer, wire
+
+
+class StandIn:
+    """auth.php with its files, latency and failures. handle() is safe to call from many threads."""
+
+    def __init__(self, dir=None, keys=None, gauth=None, latency_ms=0, jitter_ms=0, fail=0.0, lock=False,
+                 hmac_key="YourSecretKeyForTagKeyGeneration", grant_key="", grant_ttl=86400, log_devices=(), verbose=False):
+        self.dir = dir
+        self.db = json.dumps(keys if keys is not None else {})  #rfid.txt without dir
+        if gauth is None and dir is not None and os.path.exists(self._path("googleauth.txt")):
+            with open(self._path("googleauth.txt")) as f:
+                gauth = json.load(f)
+        self.gauth = gauth if gauth is not None else {}
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms  #up to this much more per request, evenly distributed
+        self.fail = fail            #share of requests that are dropped without an answer
+        self.lock = threading.Lock() if lock else None
+        self.hmac_key = hmac_key
+        self.grant_key = grant_key
+        self.grant_ttl = grant_ttl
+        self.log_devices = list(log_devices)    #$reader_log_devices
+        self.verbose = verbose
+        self.rand = random.Random()
+        self._mutex = threading.Lock()  #the database text, the stats and the logs, never held while a request runs
+        self.stats = {"requests": 0, "dropped": 0, "writes": 0, "lost_updates": 0}
+        #what the hooks of configuration.php and the log files of auth.php would get
+        self.doors = []
+        self.unknown = []
+        self.races = []
+        self.china = []
+        self.offline = []
+        self.traces = []
+        self.reader_logs = []
+
+    def _path(self, name):
+        return os.path.join(self.dir, name)
+
+    def load(self):
+        """The text of rfid.txt."""
+        with self._mutex:
+            if self.dir is None:
+                return self.db
+        with open(self._path("rfid.txt")) as f:
+            return f.read()
+
+    def _save(self, loaded, text):
+        with self._mutex:
+            self.stats["writes"] += 1
+            if self.dir is None:
+                if self.db != loaded:
+                    self.stats["lost_updates"] += 1
+                self.db = text
+                return
+            with open(self._path("rfid.txt")) as f:
+                if f.read() != loaded:
+                    self.stats["lost_updates"] += 1
+            with open(self._path("rfid.txt"), "w") as f:
+                f.write(text)
+
+    def _append(self, name, lines):
+        if self.dir is not None and lines:
+            with open(self._path(name), "a") as f:
+                f.write("".join(" ".join(str(x) for x in l) + "\n" for l in lines))
+
+    def handle(self, post, cbor=False):
+        """Answer body to the decoded JSON (CBOR) post, None if the request is dropped (--fail)."""
+        with self._mutex:
+            self.stats["requests"] += 1
+            if self.rand.random() < self.fail:
+                self.stats["dropped"] += 1
+                return None
+            delay = (self.latency_ms + self.rand.uniform(0, self.jitter_ms)) / 1000
+        if self.lock is None:
+            return self._handle(post, cbor, delay)
+        with self.lock:
+            return self._handle(post, cbor, delay)
+
+    def _handle(self, post, cbor, delay):
+        loaded = self.load()
+        srv = AuthServer(json.loads(loaded), self.gauth, self.hmac_key, self.grant_key, self.grant_ttl)
+        srv.log_devices = self.log_devices
+        body = srv.handle(post, cbor)
+        #the time PHP takes, between reading rfid.txt and writing it back
+        time.sleep(delay)
+        if self.dir is None:
+            text = json.dumps(srv.keys)
+            if text != loaded:
+                self._save(loaded, text)
+        elif srv.keys != json.loads(loaded):
+            #JSON_PRETTY_PRINT
+            self._save(loaded, json.dumps(srv.keys, indent=4))
+        now = time.strftime("%Y-%m-%d %H:%M:%S")
+        with self._mutex:
+            self.doors.extend(srv.doors)
+            self.unknown.extend(srv.unknown)
+            self.races.extend(srv.races)
+            self.china.extend(srv.china)
+            self.offline.extend(srv.offline)
+            self.traces.extend(srv.traces)
+            self.reader_logs.extend(srv.reader_logs)
+            self._append("unknown_uids.txt", srv.unknown)
+            self._append("antitamper_temp_race_condition.txt", srv.races)
+            self._append("offline_uses.txt", srv.offline)
+            self._append("tap_traces.txt", [(now,) + t for t in srv.traces])
+            self._append("reader_logs.txt", [(now,) + l for l in srv.reader_logs])
+        if self.verbose:
+            for d in srv.doors:
+                print("door %s: %s %s" % (d[0], d[2], d[1]))
+            for c in srv.china:
+                print("china uid at %s: %s (%s)" % c)
+        return body
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    timeout = 5     #KeepAliveTimeout of apache
+
+    def do_POST(self):
+        data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        cbor = self.headers.get("Content-Type") == wire.CONTENT_TYPE
+        try:
+            post = wire.loads(data) if cbor else json.loads(data)
+        except (ValueError, EOFError):
+            post = None
+        if isinstance(post, dict):
+            body = self.server.standin.handle(post, cbor)
+        else:
+            cbor = False
+            body = b"Received content contained invalid JSON!"
+        if body is None:
+            #dropped: the connection closes without an answer, the reader sees an OSError
+            self.close_connection = True
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", wire.CONTENT_TYPE if cbor else "text/html; charset=UTF-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        if self.server.standin.verbose:
+            BaseHTTPRequestHandler.log_message(self, fmt, *args)
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256    #hundreds of readers connect at once
+
+
+def serve(standin, host="127.0.0.1", port=0):
+    """Start the HTTP server in a thread, returns it (server_address has the port)."""
+    httpd = Server((host, port), Handler)
+    httpd.standin = standin
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+
+def main():
+    p = argparse.ArgumentParser(prog="python -m emulator.standin", description="auth.php stand-in HTTP server.")
+    p.add_argument("--dir", help="folder with rfid.txt and googleauth.txt, the log files go there too (default: in memory)")
+    p.add_argument("--bind", default="0.0.0.0")
+    p.add_argument("--port", type=int, default=8080)
+    p.add_argument("--latency", type=int, default=0, metavar="MS", help="time per request")
+    p.add_argument("--jitter", type=int, default=0, metavar="MS", help="up to this much more per request")
+    p.add_argument("--fail", type=float, default=0.0, metavar="RATE", help="share of requests dropped without an answer")
+    p.add_argument("--lock", action="store_true", help="one request at a time (auth.php has no lock)")
+    p.add_argument("--hmac-key", default="YourSecretKeyForTagKeyGeneration", help="$hmac_hash_key")
+    p.add_argument("--grant-key", default="", help="$offline_grant_key")
+    p.add_argument("--log-device", action="append", default=[], metavar="DEVICE_ID",
+                   help="$reader_log_devices, the reader sends its log lines after every tap")
+    p.add_argument("-v", "--verbose", action="store_true", help="log requests and door commands")
+    a = p.parse_args()
+
+    standin = StandIn(a.dir, latency_ms=a.latency, jitter_ms=a.jitter, fail=a.fail, lock=a.lock,
+                      hmac_key=a.hmac_key, grant_key=a.grant_key, log_devices=a.log_device, verbose=a.verbose)
+    httpd = serve(standin, a.bind, a.port)
+    print("auth.php stand-in on http://%s:%d/auth.php" % httpd.server_address)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    print("requests: %(requests)d, dropped: %(dropped)d, rfid.txt writes: %(writes)d, lost updates: %(lost_updates)d"
+          % standin.stats)
+    print("door commands: %d, race conditions: %d" % (len(standin.doors), len(standin.races)))
+
+
+if __name__ == "__main__":
+    main()
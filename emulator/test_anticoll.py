@@ -0,0 +1,68 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# ISO 14443-3 anticollision of the MFRC522 driver against the emulated reader and tags (cascade levels,
+# several tags in the field), and the wallet scenario of python -m emulator.
+
+import unittest
+
+from emulator import World, mifare
+from emulator.__main__ import UID, UID7, play
+
+
+class Anticollision(unittest.TestCase):
+
+    def field(self, *uids):
+        w = World()
+        rdr = w.driver()
+        for u in uids:
+            w.reader.place(mifare.Classic1K(u))
+        self.assertEqual(rdr.detect(rdr.REQIDL), rdr.OK)
+        return rdr
+
+    def test_cascade_levels(self):
+        #4, 7 and 10 byte UIDs need 1, 2 and 3 cascade levels
+        for uid in (UID, UID7, bytes(range(1, 11))):
+            rdr = self.field(uid)
+            self.assertEqual(rdr.select_any(), (rdr.OK, uid))
+
+    def test_wallet(self):
+        #tags that collide in the first bit, in the last bit of the last cascade level and on different levels
+        uids = [UID, b"\x0b\xcd\x3f\x15", UID7, UID7[:6] + b"\xf7", bytes(range(1, 11))]
+        rdr = self.field(*uids)
+        found = rdr.tags(limit=len(uids))
+        self.assertEqual(sorted(found), sorted(uids))
+
+    def test_limit(self):
+        rdr = self.field(UID, UID7, b"\xde\xad\xbe\xef")
+        self.assertEqual(len(rdr.tags(limit=2)), 2)
+
+    def test_select_halted(self):
+        #after tags() every tag is halted, a WUPA and select_tag() reach the one with this uid only
+        rdr = self.field(UID, UID7[:6] + b"\xf7", UID7)
+        rdr.tags()
+        self.assertEqual(rdr.detect(rdr.REQALL), rdr.OK)
+        self.assertEqual(rdr.select_tag(UID7), rdr.OK)
+
+
+class Scenarios(unittest.TestCase):
+
+    def test_wallet(self):
+        play("wallet")
+
+    def test_wallet_async(self):
+        play("wallet", useAsyncio=True)
+
+    def test_wallet_stages(self):
+        play("wallet", useSessionProtocol=False)
+
+
+if __name__ == "__main__":
+    unittest.main()
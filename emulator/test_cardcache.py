@@ -0,0 +1,122 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# CardCache of ESP32/cardcache.py on its own, and taps of tags the reader remembers: they skip stage1
+# in the session protocol and in stage1-4, ask stage1 again when what they remember does not hold
+# anymore and are forgotten when the server revokes them.
+
+import os
+import tempfile
+import unittest
+
+from emulator import firmware_module, install
+from emulator.__main__ import play
+
+KEY = "7846ef811678"
+
+
+class CardCache(unittest.TestCase):
+
+    def setUp(self):
+        install()
+        from emulator import clock
+        self.clock = clock
+        clock.reset()
+        self.CardCache = firmware_module("cardcache").CardCache
+        self.path = os.path.join(tempfile.mkdtemp(prefix="nfc-flash-"), "cards.json")
+
+    def test_put_get(self):
+        c = self.CardCache()
+        c.put("0acd3f15", 13, KEY, 16)
+        c.put("01020304", 14, bytes.fromhex(KEY), 16)
+        self.assertEqual(c.get("0acd3f15"), (13, KEY, 16))
+        self.assertEqual(c.get("01020304"), (14, KEY, 16))
+        self.assertIsNone(c.get("05060708"))
+        c.forget("0acd3f15")
+        self.assertNotIn("0acd3f15", c)
+
+    def test_least_recently_used_dropped(self):
+        c = self.CardCache(size=2)
+        c.put("01", 13, KEY, 16)
+        c.put("02", 13, KEY, 16)
+        c.get("01")
+        c.put("03", 13, KEY, 16)
+        self.assertEqual(c.order, ["01", "03"])
+
+    def test_ttl(self):
+        c = self.CardCache(ttl_s=60)
+        c.put("01", 13, KEY, 16)
+        self.clock.advance(59000)
+        self.assertIsNotNone(c.get("01"))
+        self.clock.advance(1000)
+        self.assertIsNone(c.get("01"))
+        self.assertNotIn("01", c)
+
+    def test_clock_went_back(self):
+        c = self.CardCache()
+        c.put("01", 13, KEY, 16)
+        self.clock.rtc_s -= 10
+        self.assertIsNone(c.get("01"))
+
+    def test_file(self):
+        c = self.CardCache(path=self.path)
+        c.put("01", 13, KEY, 16)
+        c.put("02", 14, KEY, 16)
+        c.get("01")
+        after = self.CardCache(path=self.path)
+        self.assertEqual(after.get("02"), (14, KEY, 16))
+        after.forget("02")
+        self.assertEqual(list(self.CardCache(path=self.path).cards), ["01"])
+
+    def test_file_written_on_change_only(self):
+        c = self.CardCache(path=self.path)
+        c.put("01", 13, KEY, 16)
+        os.remove(self.path)
+        c.put("01", 13, KEY, 16)
+        c.get("01")
+        self.assertFalse(os.path.exists(self.path))
+        c.put("01", 13, KEY, 4)
+        self.assertEqual(self.CardCache(path=self.path).get("01"), (13, KEY, 4))
+
+    def test_bad_file(self):
+        with open(self.path, "w") as f:
+            f.write('{"cards": {"01": [13')
+        self.assertEqual(self.CardCache(path=self.path).cards, {})
+
+
+class Scenarios(unittest.TestCase):
+
+    def test_tap_no_card_cache(self):
+        play("tap", card_cache_size=0)
+
+    def test_revoke(self):
+        play("revoke")
+
+    def test_revoke_async(self):
+        play("revoke", useAsyncio=True)
+
+    def test_revoke_stages(self):
+        play("revoke", useSessionProtocol=False)
+
+    def test_stale(self):
+        play("stale")
+
+    def test_stale_async(self):
+        play("stale", useAsyncio=True)
+
+    def test_stale_stages(self):
+        play("stale", useSessionProtocol=False)
+
+    def test_stale_async_stages(self):
+        play("stale", useAsyncio=True, useSessionProtocol=False)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# The table driven software CRC_A of ESP32/crc_a.py against known frames and the emulated MFRC522,
+# and taps with it and with the CalcCRC coprocessor (useSoftCRC).
+
+import random
+import unittest
+
+from emulator import World, firmware_module, mifare
+from emulator.__main__ import play
+
+
+class CrcA(unittest.TestCase):
+
+    def setUp(self):
+        self.crc = firmware_module("crc_a").crc_a
+
+    def test_known_frames(self):
+        #ISO/IEC 14443-3 annex B and the frames every tap sends, CRC_A goes on the air low byte first
+        for frame, crc in ((b"\x00\x00", b"\xa0\x1e"), (b"\x12\x34", b"\x26\xcf"), (b"\x50\x00", b"\x57\xcd"),
+                           (b"\x30\x04", b"\x26\xee"), (b"\x93\x70\x0a\xcd\x3f\x15\xed", None)):
+            c = self.crc(frame)
+            self.assertEqual(bytes((c & 0xFF, c >> 8)), crc or mifare.crc_a(frame))
+
+    def test_same_as_reader(self):
+        #the table driven CRC against the bitwise one of the emulated MFRC522
+        rand = random.Random(14)
+        for n in range(0, 40):
+            data = bytes(rand.randrange(256) for _ in range(n))
+            c = self.crc(data)
+            self.assertEqual(bytes((c & 0xFF, c >> 8)), mifare.crc_a(data))
+
+    def test_slice(self):
+        data = b"\xff\x30\x04\xff"
+        self.assertEqual(self.crc(data, 1, 3), self.crc(b"\x30\x04"))
+
+    def test_driver_check(self):
+        #verify_crc() compares the software CRC with the CalcCRC coprocessor at boot
+        self.assertTrue(World().driver().verify_crc())
+
+
+
+    def test_taps(self):
+        #the coprocessor is only asked at boot (verify_crc), with useSoftCRC=False for every frame
+        soft = play("tap").reader.crc_calcs
+        chip = play("tap", useSoftCRC=False).reader.crc_calcs
+        self.assertGreater(chip, soft)
+
+    def test_taps_async(self):
+        play("tap", useAsyncio=True, useSoftCRC=False)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# Several MFRC522 readers on one ESP32 (nfc_readers): the doors scenario, a second reader inside the
+# door with its own device_id.
+
+import unittest
+
+from emulator.__main__ import play
+
+
+class Scenarios(unittest.TestCase):
+
+    def test_doors(self):
+        play("doors")
+
+    def test_doors_async(self):
+        play("doors", useAsyncio=True)
+
+    def test_doors_stages(self):
+        play("doors", useSessionProtocol=False)
+
+    def test_doors_irq(self):
+        #the IRQ outputs of both readers on one pin
+        play("doors", pin_nfc_irq=25)
+
+    def test_doors_irq_async(self):
+        play("doors", pin_nfc_irq=25, useAsyncio=True)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# The scenarios of python -m emulator with their checks, in the blocking loop, with uasyncio and with
+# stage1-4. The other test_*.py files test one part of the firmware each. From the repository root:
+#
+#   > python -m unittest discover -s emulator -t .
+#   > python -m pytest emulator
+
+import unittest
+
+from emulator.__main__ import play
+
+
+class Scenarios(unittest.TestCase):
+    """The scenarios of python -m emulator in the blocking loop, with uasyncio and with stage1-4."""
+
+    def test_tap(self):
+        play("tap")
+
+    def test_tap_async(self):
+        play("tap", useAsyncio=True)
+
+    def test_tap_stages(self):
+        play("tap", useSessionProtocol=False)
+
+    def test_pin(self):
+        play("pin")
+
+    def test_pin_async(self):
+        play("pin", useAsyncio=True)
+
+    def test_pin_stages(self):
+        play("pin", useSessionProtocol=False)
+
+    def test_reset(self):
+        play("reset")
+
+    def test_reset_async(self):
+        play("reset", useAsyncio=True)
+
+    def test_reset_stages(self):
+        play("reset", useSessionProtocol=False)
+
+    def test_china(self):
+        play("china")
+
+    def test_china_async(self):
+        play("china", useAsyncio=True)
+
+    def test_china_stages(self):
+        play("china", useSessionProtocol=False)
+
+    def test_bench(self):
+        play("bench")
+
+    def test_bench_async(self):
+        play("bench", useAsyncio=True)
+
+    def test_bench_stages(self):
+        play("bench", useSessionProtocol=False)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,156 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# EventQueue of ESP32/eventqueue.py on its own, the "events" command of the auth server stand-in and
+# the outage and lateclose scenarios of python -m emulator.
+
+import os
+import tempfile
+import unittest
+
+from emulator import firmware_module, install
+from emulator.__main__ import play
+
+
+class EventQueue(unittest.TestCase):
+
+    def setUp(self):
+        install()
+        from emulator import clock
+        self.clock = clock
+        clock.reset()
+        self.EventQueue = firmware_module("eventqueue").EventQueue
+        self.path = os.path.join(tempfile.mkdtemp(prefix="nfc-flash-"), "events.txt")
+
+    def test_put_batch_sent(self):
+        q = self.EventQueue(4)
+        for i in range(3):
+            q.put({"ev": "seen", "uid": "%02x" % i})
+        self.assertEqual([e["uid"] for e in q.batch(2)], ["00", "01"])
+        q.sent(2)
+        self.assertEqual([e["uid"] for e in q.batch(8)], ["02"])
+        self.assertTrue(all(e["b"] == q.boot and e["t"] == self.clock.wall() for e in q.batch(8)))
+
+    def test_full_drops_oldest(self):
+        q = self.EventQueue(2)
+        for i in range(5):
+            q.put({"ev": "seen", "uid": "%02x" % i})
+        self.assertEqual([e["uid"] for e in q.batch(8)], ["03", "04"])
+        self.assertEqual(q.dropped, 3)
+
+    def test_backoff(self):
+        q = self.EventQueue(4, retry_ms=1000, max_retry_ms=3000)
+        q.put({"ev": "seen", "uid": "01"})
+        self.assertTrue(q.due())
+        for pause in (1000, 2000, 3000, 3000):
+            q.failed()
+            self.assertEqual(q.wait_ms(), pause)
+            self.assertFalse(q.due())
+            self.clock.advance(pause)
+            self.assertTrue(q.due())
+        q.sent(1)
+        self.assertFalse(q.due())
+        self.assertEqual(q.pause, 1000)
+
+    def test_file(self):
+        #what was not sent goes out after the reset, with the start it happened in
+        q = self.EventQueue(4, self.path)
+        for i in range(3):
+            q.put({"ev": "seen", "uid": "%02x" % i})
+        q.sent(1)
+        q.put({"ev": "close", "uid": "03", "key": "485af3cdd3b16ea1"})
+        after = self.EventQueue(4, self.path)
+        self.assertEqual(after.batch(8), q.batch(8))
+        self.assertNotEqual(after.boot, q.boot)
+        self.assertTrue(all(e["b"] == q.boot for e in after.batch(8)))
+        after.sent(3)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(self.EventQueue(4, self.path).count, 0)
+
+    def test_file_rewritten(self):
+        #sent events are only dropped from the file once it holds twice the queue
+        q = self.EventQueue(2, self.path)
+        for i in range(9):
+            q.put({"ev": "seen", "uid": "%02x" % i})
+        with open(self.path) as f:
+            self.assertLessEqual(len(f.readlines()), 4)
+        self.assertEqual([e["uid"] for e in self.EventQueue(2, self.path).batch(8)], ["07", "08"])
+
+    def test_cut_line(self):
+        #the power went while a line was written
+        with open(self.path, "w") as f:
+            f.write('{"ev": "seen", "uid": "01", "t": 1, "b": 7}\n{"ev": "se')
+        q = self.EventQueue(4, self.path)
+        self.assertEqual([e["uid"] for e in q.batch(8)], ["01"])
+
+
+class Events(unittest.TestCase):
+    """The "events" command of auth.php (emulator.authserver)."""
+
+    def setUp(self):
+        from emulator.authserver import AuthServer
+        self.server = AuthServer({"0acd3f15": {"key_name": "alice", "anti_tamper_block": 13, "anti_tamper_num": 1,
+                                               "anti_tamper_num_temp": 2}}, late_close_s=60)
+        self.txt = self.server.antitamper_txt("alice", 2)
+
+    def close(self, t, now, b=5, boot=5):
+        e = {"ev": "close", "uid": "0acd3f15", "key": self.txt, "t": t}
+        post = {"cmd": "events", "device_id": "frontdoor", "now": now, "events": [e]}
+        if b is not None:
+            e["b"] = b
+        if boot is not None:
+            post["boot"] = boot
+        self.assertEqual(self.server.answer(post), {"status": "ok"})
+        self.assertEqual(self.server.keys["0acd3f15"]["anti_tamper_num"], 2, "new text not taken")
+        return [d[2] for d in self.server.doors]
+
+    def test_in_time(self):
+        self.assertEqual(self.close(1000, 1030), ["close"])
+
+    def test_late(self):
+        self.assertEqual(self.close(1000, 1061), [])
+
+    def test_earlier_start(self):
+        #"t" is from the clock of another start: no age, no close, also when it looks recent
+        self.assertEqual(self.close(1000, 1030, b=4), [])
+        self.server.keys["0acd3f15"]["anti_tamper_num_temp"] = 2
+        self.assertEqual(self.close(1000, 1030, b=None), [])
+
+    def test_ahead_of_now(self):
+        #the clock started over (power cycle) and the file still holds the old time
+        self.assertEqual(self.close(900000, 30), [])
+
+    def test_reader_without_boot(self):
+        self.assertEqual(self.close(1000, 1030, b=None, boot=None), ["close"])
+
+
+class Scenarios(unittest.TestCase):
+
+    def test_outage(self):
+        play("outage")
+
+    def test_outage_async(self):
+        play("outage", useAsyncio=True)
+
+    def test_outage_stages(self):
+        play("outage", useSessionProtocol=False)
+
+    def test_lateclose(self):
+        play("lateclose")
+
+    def test_lateclose_async(self):
+        play("lateclose", useAsyncio=True)
+
+    def test_lateclose_stages(self):
+        play("lateclose", useSessionProtocol=False)
+
+
+if __name__ == "__main__":
+    unittest.main()
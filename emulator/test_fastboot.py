@@ -0,0 +1,67 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# Fast start of ESP32/fastboot.py: taps after a cold start, a power cycle and a watchdog reset, with
+# the AP and the lease cached or not.
+
+import unittest
+
+from emulator.__main__ import check, setup
+
+
+class FastBoot(unittest.TestCase):
+
+    def tap(self, start=None, **config):
+        w, card, until = setup("tap", dict({"debugmode": False}, **config))
+        if start is not None:
+            start(w)
+        w.run(until)
+        check("tap", w, card)
+        return w
+
+    def test_cold_start(self):
+        w = self.tap()
+        self.assertEqual(w.g["fastboot"].how, "scan")
+        self.assertEqual(w.wifi.stats, {"scans": 1, "dhcp": 1})
+
+    def test_tap_warm_start(self):
+        w = self.tap(lambda w: w.warm_start())
+        self.assertEqual(w.g["fastboot"].how, "lease")
+        self.assertEqual(w.wifi.stats, {"scans": 0, "dhcp": 0})
+
+    def test_power_cycle(self):
+        #the AP is still in NVS, the lease in RTC memory is gone
+        def start(w):
+            import machine
+            w.warm_start()
+            machine.cause[0] = machine.PWRON_RESET
+        w = self.tap(start)
+        self.assertEqual(w.g["fastboot"].how, "ap")
+        self.assertEqual(w.wifi.stats, {"scans": 0, "dhcp": 1})
+
+    def test_ap_replaced(self):
+        #the cached AP is gone, another one serves the network: scan and DHCP, the new AP is cached
+        def start(w):
+            w.warm_start()
+            w.wifi.ap_bssid = b"\x3c\x84\x6a\x10\x20\x31"
+        w = self.tap(start)
+        self.assertEqual(w.g["fastboot"].how, "scan")
+        self.assertEqual(w.wifi.stats, {"scans": 1, "dhcp": 1})
+        self.assertEqual(w.g["fastboot"].cached_ap(), (w.wifi.ap_bssid, w.wifi.ap_channel))
+
+    def test_warm_start_renews_old_lease(self):
+        #a reused lease goes back to DHCP once half of lease_s (3600 in boot.py) is over
+        for runtime in ({}, {"useAsyncio": True}, {"useSessionProtocol": False}):
+            w = self.tap(lambda w: w.warm_start(lease_age_s=3000), **runtime)
+            self.assertEqual(w.wifi.stats["dhcp"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
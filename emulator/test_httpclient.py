@@ -0,0 +1,176 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# HTTPClient and AsyncHTTPClient of ESP32/httpclient.py on scripted connections: a request on a
+# kept connection is sent again only when the server cannot have processed it.
+
+import time
+import unittest
+
+from emulator import firmware_module, install
+
+ANSWER = b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n{}'
+
+
+class Connection:
+    """A socket (and uasyncio stream) that plays one of the ways a request can go."""
+
+    def __init__(self, fail=None, answer=ANSWER):
+        self.fail = fail        #None, "send", "closed" (no answer at all), "reset" or "timeout" while waiting
+        self.out = answer
+        self.requests = 0
+
+    def write(self, data):
+        if self.fail == "send":
+            raise OSError(104)
+        if data.startswith(b"POST"):
+            self.requests += 1
+        return len(data)
+
+    def readline(self):
+        if self.fail == "closed":
+            return b""
+        if self.fail == "reset":
+            raise OSError(104)
+        if self.fail == "timeout":
+            raise OSError(110)
+        i = self.out.find(b"\n") + 1 or len(self.out)
+        l, self.out = self.out[:i], self.out[i:]
+        return l
+
+    def read(self, n=-1):
+        n = len(self.out) if n < 0 else n
+        d, self.out = self.out[:n], self.out[n:]
+        return d
+
+    def close(self):
+        pass
+
+
+class AsyncConnection(Connection):
+
+    async def drain(self):
+        pass
+
+    async def readline(self):
+        if self.fail == "timeout":
+            import uasyncio
+            await uasyncio.sleep_ms(10000)
+        return Connection.readline(self)
+
+    async def read(self, n=-1):
+        return Connection.read(self, n)
+
+    async def wait_closed(self):
+        pass
+
+
+class Sync(unittest.TestCase):
+
+    def setUp(self):
+        install()
+        from emulator import clock
+        clock.reset()
+        self.client = firmware_module("httpclient").HTTPClient("http://auth.example/auth.php", timeout=1)
+        self.connections = []
+
+    def kept(self, fail):
+        #a connection of an earlier request, then fresh ones that work
+        self.client.sock = first = Connection(fail)
+        self.client.last_used = time.ticks_ms()
+        self.client.connect = self.connect
+        self.connections.append(first)
+        return first
+
+    def connect(self):
+        if self.client.sock is not None:
+            return False
+        self.client.sock = Connection()
+        self.connections.append(self.client.sock)
+        return True
+
+    def requests(self):
+        return [c.requests for c in self.connections]
+
+    def test_stale_sent_again(self):
+        for fail in ("send", "closed"):
+            self.connections = []
+            self.kept(fail)
+            self.assertEqual(self.client.post("{}").status_code, 200)
+            self.assertEqual(self.client.reconnects, 1)
+            self.client.reconnects = 0
+            self.assertEqual(self.requests(), [0 if fail == "send" else 1, 1])
+
+    def test_processed_not_sent_again(self):
+        #the request went out, the answer did not come: no second stage2/sess2
+        for fail in ("reset", "timeout"):
+            self.connections = []
+            self.kept(fail)
+            with self.assertRaises(OSError):
+                self.client.post("{}")
+            self.assertEqual(self.requests(), [1])
+            self.assertEqual(self.client.reconnects, 0)
+            self.assertIsNone(self.client.sock)
+
+    def test_new_connection_not_sent_again(self):
+        self.client.connect = lambda: True
+        self.client.sock = Connection("closed")
+        self.client.last_used = time.ticks_ms()
+        with self.assertRaises(OSError):
+            self.client.post("{}")
+        self.assertEqual(self.client.reconnects, 0)
+
+
+class Async(unittest.TestCase):
+
+    def setUp(self):
+        install()
+        from emulator import clock
+        clock.reset()
+        self.client = firmware_module("httpclient").AsyncHTTPClient("http://auth.example/auth.php", timeout=1)
+        self.connections = []
+
+    def post(self, fail):
+        import uasyncio
+        self.client.reader = self.client.writer = first = AsyncConnection(fail)
+        self.client.last_used = time.ticks_ms()
+        self.connections.append(first)
+
+        async def connect():
+            if self.client.writer is not None:
+                return False
+            self.client.reader = self.client.writer = AsyncConnection()
+            self.connections.append(self.client.writer)
+            return True
+
+        self.client.connect = connect
+
+        async def post():
+            return await self.client.post("{}")
+        return uasyncio.run(post())
+
+    def test_stale_sent_again(self):
+        for fail in ("send", "closed"):
+            self.connections = []
+            self.assertEqual(self.post(fail).status_code, 200)
+            self.assertEqual(len(self.connections), 2)
+
+    def test_processed_not_sent_again(self):
+        #asyncio.TimeoutError is an OSError on CPython, still no second request
+        for fail, error in (("reset", OSError), ("timeout", Exception)):
+            self.connections = []
+            with self.assertRaises(error):
+                self.post(fail)
+            self.assertEqual([c.requests for c in self.connections], [1])
+            self.assertIsNone(self.client.writer)
+
+
+if __name__ == "__main__":
+    unittest.main()
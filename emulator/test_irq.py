@@ -0,0 +1,37 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# Card detection on the IRQ pin of the MFRC522 (pin_nfc_irq) instead of polling.
+
+import unittest
+
+from emulator.__main__ import play
+
+
+class Scenarios(unittest.TestCase):
+
+    def test_tap(self):
+        play("tap", pin_nfc_irq=25)
+        import machine
+        self.assertIsNotNone(machine._pins[25].handler)
+
+    def test_tap_async(self):
+        play("tap", pin_nfc_irq=25, useAsyncio=True)
+
+    def test_tap_stages(self):
+        play("tap", pin_nfc_irq=25, useSessionProtocol=False)
+
+    def test_bench(self):
+        #every tap is seen while the reader waits for the interrupt
+        play("bench", pin_nfc_irq=25)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,38 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# Low-power idle (useLowPower): the MFRC522 powered down and the ESP32 in light sleep between the
+# detection windows, the taps still get through.
+
+import unittest
+
+from emulator.__main__ import play
+
+
+class Scenarios(unittest.TestCase):
+
+    def test_tap(self):
+        play("tap", useLowPower=True)
+        import machine
+        self.assertGreater(machine.sleeps[0], 0, "no light sleep")
+
+    def test_tap_stages(self):
+        play("tap", useLowPower=True, useSessionProtocol=False)
+
+    def test_pin(self):
+        #a key press wakes the ESP32
+        play("pin", useLowPower=True)
+
+    def test_bench(self):
+        play("bench", useLowPower=True)
+
+
+if __name__ == "__main__":
+    unittest.main()
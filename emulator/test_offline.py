@@ -0,0 +1,155 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# Offline grants: GrantCache of ESP32/offline.py on its own, and the offline and reboot scenarios of
+# python -m emulator, where the tag gets in with its grant while the server is down.
+
+import os
+import tempfile
+import unittest
+
+from emulator import firmware_module, install
+from emulator.__main__ import play
+
+KEY = b"emulator"
+
+
+class GrantCache(unittest.TestCase):
+
+    def setUp(self):
+        install()
+        from emulator import clock
+        self.clock = clock
+        clock.reset()
+        self.offline = firmware_module("offline")
+        self.path = os.path.join(tempfile.mkdtemp(prefix="nfc-flash-"), "grants.json")
+        self.server_now = clock.wall()
+
+    def grant(self, uid="0acd3f15", dev="frontdoor", ttl=3600):
+        g = {"uid": uid, "dev": dev, "exp": self.server_now + ttl, "blk": 13, "rkey": "7846ef811678",
+             "wkey": "e74c1e42ca40", "txt": "485af3cdd3b16ea1", "otxt": "c93d34561210b18e"}
+        g["sig"] = self.offline.signature(KEY, g)
+        return g
+
+    def cache(self, size=16):
+        return self.offline.GrantCache(self.path, KEY, "frontdoor", size)
+
+    def test_put_get(self):
+        c = self.cache()
+        self.assertIsNone(c.now())
+        self.assertTrue(c.put(self.grant(), self.server_now))
+        self.assertEqual(c.get("0acd3f15")["otxt"], "c93d34561210b18e")
+        self.assertIsNone(c.get("01020304"))
+
+    def test_rejected(self):
+        c = self.cache()
+        self.assertFalse(c.put(self.grant(dev="backdoor"), self.server_now))
+        g = self.grant()
+        g["exp"] += 1
+        self.assertFalse(c.put(g, self.server_now))
+        self.assertEqual(c.grants, {})
+
+    def test_expired(self):
+        c = self.cache()
+        c.put(self.grant(ttl=10), self.server_now)
+        self.clock.advance(11000)
+        self.assertIsNone(c.get("0acd3f15"))
+
+    def test_server_time_behind(self):
+        #the reader clock is off from the server: grants go by server time
+        c = self.cache()
+        c.put(self.grant(ttl=10), self.server_now + 3600)
+        self.assertIsNone(c.get("0acd3f15"))
+
+    def test_least_recently_used_dropped(self):
+        c = self.cache(size=2)
+        for uid in ("01", "02"):
+            c.put(self.grant(uid), self.server_now)
+        c.get("01")
+        c.put(self.grant("03"), self.server_now)
+        self.assertEqual(sorted(c.grants), ["01", "03"])
+
+    def test_watchdog_reset(self):
+        #the RTC goes on: after the reset the grants work before the server answered once
+        self.cache().put(self.grant(), self.server_now)
+        self.clock.advance(60000)
+        c = self.cache()
+        self.assertEqual(c.now(), self.server_now + 60)
+        self.assertIsNotNone(c.get("0acd3f15"))
+
+    def test_power_cycle(self):
+        #the RTC starts over at 0: the server time goes on from the last save, time since the boot added
+        self.cache().put(self.grant(ttl=100), self.server_now)
+        self.clock.advance(30000)
+        self.clock.rtc_s = -self.clock.wall()
+        c = self.cache()
+        self.assertEqual(c.now(), self.server_now)
+        self.assertIsNotNone(c.get("0acd3f15"))
+        self.clock.advance(101000)
+        self.assertIsNone(c.get("0acd3f15"))
+
+    def test_power_cycle_counts_saves(self):
+        #a later save (an offline tap) moves the time the reader knows has passed
+        c = self.cache()
+        c.put(self.grant("01", ttl=100), self.server_now)
+        c.put(self.grant("02", ttl=300), self.server_now)
+        self.clock.advance(200000)
+        c.use("02")
+        self.clock.rtc_s = -self.clock.wall()
+        c = self.cache()
+        self.assertEqual(c.now(), self.server_now + 200)
+        self.assertIsNone(c.get("01"))
+
+    def test_pending(self):
+        c = self.cache()
+        c.put(self.grant(), self.server_now)
+        c.use("0acd3f15")
+        self.assertIsNone(c.get("0acd3f15"))
+        c = self.cache()
+        self.assertEqual(c.pending(), [("0acd3f15", "c93d34561210b18e")])
+        c.reported("0acd3f15")
+        self.assertEqual(self.cache().pending(), [])
+
+    def test_old_file(self):
+        #grants.json of a firmware without the server time in it: kept, usable after the next answer
+        with open(self.path, "w") as f:
+            f.write('{"grants": {}, "order": [], "unreported": {"01": "c93d34561210b18e"}}')
+        c = self.cache()
+        self.assertIsNone(c.now())
+        self.assertEqual(c.pending(), [("01", "c93d34561210b18e")])
+
+
+class Scenarios(unittest.TestCase):
+
+    def test_offline(self):
+        play("offline")
+
+    def test_offline_async(self):
+        play("offline", useAsyncio=True)
+
+    def test_offline_stages(self):
+        play("offline", useSessionProtocol=False)
+
+    def test_offline_keypad_always_scanned(self):
+        #the keypad timer runs all the time, the relay timer must not be the same hardware timer
+        play("offline", keypad_idle_ms=None)
+
+    def test_reboot(self):
+        play("reboot")
+
+    def test_reboot_async(self):
+        play("reboot", useAsyncio=True)
+
+    def test_reboot_stages(self):
+        play("reboot", useSessionProtocol=False)
+
+
+if __name__ == "__main__":
+    unittest.main()
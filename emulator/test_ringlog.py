@@ -0,0 +1,72 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# RingLog of ESP32/ringlog.py: the lines in the ring, before and after it went round.
+
+import unittest
+
+from emulator import firmware_module
+
+
+class RingLog(unittest.TestCase):
+
+    def setUp(self):
+        self.RingLog = firmware_module("ringlog").RingLog
+
+    def test_not_full(self):
+        log = self.RingLog(64)
+        log.write("one")
+        log.write(b"two")
+        self.assertEqual(log.lines(), ["one", "two"])
+
+    def test_wraparound(self):
+        #lines of different lengths in a ring that is no multiple of them: after every write the oldest
+        #line is a whole one, the latest lines are all there
+        for size in (32, 33, 47, 64):
+            log = self.RingLog(size)
+            written = []
+            for i in range(60):
+                line = "line %d %s" % (i, "x" * (i % 7))
+                log.write(line)
+                written.append(line)
+                lines = log.lines()
+                self.assertTrue(lines)
+                self.assertEqual(lines, written[len(written) - len(lines):], (size, i))
+                self.assertLessEqual(sum(len(l) + 1 for l in lines), size)
+
+    def test_cut_oldest_line(self):
+        #"abcdefgh" gets its start overwritten, what is left of it ("gh") is no line
+        log = self.RingLog(16)
+        log.write("abcdefgh")
+        log.write("1234")
+        log.write("56")
+        self.assertTrue(log.full)
+        self.assertEqual(log.lines(), ["1234", "56"])
+
+    def test_long_line(self):
+        log = self.RingLog(16)
+        log.write("short")
+        log.write("0123456789abcdefghij")
+        self.assertEqual(log.lines(), ["56789abcdefghij"])
+        log.write("next")
+        self.assertEqual(log.lines(), ["next"])
+
+    def test_clear(self):
+        log = self.RingLog(16)
+        for i in range(10):
+            log.write("line %d" % i)
+        log.clear()
+        self.assertEqual(log.lines(), [])
+        log.write("new")
+        self.assertEqual(log.lines(), ["new"])
+
+
+if __name__ == "__main__":
+    unittest.main()
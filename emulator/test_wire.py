@@ -0,0 +1,79 @@
+#---------------------------------------------------
+# NFC Door Access Control
+#---------------------------------------------------
+# Copyright (c) 2020 devBioS
+# With enough persistence everything is possible
+# https://github.com/devBioS/NFC_Access_Control
+#
+# Licensed under the MIT License
+#---------------------------------------------------
+#
+# The CBOR subset of ESP32/wire.py on its own, and taps with useBinaryWire against an auth server
+# with and without cbor.php.
+
+import unittest
+
+from emulator import firmware_module
+from emulator.__main__ import check, play, setup
+
+
+class Wire(unittest.TestCase):
+
+    def setUp(self):
+        self.wire = firmware_module("wire")
+
+    def test_rfc8949_examples(self):
+        #appendix A of RFC 8949
+        for v, hexed in ((0, "00"), (23, "17"), (24, "1818"), (1000, "1903e8"), (1000000, "1a000f4240"),
+                         (1000000000000, "1b000000e8d4a51000"), (-1, "20"), (-1000, "3903e7"),
+                         (False, "f4"), (True, "f5"), (None, "f6"), ("", "60"), ("IETF", "6449455446"),
+                         (b"\x01\x02\x03\x04", "4401020304"), ([1, [2, 3]], "8201820203"),
+                         ({"a": 1, "b": [2, 3]}, "a26161016162820203")):
+            self.assertEqual(self.wire.dumps(v).hex(), hexed, v)
+            self.assertEqual(self.wire.loads(bytes.fromhex(hexed)), v, hexed)
+
+    def test_round_trip(self):
+        answer = {"status": "ok", "blk": 13, "key": bytes(range(6)), "data": bytes(16), "uids": ["0acd3f15"],
+                  "big": 1 << 40, "neg": -300, "none": None, "ack": True}
+        self.assertEqual(self.wire.loads(self.wire.dumps(answer)), answer)
+
+    def test_cut_item(self):
+        #a streamed answer: every prefix of an item is EOFError, the bytes after it are the next item
+        buf = self.wire.dumps({"status": "ok", "key": bytes(6), "n": 70000}) + self.wire.dumps([1])
+        first = len(buf) - 2
+        for n in range(first):
+            with self.assertRaises(EOFError):
+                self.wire.decode(buf[:n])
+        self.assertEqual(self.wire.decode(buf)[1], first)
+        self.assertEqual(self.wire.decode(buf, first), ([1], len(buf)))
+
+    def test_not_in_subset(self):
+        with self.assertRaises(ValueError):
+            self.wire.loads(b"\xf9\x3c\x00")    #half float
+        with self.assertRaises(TypeError):
+            self.wire.dumps(1.5)
+
+    def test_is_cbor(self):
+        self.assertTrue(self.wire.is_cbor(self.wire.dumps({"status": "ok"})))
+        self.assertFalse(self.wire.is_cbor(b'{"status": "ok"}'))
+        self.assertFalse(self.wire.is_cbor(b""))
+        self.assertFalse(self.wire.is_cbor(b"<html>"))
+
+
+class Scenarios(unittest.TestCase):
+
+    def test_tap_binary_wire(self):
+        w = play("tap", useBinaryWire=True)
+        self.assertTrue(w.g["wire_cbor"])
+
+    def test_tap_json_only_server(self):
+        #an auth.php without cbor.php: the reader falls back to JSON and the taps still work
+        w, card, until = setup("tap", {"debugmode": False, "useBinaryWire": True})
+        w.net.cbor = False
+        w.run(until)
+        check("tap", w, card)
+        self.assertFalse(w.g["wire_cbor"])
+
+
+if __name__ == "__main__":
+    unittest.main()